@@ -0,0 +1,408 @@
+import argparse
+import concurrent.futures
+import contextlib
+import functools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import re
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows 上没有 resource 模块, 不统计峰值内存
+    resource = None
+
+import jpgextract
+import multiextract
+import pngextract
+import webpextract
+from ddsextract import DDSProcessor
+from scanio import open_mapped
+from validation import DEFAULT_LEVEL, LEVELS
+
+# ---------- 合成样本 ----------
+
+def png_chunk(chunk_type: bytes, payload: bytes) -> bytes:
+    return (struct.pack('>I', len(payload)) + chunk_type + payload +
+            struct.pack('>I', zlib.crc32(chunk_type + payload)))
+
+def make_png(rng: random.Random) -> bytes:
+    width, height = rng.randint(1, 64), rng.randint(1, 64)
+    raw = b''.join(b'\x00' + rng.randbytes(width * 3) for _ in range(height))
+    chunks = [png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))]
+    if rng.random() < 0.3:
+        # 文本块里藏一段 IEND 字节序列, 检验是否会被提前截断
+        chunks.append(png_chunk(b'tEXt', b'Comment\x00' + png_chunk(b'IEND', b'')))
+    chunks.append(png_chunk(b'IDAT', zlib.compress(raw)))
+    chunks.append(png_chunk(b'IEND', b''))
+    return b'\x89PNG\r\n\x1a\n' + b''.join(chunks)
+
+def jpeg_segment(marker: int, payload: bytes) -> bytes:
+    return bytes([0xFF, marker]) + struct.pack('>H', len(payload) + 2) + payload
+
+def make_entropy_data(rng: random.Random, size: int) -> bytes:
+    # 随机熵编码数据: 所有 FF 后补 00, 并穿插 RSTn 标记
+    out = bytearray()
+    rst = 0
+    for byte in rng.randbytes(size):
+        out.append(byte)
+        if byte == 0xFF:
+            out.append(0x00)
+        if rng.random() < 0.002:
+            out += bytes([0xFF, 0xD0 + rst])
+            rst = (rst + 1) % 8
+    return bytes(out)
+
+def make_jpeg_core(rng: random.Random, entropy_size: int) -> bytes:
+    width, height = rng.randint(8, 512), rng.randint(8, 512)
+    return (jpeg_segment(0xDB, b'\x00' + rng.randbytes(64)) +
+            jpeg_segment(0xC0, struct.pack('>BHHB', 8, height, width, 1) + b'\x01\x11\x00') +
+            jpeg_segment(0xC4, b'\x00' + bytes(16)) +
+            jpeg_segment(0xDA, b'\x01\x01\x00\x00\x3f\x00') +
+            make_entropy_data(rng, entropy_size) + b'\xFF\xD9')
+
+def make_jpeg(rng: random.Random) -> bytes:
+    kind = rng.choice(['jfif', 'exif', 'plain'])
+    if kind == 'jfif':
+        app = jpeg_segment(0xE0, b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00')
+    elif kind == 'exif':
+        # Exif 中嵌入带 EOI 的缩略图
+        thumbnail = b'\xFF\xD8' + make_jpeg_core(rng, 64)
+        app = jpeg_segment(0xE1, b'Exif\x00\x00' + thumbnail)
+    else:
+        app = jpeg_segment(0xEE, b'Adobe\x00' + rng.randbytes(6))
+    return b'\xFF\xD8' + app + make_jpeg_core(rng, rng.randint(256, 32768))
+
+# (FourCC 或 DXGI 格式, 每块字节数, 块边长) ; 块边长为 1 表示非压缩格式按像素计算
+DDS_LEGACY_FORMATS = [(b'DXT1', 8, 4), (b'DXT5', 16, 4), (b'ATI2', 16, 4)]
+DDS_DX10_FORMATS = [(71, 8, 4), (77, 16, 4), (98, 16, 4), (28, 4, 1), (10, 8, 1)]
+
+def dds_mip_size(width: int, height: int, unit_size: int, block: int) -> int:
+    return max(1, (width + block - 1) // block) * max(1, (height + block - 1) // block) * unit_size
+
+def make_dds(rng: random.Random) -> bytes:
+    width = 1 << rng.randint(2, 9)
+    height = 1 << rng.randint(2, 9)
+    mip_count = rng.randint(1, max(width, height).bit_length())
+    dx10 = rng.random() < 0.5
+    if dx10:
+        fmt, unit_size, block = rng.choice(DDS_DX10_FORMATS)
+        fourcc = b'DX10'
+    else:
+        fourcc, unit_size, block = rng.choice(DDS_LEGACY_FORMATS)
+
+    sizes = []
+    w, h = width, height
+    for _ in range(mip_count):
+        sizes.append(dds_mip_size(w, h, unit_size, block))
+        w, h = max(1, w // 2), max(1, h // 2)
+
+    flags = 0x1007 | (0x20000 if mip_count > 1 else 0)
+    if block == 4:
+        flags |= 0x80000  # DDSD_LINEARSIZE: 顶层 mip 的字节数
+        pitch = sizes[0]
+    else:
+        flags |= 0x8  # DDSD_PITCH
+        pitch = width * unit_size
+
+    header = struct.pack('<4sIIIIIII', b'DDS ', 124, flags, height, width, pitch, 0, mip_count)
+    header += bytes(44)
+    header += struct.pack('<II4sIIIII', 32, 0x4, fourcc, 0, 0, 0, 0, 0)
+    header += struct.pack('<IIIII', 0x1000 | (0x400008 if mip_count > 1 else 0), 0, 0, 0, 0)
+    if dx10:
+        header += struct.pack('<IIIII', fmt, 3, 0, 1, 0)
+    return header + rng.randbytes(sum(sizes))
+
+def make_webp(rng: random.Random) -> bytes:
+    kind = rng.choice(['VP8L', 'VP8 ', 'VP8X'])
+    width, height = rng.randint(1, 1024), rng.randint(1, 1024)
+
+    def chunk(fourcc: bytes, payload: bytes) -> bytes:
+        return fourcc + struct.pack('<I', len(payload)) + payload + (b'\x00' if len(payload) & 1 else b'')
+
+    vp8l = chunk(b'VP8L', b'\x2f' + struct.pack('<I', (width - 1) | ((height - 1) << 14)) +
+                 rng.randbytes(rng.randint(16, 4096)))
+    if kind == 'VP8L':
+        body = vp8l
+    elif kind == 'VP8 ':
+        body = chunk(b'VP8 ', b'\x10\x02\x00\x9d\x01\x2a' + struct.pack('<HH', width, height) +
+                     rng.randbytes(rng.randint(16, 4096)))
+    else:
+        body = (chunk(b'VP8X', struct.pack('<I', 0x10) + (width - 1).to_bytes(3, 'little') +
+                      (height - 1).to_bytes(3, 'little')) +
+                chunk(b'ALPH', rng.randbytes(rng.randint(8, 512))) + vp8l)
+    payload = b'WEBP' + body
+    return b'RIFF' + struct.pack('<I', len(payload)) + payload
+
+GENERATORS = {
+    'png': make_png,
+    'jpg': make_jpeg,
+    'dds': make_dds,
+    'webp': make_webp,
+}
+
+def make_adversarial_filler(rng: random.Random, size: int) -> bytes:
+    # 随机数据中密集插入各种假签名
+    out = bytearray(rng.randbytes(size))
+    fakes = [
+        lambda: b'DDS ' + rng.randbytes(8),
+        lambda: b'DDS |\x00\x00\x00' + rng.randbytes(16),
+        lambda: b'RIFF' + struct.pack('<I', rng.randint(8, 64)) + b'WEBPVP8' + rng.choice(b' LX').to_bytes(1, 'little'),
+        lambda: b'\xFF\xD9',
+        lambda: b'\xFF\xD8\xFF' + rng.randbytes(4),
+        lambda: b'\x89PNG\r\n\x1a\n' + rng.randbytes(8),
+    ]
+    pos = rng.randint(0, 64)
+    while pos < size:
+        fake = rng.choice(fakes)()
+        out[pos:pos + len(fake)] = fake
+        pos += len(fake) + rng.randint(16, 128)
+    return bytes(out[:size])
+
+def generate_corpus(path: str, size: int, seed: int = 1, adversarial: bool = True,
+                    alignment: int = 0) -> List[Dict]:
+    # 生成确定性的合成容器文件, 返回每个嵌入图像的真实 (格式, 偏移, 长度).
+    # alignment 非 0 时每个图像都从其整数倍的偏移开始, 模拟文件系统镜像
+    rng = random.Random(seed)
+    truth = []
+    written = 0
+    with open(path, 'wb') as f:
+        while written < size:
+            filler_size = rng.randint(0, 4096)
+            if alignment:
+                filler_size += -(written + filler_size) % alignment
+            if adversarial:
+                filler = make_adversarial_filler(rng, filler_size)
+            else:
+                filler = rng.randbytes(filler_size)
+            f.write(filler)
+            written += len(filler)
+
+            fmt = rng.choice(list(GENERATORS))
+            image = GENERATORS[fmt](rng)
+            truth.append({'format': fmt, 'offset': written, 'length': len(image)})
+            f.write(image)
+            written += len(image)
+
+        # 末尾留一段填充, 避免最后一个图像紧贴文件结尾
+        tail = rng.randbytes(64)
+        f.write(tail)
+    return truth
+
+# ---------- 运行基准 ----------
+
+def peak_rss_kb() -> Optional[int]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 上单位是字节, Linux 上是 KB
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def run_scan(corpus_path: str, formats: List[str],
+             level: str = DEFAULT_LEVEL) -> Tuple[float, List[Tuple[str, int, int]], Optional[int]]:
+    signatures = multiextract.compile_signatures(formats)
+    start = time.perf_counter()
+    with open_mapped(corpus_path) as data:
+        hits = [(hit.format, hit.offset, hit.length)
+                for hit in multiextract.scan_hits(data, signatures=signatures, level=level)]
+    return time.perf_counter() - start, hits, peak_rss_kb()
+
+def run_extract(corpus_path: str, formats: List[str],
+                level: str = DEFAULT_LEVEL) -> Tuple[float, List[Tuple[str, int, int]], Optional[int]]:
+    output_dir = tempfile.mkdtemp(prefix='bench_out_')
+    try:
+        # 逐个文件的提取日志会淹没结果, 测量时丢弃
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            options = multiextract.ExtractOptions(validation=level)
+            written = multiextract.extract_all_from_file(corpus_path, output_dir, options).written
+            elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return elapsed, [(hit.format, hit.offset, hit.length) for hit in written], peak_rss_kb()
+
+def run_image(corpus_path: str, formats: List[str], level: str = DEFAULT_LEVEL,
+              alignment: int = 0) -> Tuple[float, List[Tuple[str, int, int]], Optional[int]]:
+    signatures = multiextract.compile_signatures(formats)
+    options = multiextract.ExtractOptions(validation=level)
+    start = time.perf_counter()
+    with open(corpus_path, 'rb', buffering=0) as image_file:
+        size = multiextract.image_size(image_file)
+        hits = [(hit.format, hit.offset, hit.length)
+                for hit in multiextract.carve_image(image_file, size, corpus_path, options, alignment, signatures)]
+    return time.perf_counter() - start, hits, peak_rss_kb()
+
+def extract_with_script(fmt: str, corpus_path: str, output_dir: str) -> None:
+    # 各格式独立脚本的单文件入口, 使用各自的默认校验
+    if fmt == 'png':
+        pngextract.extract_content(corpus_path, output_dir)
+    elif fmt == 'jpg':
+        jpgextract.extract_jpgs_from_file(corpus_path, b'\xFF\xD8\xFF', output_dir)
+    elif fmt == 'webp':
+        webpextract.extract_webps_from_file(corpus_path, output_dir)
+    else:
+        DDSProcessor().extract_from_file(corpus_path, output_dir)
+
+OUTPUT_NAME = re.compile(r'@(\d+)\.(\w+)$')
+
+def run_script(corpus_path: str, formats: List[str],
+               level: str = DEFAULT_LEVEL) -> Tuple[float, List[Tuple[str, int, int]], Optional[int]]:
+    # 脚本不返回命中列表, 从输出文件名 (<来源>@<偏移>.<格式>) 和文件大小还原
+    output_dir = tempfile.mkdtemp(prefix='bench_out_')
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            extract_with_script(formats[0], corpus_path, output_dir)
+            elapsed = time.perf_counter() - start
+        hits = []
+        for name in os.listdir(output_dir):
+            match = OUTPUT_NAME.search(name)
+            if match:
+                hits.append((match.group(2), int(match.group(1)), os.path.getsize(os.path.join(output_dir, name))))
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return elapsed, hits, peak_rss_kb()
+
+RUNNERS = {
+    'scan': run_scan,
+    'extract': run_extract,
+    'image': run_image,
+    'script': run_script,
+}
+RUNNERS.update({f"image-{size}": functools.partial(run_image, alignment=size) for size in multiextract.SECTOR_SIZES})
+
+def score(hits: List[Tuple[str, int, int]], truth: List[Dict], formats: List[str]) -> Dict:
+    expected = {(item['format'], item['offset'], item['length']) for item in truth if item['format'] in formats}
+    expected_offsets = {(fmt, offset) for fmt, offset, _ in expected}
+    found = set(hits)
+    exact = len(found & expected)
+    offsets = len({(fmt, offset) for fmt, offset, _ in found} & expected_offsets)
+    return {
+        'expected': len(expected),
+        'hits': len(hits),
+        'recall': exact / len(expected) if expected else 1.0,
+        'precision': exact / len(found) if found else 1.0,
+        'offset_recall': offsets / len(expected) if expected else 1.0,
+    }
+
+def run_benchmark(name: str, runner: str, corpus_path: str, truth: List[Dict],
+                  formats: List[str], repeat: int, level: str = DEFAULT_LEVEL) -> Dict:
+    # 每次运行都在新的子进程中进行, 峰值内存互不影响
+    context = multiprocessing.get_context('spawn')
+    corpus_size = os.path.getsize(corpus_path)
+    timings = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        baseline_rss = executor.submit(peak_rss_kb).result()
+    for _ in range(repeat):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            elapsed, hits, rss = executor.submit(RUNNERS[runner], corpus_path, formats, level).result()
+        timings.append(elapsed)
+
+    best = min(timings)
+    result = {
+        'name': name,
+        'runner': runner,
+        'formats': formats,
+        'validation': level,
+        'seconds': best,
+        'mb_per_s': corpus_size / (1024 * 1024) / best if best else 0.0,
+        'hits_per_s': len(hits) / best if best else 0.0,
+        'peak_rss_kb': rss,
+        'baseline_rss_kb': baseline_rss,
+    }
+    result.update(score(hits, truth, formats))
+    return result
+
+def compare(results: List[Dict], previous_path: str) -> None:
+    with open(previous_path, encoding='utf-8') as f:
+        previous = {item['name']: item for item in json.load(f)['results']}
+
+    print(f"\n与 {previous_path} 对比:")
+    for item in results:
+        old = previous.get(item['name'])
+        if old is None or not old['mb_per_s']:
+            continue
+        change = (item['mb_per_s'] / old['mb_per_s'] - 1) * 100
+        print(f"  {item['name']:<14} {old['mb_per_s']:8.1f} -> {item['mb_per_s']:8.1f} MB/s ({change:+.1f}%)"
+              f"  召回 {old['recall']:.3f} -> {item['recall']:.3f}"
+              f"  精确 {old['precision']:.3f} -> {item['precision']:.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="用确定性的合成样本测量各提取器的吞吐量与准确率")
+    parser.add_argument('--size-mb', type=int, default=64, help="合成样本大小 (MB)")
+    parser.add_argument('--seed', type=int, default=1, help="随机种子")
+    parser.add_argument('--plain', action='store_true', help="填充中不插入假签名")
+    parser.add_argument('--sector-align', type=int, choices=multiextract.SECTOR_SIZES, default=0, metavar='N',
+                        help="图像按 N 字节对齐存放, 并另外测量磁盘镜像模式及其扇区对齐快速路径")
+    parser.add_argument('--repeat', type=int, default=3, help="每项重复次数, 取最快一次")
+    parser.add_argument('--output', default='bench_results.json', help="结果 JSON 路径")
+    parser.add_argument('--compare', metavar='JSON', help="与之前保存的结果对比")
+    parser.add_argument('--keep', metavar='DIR', help="把合成样本及其真值保存到此目录")
+    args = parser.parse_args()
+
+    work_dir = args.keep or tempfile.mkdtemp(prefix='bench_')
+    os.makedirs(work_dir, exist_ok=True)
+    corpus_path = os.path.join(work_dir, f"corpus_{args.seed}.bin")
+
+    try:
+        print(f"生成合成样本: {corpus_path} ({args.size_mb} MB)")
+        truth = generate_corpus(corpus_path, args.size_mb * 1024 * 1024, args.seed, not args.plain,
+                                args.sector_align)
+        if args.keep:
+            with open(os.path.join(work_dir, f"corpus_{args.seed}.truth.json"), 'w', encoding='utf-8') as f:
+                json.dump(truth, f)
+
+        benchmarks = [('scan-all', 'scan', list(multiextract.HANDLERS), DEFAULT_LEVEL)]
+        benchmarks += [(f"scan-{fmt}", 'scan', [fmt], DEFAULT_LEVEL) for fmt in multiextract.HANDLERS]
+        # 其他校验级别: 吞吐量与精确率的取舍
+        benchmarks += [(f"scan-all-{level}", 'scan', list(multiextract.HANDLERS), level)
+                       for level in LEVELS if level != DEFAULT_LEVEL]
+        benchmarks.append(('extract-all', 'extract', list(multiextract.HANDLERS), DEFAULT_LEVEL))
+        # 各格式的独立脚本, 与上面共享的扫描核心对照
+        benchmarks += [(f"script-{fmt}", 'script', [fmt], DEFAULT_LEVEL) for fmt in multiextract.HANDLERS]
+        if args.sector_align:
+            benchmarks.append(('image-all', 'image', list(multiextract.HANDLERS), DEFAULT_LEVEL))
+            benchmarks.append(("image-aligned", f"image-{args.sector_align}", list(multiextract.HANDLERS),
+                               DEFAULT_LEVEL))
+
+        results = []
+        for name, runner, formats, level in benchmarks:
+            result = run_benchmark(name, runner, corpus_path, truth, formats, args.repeat, level)
+            results.append(result)
+            print(f"{name:<14} {result['mb_per_s']:8.1f} MB/s  {result['hits_per_s']:10.0f} 命中/秒  "
+                  f"召回 {result['recall']:.3f}  精确 {result['precision']:.3f}  "
+                  f"峰值内存 {result['peak_rss_kb']} KB")
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'seed': args.seed,
+            'size_mb': args.size_mb,
+            'adversarial': not args.plain,
+            'sector_align': args.sector_align,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\n结果保存在: {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
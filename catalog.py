@@ -0,0 +1,113 @@
+import argparse
+import csv
+import json
+import os
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from scanio import copy_range
+from sinks import output_name, output_stem
+from sources import MEMBER_SEPARATOR, STREAM_ERRORS, copy_member_range, open_member, split_label
+
+CSV_FIELDS = ['source', 'format', 'offset', 'length', 'width', 'height',
+              'mipmap_count', 'pixel_format', 'bit_depth', 'color_type']
+
+class CatalogWriter:
+    # 每个图像一条记录, 扩展名为 .csv 时写 CSV, 否则写 JSONL
+    def __init__(self, catalog_path: str):
+        self.catalog_path = catalog_path
+        self.is_csv = catalog_path.lower().endswith('.csv')
+        directory = os.path.dirname(os.path.abspath(catalog_path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(catalog_path, 'w', encoding='utf-8', newline='')
+        self._csv = None
+        if self.is_csv:
+            self._csv = csv.DictWriter(self._file, fieldnames=CSV_FIELDS, extrasaction='ignore')
+            self._csv.writeheader()
+        self.count = 0
+
+    def write(self, record: Dict) -> None:
+        if self._csv is not None:
+            self._csv.writerow(record)
+        else:
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.count += 1
+
+    def close(self) -> None:
+        self._file.close()
+
+def read_catalog(catalog_path: str) -> Iterator[Dict]:
+    with open(catalog_path, encoding='utf-8', newline='') as f:
+        if catalog_path.lower().endswith('.csv'):
+            for row in csv.DictReader(f):
+                row['offset'] = int(row['offset'])
+                row['length'] = int(row['length'])
+                yield row
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def extract_from_catalog(catalog_path: str, output_dir: str,
+                         formats: Optional[Iterable[str]] = None) -> int:
+    # 只按记录的偏移定位读取选中的字节区间, 同一源文件只打开一次
+    selected_formats = set(formats) if formats else None
+    by_source: Dict[str, List[Dict]] = {}
+    for record in read_catalog(catalog_path):
+        if selected_formats is None or record['format'] in selected_formats:
+            by_source.setdefault(record['source'], []).append(record)
+
+    extracted = 0
+    for source, records in by_source.items():
+        records.sort(key=lambda record: record['offset'])
+
+        try:
+            if not os.path.isfile(source) and MEMBER_SEPARATOR in source:
+                extracted += extract_member_records(source, records, output_dir)
+                continue
+
+            with open(source, 'rb') as in_file:
+                for record in records:
+                    with open(record_output_path(output_dir, output_stem(source), record), 'wb') as out_file:
+                        copy_range(in_file, out_file, record['offset'], record['length'])
+                    extracted += 1
+        except STREAM_ERRORS + (ValueError,) as e:
+            print(f"读取源文件 {source} 时出错: {str(e)}")
+
+    return extracted
+
+def record_output_path(output_dir: str, stem: str, record: Dict) -> str:
+    # 与 multiextract.py 直接提取时的输出名相同
+    output_path = os.path.join(output_dir, record['format'], output_name(stem, record['offset'], record['format']))
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    return output_path
+
+def extract_member_records(source: str, records: List[Dict], output_dir: str) -> int:
+    # 压缩包成员只能顺序读取: 记录已按偏移排序, 在同一个解压流上一路向前读
+    stem = output_stem(split_label(source)[0], source)
+    extracted = 0
+    with open_member(source) as stream:
+        position = 0
+        for record in records:
+            if record['offset'] < position:
+                # 与上一个图像重叠, 无法回退, 跳过
+                print(f"跳过重叠的记录: {source}@{record['offset']}")
+                continue
+            with open(record_output_path(output_dir, stem, record), 'wb') as out_file:
+                copy_member_range(stream, out_file, record['offset'] - position, record['length'])
+            position = record['offset'] + record['length']
+            extracted += 1
+    return extracted
+
+def main():
+    parser = argparse.ArgumentParser(description="根据目录清单 (JSONL/CSV) 提取选中的图像")
+    parser.add_argument('catalog', help="由 multiextract.py --catalog 生成的清单文件")
+    parser.add_argument('-o', '--output', required=True, help="输出目录")
+    parser.add_argument('-f', '--format', action='append', choices=['png', 'jpg', 'dds', 'webp'],
+                        help="只提取指定格式, 可重复")
+    args = parser.parse_args()
+
+    extracted = extract_from_catalog(args.catalog, args.output, args.format)
+    print(f"从清单中提取了 {extracted} 个图像, 保存在: {args.output}")
+
+if __name__ == "__main__":
+    main()
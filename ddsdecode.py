@@ -0,0 +1,219 @@
+import struct
+import zlib
+from typing import Optional
+
+try:
+    import numpy as np
+except ImportError:  # 没有 numpy 时不能解码, 转换为 PNG 的功能不可用
+    np = None
+
+from ddsextract import DDS_HEADER_SIZE, DDSHeader, dds_header_size, texture_layout
+
+# 块压缩格式 (含 TYPELESS/UNORM/UNORM_SRGB 或 SNORM)
+BC1_FORMATS = (70, 71, 72)
+BC2_FORMATS = (73, 74, 75)
+BC3_FORMATS = (76, 77, 78)
+BC4_FORMATS = (79, 80, 81)
+BC5_FORMATS = (82, 83, 84)
+SNORM_FORMATS = (81, 84)
+
+# 每像素 4 字节的非压缩格式: DXGI 格式 -> R/G/B/A 所在的字节 (None 表示没有该通道)
+RGBA8_FORMATS = {fmt: (0, 1, 2, 3) for fmt in (27, 28, 29)}
+RGBA8_FORMATS.update({fmt: (2, 1, 0, 3) for fmt in (87, 90, 91)})
+RGBA8_FORMATS.update({fmt: (2, 1, 0, None) for fmt in (88, 92, 93)})
+B5G6R5_FORMAT = 85
+
+DDPF_ALPHAPIXELS = 0x1
+DDPF_RGB = 0x40
+DDPF_LUMINANCE = 0x20000
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# 通道数 -> PNG 颜色类型: 灰度, 灰度+alpha, RGB, RGBA
+PNG_COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6}
+# 预览图以速度优先, 压缩等级低
+DEFAULT_PNG_LEVEL = 1
+
+def decoding_available() -> bool:
+    return np is not None
+
+if np is not None:
+    BC1_BLOCK = np.dtype([('c0', '<u2'), ('c1', '<u2'), ('indices', '<u4')])
+    # BC4 块: 两个 8 位端点与 16 个 3 位索引, 整块作为一个 64 位整数处理
+    BC4_BLOCK = np.dtype('<u8')
+    BC2_BLOCK = np.dtype([('alpha', '<u8'), ('color', BC1_BLOCK)])
+    BC3_BLOCK = np.dtype([('alpha', BC4_BLOCK), ('color', BC1_BLOCK)])
+    BC5_BLOCK = np.dtype([('red', BC4_BLOCK), ('green', BC4_BLOCK)])
+
+    # 块内 16 个像素的索引位移, 按行优先
+    SHIFTS_2BIT = np.arange(16, dtype=np.uint32) * 2
+    SHIFTS_3BIT = np.arange(16, dtype=np.uint64) * 3 + 16
+    SHIFTS_4BIT = np.arange(16, dtype=np.uint64) * 4
+
+def expand_565(values):
+    # (n,) 的 R5G6B5 -> (n, 3) 的 8 位 RGB, 高位复制到低位
+    values = values.astype(np.uint32)
+    r = (values >> 11) & 0x1F
+    g = (values >> 5) & 0x3F
+    b = values & 0x1F
+    return np.stack(((r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)), axis=-1)
+
+def pack_rgb(rgb, alpha):
+    # (n, 3) 的 RGB 与 alpha 打包为小端 32 位, 按字节看即为 R, G, B, A
+    return rgb[:, 0] | rgb[:, 1] << 8 | rgb[:, 2] << 16 | np.asarray(alpha, dtype=np.uint32) << 24
+
+def decode_bc1_colors(blocks, punch_through: bool):
+    # 所有块一起计算 4 色调色板, 每色打包为 32 位, 按 2 位索引一次取出整个像素; 返回 (n, 16, 4)
+    count = len(blocks)
+    c0, c1 = blocks['c0'], blocks['c1']
+    rgb0, rgb1 = expand_565(c0), expand_565(c1)
+    # c0 > c1 为 4 色模式; 否则第 3 色为中点, 第 4 色为黑色 (BC1 中为透明)
+    four_color = c0 > c1 if punch_through else np.ones(count, dtype=bool)
+    mask = four_color[:, None]
+
+    palette = np.empty((count, 4), dtype='<u4')
+    palette[:, 0] = pack_rgb(rgb0, 255)
+    palette[:, 1] = pack_rgb(rgb1, 255)
+    palette[:, 2] = pack_rgb(np.where(mask, (2 * rgb0 + rgb1 + 1) // 3, (rgb0 + rgb1) // 2), 255)
+    palette[:, 3] = pack_rgb(np.where(mask, (rgb0 + 2 * rgb1 + 1) // 3, 0), np.where(four_color, 255, 0))
+
+    indices = (blocks['indices'][:, None] >> SHIFTS_2BIT) & 3
+    pixels = np.take_along_axis(palette, indices.astype(np.intp), axis=1)
+    return pixels.view(np.uint8).reshape(count, 16, 4)
+
+def decode_bc4_values(blocks, signed: bool = False):
+    # 两个端点加 6 个插值 (或 4 个插值与最小/最大值) 组成 8 项调色板, 按 3 位索引取值; 返回 (n, 16)
+    e0 = (blocks & 0xFF).astype(np.int32)
+    e1 = ((blocks >> 8) & 0xFF).astype(np.int32)
+    low, high = 0, 255
+    if signed:
+        e0 = np.maximum((e0 ^ 0x80) - 0x80, -127)
+        e1 = np.maximum((e1 ^ 0x80) - 0x80, -127)
+        low, high = -127, 127
+
+    eight = (e0 > e1)[:, None]
+    e0, e1 = e0[:, None], e1[:, None]
+    steps = np.arange(1, 7, dtype=np.int32)
+    interpolated6 = np.empty((len(blocks), 6), dtype=np.int32)
+    interpolated6[:, :4] = ((5 - steps[:4]) * e0 + steps[:4] * e1 + 2) // 5
+    interpolated6[:, 4] = low
+    interpolated6[:, 5] = high
+    palette = np.concatenate((e0, e1, np.where(eight, ((7 - steps) * e0 + steps * e1 + 3) // 7, interpolated6)),
+                             axis=1)
+    if signed:
+        # -127..127 映射到 0..255
+        palette = ((palette + 127) * 255 + 127) // 254
+
+    indices = (blocks[:, None] >> SHIFTS_3BIT) & 7
+    return np.take_along_axis(palette.astype(np.uint8), indices.astype(np.intp), axis=1)
+
+def decode_blocks(data, offset: int, dxgi_format: int, width: int, height: int):
+    # 按 4x4 块解码整个 mip, 返回 (height, width, channels) 的 uint8 数组
+    blocks_wide, blocks_high = max(1, (width + 3) // 4), max(1, (height + 3) // 4)
+    count = blocks_wide * blocks_high
+    signed = dxgi_format in SNORM_FORMATS
+
+    if dxgi_format in BC1_FORMATS:
+        pixels = decode_bc1_colors(np.frombuffer(data, BC1_BLOCK, count, offset), True)
+    elif dxgi_format in BC2_FORMATS:
+        blocks = np.frombuffer(data, BC2_BLOCK, count, offset)
+        pixels = decode_bc1_colors(blocks['color'], False)
+        pixels[:, :, 3] = ((blocks['alpha'][:, None] >> SHIFTS_4BIT) & 0xF).astype(np.uint8) * 17
+    elif dxgi_format in BC3_FORMATS:
+        blocks = np.frombuffer(data, BC3_BLOCK, count, offset)
+        pixels = decode_bc1_colors(blocks['color'], False)
+        pixels[:, :, 3] = decode_bc4_values(blocks['alpha'])
+    elif dxgi_format in BC4_FORMATS:
+        pixels = decode_bc4_values(np.frombuffer(data, BC4_BLOCK, count, offset), signed)[:, :, None]
+    elif dxgi_format in BC5_FORMATS:
+        # 法线贴图: 只有 R/G 两个通道, B 取 0 (SNORM 时 0 映射为 128)
+        blocks = np.frombuffer(data, BC5_BLOCK, count, offset)
+        pixels = np.full((count, 16, 3), 128 if signed else 0, dtype=np.uint8)
+        pixels[:, :, 0] = decode_bc4_values(blocks['red'], signed)
+        pixels[:, :, 1] = decode_bc4_values(blocks['green'], signed)
+    else:
+        return None
+
+    # (块行, 块列, 像素行, 像素列) -> (行, 列), 再裁掉补齐到 4 的部分
+    channels = pixels.shape[-1]
+    image = pixels.reshape(blocks_high, blocks_wide, 4, 4, channels).transpose(0, 2, 1, 3, 4)
+    return image.reshape(blocks_high * 4, blocks_wide * 4, channels)[:height, :width]
+
+def decode_uncompressed(data, offset: int, dxgi_format: int, width: int, height: int):
+    if dxgi_format in RGBA8_FORMATS:
+        raw = np.frombuffer(data, np.uint8, width * height * 4, offset).reshape(height, width, 4)
+        return raw[:, :, [index for index in RGBA8_FORMATS[dxgi_format] if index is not None]]
+    if dxgi_format == B5G6R5_FORMAT:
+        values = np.frombuffer(data, '<u2', width * height, offset)
+        return expand_565(values).astype(np.uint8).reshape(height, width, 3)
+    return None
+
+def mask_channel(values, mask: int):
+    # 按掩码取出一个通道并缩放到 8 位
+    shift = (mask & -mask).bit_length() - 1
+    maximum = np.uint64(mask >> shift)
+    channel = (values.astype(np.uint64) & np.uint64(mask)) >> np.uint64(shift)
+    return ((channel * np.uint64(255) + maximum // np.uint64(2)) // maximum).astype(np.uint8)
+
+def decode_masked(data, offset: int, header: DDSHeader, width: int, height: int):
+    # 旧式非压缩格式: 按像素格式中的位掩码解出各通道
+    bytes_per_pixel = header.pf_bitcount // 8
+    if header.pf_bitcount % 8 or not 1 <= bytes_per_pixel <= 4:
+        return None
+    raw = np.frombuffer(data, np.uint8, width * height * bytes_per_pixel, offset)
+    raw = raw.reshape(-1, bytes_per_pixel).astype(np.uint32)
+    values = raw[:, 0]
+    for index in range(1, bytes_per_pixel):
+        values = values | raw[:, index] << np.uint32(8 * index)
+
+    if header.pf_flags & DDPF_RGB and header.pf_rmask and header.pf_gmask and header.pf_bmask:
+        masks = [header.pf_rmask, header.pf_gmask, header.pf_bmask]
+    elif header.pf_flags & DDPF_LUMINANCE and header.pf_rmask:
+        masks = [header.pf_rmask]
+    else:
+        return None
+    if header.pf_flags & DDPF_ALPHAPIXELS and header.pf_amask:
+        masks.append(header.pf_amask)
+    return np.stack([mask_channel(values, mask) for mask in masks], axis=-1).reshape(height, width, len(masks))
+
+def decode_dds(data, pos: int, header: Optional[DDSHeader] = None):
+    # 解码第一个面/数组元素的顶层 mip (体纹理取第一个切片), 不支持的格式返回 None
+    if np is None:
+        raise RuntimeError("解码 DDS 需要安装 numpy")
+    if header is None:
+        if pos + 4 + DDS_HEADER_SIZE > len(data):
+            return None
+        header = DDSHeader(data, pos)
+    layout = texture_layout(header.fields, header.dx10)
+    if layout is None:
+        return None
+
+    top = layout.levels[0]
+    offset = pos + dds_header_size(header)
+    if offset + top.size // top.depth > len(data):
+        return None
+    if layout.dxgi_format is None:
+        return decode_masked(data, offset, header, top.width, top.height)
+    image = decode_blocks(data, offset, layout.dxgi_format, top.width, top.height)
+    if image is None:
+        image = decode_uncompressed(data, offset, layout.dxgi_format, top.width, top.height)
+    return image
+
+def png_chunk(chunk_type: bytes, payload: bytes) -> bytes:
+    return (struct.pack('>I', len(payload)) + chunk_type + payload +
+            struct.pack('>I', zlib.crc32(payload, zlib.crc32(chunk_type))))
+
+def encode_png(image, level: int = DEFAULT_PNG_LEVEL) -> bytes:
+    # image 为 (height, width, channels) 的 uint8 数组; 每行使用 None 过滤器, 只依赖 zlib
+    height, width, channels = image.shape
+    rows = np.zeros((height, 1 + width * channels), dtype=np.uint8)
+    rows[:, 1:] = image.reshape(height, width * channels)
+    header = struct.pack('>IIBBBBB', width, height, 8, PNG_COLOR_TYPES[channels], 0, 0, 0)
+    return (PNG_SIGNATURE + png_chunk(b'IHDR', header) +
+            png_chunk(b'IDAT', zlib.compress(rows.data, level)) + png_chunk(b'IEND', b''))
+
+def dds_to_png(data, pos: int, header: Optional[DDSHeader] = None,
+               level: int = DEFAULT_PNG_LEVEL) -> Optional[bytes]:
+    image = decode_dds(data, pos, header)
+    if image is None:
+        return None
+    return encode_png(image, level)
@@ -1,8 +1,18 @@
 import os
+import re
 import struct
-from typing import List, Tuple, Optional
+from typing import Iterable, List, NamedTuple, Tuple, Optional
+
+import stats
+from dedup import DedupIndex, new_run_id
+from discovery import discover_files
+from parallel import run_files
+from scanio import FileRange, open_mapped, write_chunks
+from sinks import output_name, output_stem
+from validation import STRICT, STRUCTURAL
 
 DDS_MAGIC = 0x20534444  # "DDS "的四字符代码
+DDS_MAGIC_BYTES = struct.pack('<I', DDS_MAGIC)
 DDS_HEADER_SIZE = 124    # 标准DDS头大小（不含魔数）
 DX10_HEADER_SIZE = 20    # DX10扩展头大小
 
@@ -129,157 +139,533 @@ DXGI_FORMAT = {
     0xffffffff: "DXGI_FORMAT_FORCE_UINT"
 }
 
+# DDS_HEADER 各字段 (含魔数, 跳过 reserved1/reserved2), 每个候选只需一次 unpack
+DDS_HEADER_STRUCT = struct.Struct('<4s7I44x2I4s5I4I4x')
+# DDS_HEADER_DXT10: dxgiFormat, resourceDimension, miscFlag, arraySize, miscFlags2
+DX10_HEADER_STRUCT = struct.Struct('<5I')
+# 魔数后紧跟的头大小字段必须为 124, 作为候选的签名
+DDS_SIGNATURE = DDS_MAGIC_BYTES + struct.pack('<I', DDS_HEADER_SIZE)
+
+DDSD_PITCH = 0x8
+DDSD_MIPMAPCOUNT = 0x20000
+DDSD_LINEARSIZE = 0x80000
+DDSD_DEPTH = 0x800000
+DDSCAPS_COMPLEX = 0x8
+DDSCAPS_MIPMAP = 0x400000
+DDPF_FOURCC = 0x4
+# DDPF_ALPHA | DDPF_RGB | DDPF_YUV | DDPF_BUMPDUDV | DDPF_LUMINANCE
+DDPF_UNCOMPRESSED = 0x2 | 0x40 | 0x200 | 0x80000 | 0x20000
+DDSCAPS2_CUBEMAP = 0x200
+DDSCAPS2_CUBEMAP_ALL_FACES = 0xFC00
+DDSCAPS2_VOLUME = 0x200000
+D3D10_RESOURCE_DIMENSION_TEXTURE3D = 4
+# TEXTURE1D, TEXTURE2D, TEXTURE3D
+D3D10_RESOURCE_DIMENSIONS = (2, 3, 4)
+D3D11_RESOURCE_MISC_TEXTURECUBE = 0x4
+
+# 块压缩格式: 每个 4x4 块的字节数
+DXGI_BLOCK_BYTES = {fmt: 8 for fmt in (70, 71, 72, 79, 80, 81)}
+DXGI_BLOCK_BYTES.update({fmt: 16 for fmt in (73, 74, 75, 76, 77, 78, 82, 83, 84, 94, 95, 96, 97, 98, 99)})
+
+# 非压缩格式: 每像素的位数
+DXGI_BITS_PER_PIXEL = {fmt: 128 for fmt in range(1, 5)}
+DXGI_BITS_PER_PIXEL.update({fmt: 96 for fmt in range(5, 9)})
+DXGI_BITS_PER_PIXEL.update({fmt: 64 for fmt in range(9, 23)})
+DXGI_BITS_PER_PIXEL.update({fmt: 32 for fmt in range(23, 48)})
+DXGI_BITS_PER_PIXEL.update({fmt: 16 for fmt in range(48, 60)})
+DXGI_BITS_PER_PIXEL.update({fmt: 8 for fmt in range(60, 66)})
+DXGI_BITS_PER_PIXEL.update({
+    66: 1, 67: 32, 85: 16, 86: 16, 87: 32, 88: 32, 89: 32, 90: 32, 91: 32, 92: 32, 93: 32,
+    100: 32, 101: 32, 102: 64, 111: 8, 112: 8, 113: 8, 114: 16, 115: 16,
+})
+
+# 打包与平面 YUV 格式: (宽, 高) -> 每个切片的字节数
+DXGI_SURFACE_SIZES = {
+    68: lambda w, h: ((w + 1) >> 1) * 4 * h,                  # R8G8_B8G8
+    69: lambda w, h: ((w + 1) >> 1) * 4 * h,                  # G8R8_G8B8
+    103: lambda w, h: ((w + 1) >> 1) * 2 * (h + ((h + 1) >> 1)),  # NV12
+    104: lambda w, h: ((w + 1) >> 1) * 4 * (h + ((h + 1) >> 1)),  # P010
+    105: lambda w, h: ((w + 1) >> 1) * 4 * (h + ((h + 1) >> 1)),  # P016
+    106: lambda w, h: ((w + 1) >> 1) * 2 * (h + ((h + 1) >> 1)),  # 420_OPAQUE
+    107: lambda w, h: ((w + 1) >> 1) * 4 * h,                 # YUY2
+    108: lambda w, h: ((w + 1) >> 1) * 8 * h,                 # Y210
+    109: lambda w, h: ((w + 1) >> 1) * 8 * h,                 # Y216
+    110: lambda w, h: ((w + 3) >> 2) * 4 * h * 2,             # NV11
+    130: lambda w, h: ((w + 1) >> 1) * 2 * h * 2,             # P208
+    131: lambda w, h: w * (h + ((h + 1) >> 1) * 2),           # V208
+    132: lambda w, h: w * (h + (h >> 1) * 4),                 # V408
+}
+
+# 旧式 FourCC 映射到等价的 DXGI 格式
+FOURCC_TO_DXGI = {
+    b'DXT1': 71, b'DXT2': 74, b'DXT3': 74, b'DXT4': 77, b'DXT5': 77,
+    b'ATI1': 80, b'BC4U': 80, b'BC4S': 81, b'ATI2': 83, b'BC5U': 83, b'BC5S': 84,
+    b'RGBG': 68, b'GRGB': 69, b'YUY2': 107,
+    # FourCC 字段中的 D3DFMT 数值
+    struct.pack('<I', 36): 11,    # A16B16G16R16
+    struct.pack('<I', 110): 13,   # Q16W16V16U16
+    struct.pack('<I', 111): 54,   # R16F
+    struct.pack('<I', 112): 34,   # G16R16F
+    struct.pack('<I', 113): 10,   # A16B16G16R16F
+    struct.pack('<I', 114): 41,   # R32F
+    struct.pack('<I', 115): 16,   # G32R32F
+    struct.pack('<I', 116): 2,    # A32B32G32R32F
+}
+# UYVY 与 YUY2 大小相同, 但没有对应的 DXGI 格式名
+FOURCC_TO_DXGI[b'UYVY'] = 107
+
+def surface_size(dxgi_format: int, width: int, height: int) -> Optional[int]:
+    # 单个 mip 切片的字节数, 未知格式返回 None
+    block_bytes = DXGI_BLOCK_BYTES.get(dxgi_format)
+    if block_bytes is not None:
+        return max(1, (width + 3) // 4) * max(1, (height + 3) // 4) * block_bytes
+
+    bits = DXGI_BITS_PER_PIXEL.get(dxgi_format)
+    if bits is not None:
+        return (width * bits + 7) // 8 * height
+
+    layout = DXGI_SURFACE_SIZES.get(dxgi_format)
+    if layout is not None:
+        return layout(width, height)
+    return None
+
+def header_is_valid(fields: tuple) -> bool:
+    # fields 为 DDS_HEADER_STRUCT 解出的元组
+    return (fields[1] == DDS_HEADER_SIZE and
+            (fields[2] & 0x1007) != 0 and  # DDSD_CAPS | DDSD_HEIGHT | DDSD_WIDTH | DDSD_PIXELFORMAT
+            fields[3] > 0 and fields[4] > 0 and
+            fields[8] == 32)
+
+class MipLevel(NamedTuple):
+    width: int
+    height: int
+    depth: int
+    size: int  # 该级所有深度切片的字节数
+
+class TextureLayout(NamedTuple):
+    dxgi_format: Optional[int]  # None 表示旧式非压缩格式, 按 bitcount 计算
+    bitcount: int
+    layers: int                 # 立方体面数 x 数组大小
+    levels: List[MipLevel]
+
+class Subresource(NamedTuple):
+    layer: int
+    mip: int
+    offset: int  # 相对于 DDS 起点
+    length: int
+    width: int
+    height: int
+    depth: int
+
+def level_size(dxgi_format: Optional[int], bitcount: int, width: int, height: int) -> Optional[int]:
+    if dxgi_format is None:
+        return (width * bitcount + 7) // 8 * height
+    return surface_size(dxgi_format, width, height)
+
+def texture_layout(fields: tuple, dx10: Optional[tuple]) -> Optional[TextureLayout]:
+    # 按格式查表计算每个 mip 的尺寸与大小, 以及面/数组元素的数量; 无法确定时返回 None
+    (_, _, flags, height, width, _, depth, mipmap_count,
+     _, pf_flags, fourcc, pf_bitcount, _, _, _, _, _, caps2, _, _) = fields
+
+    if dx10 is not None:
+        dxgi_format, dimension, misc_flag, array_size, _ = dx10
+        if array_size == 0:
+            return None
+        layers = array_size * (6 if misc_flag & D3D11_RESOURCE_MISC_TEXTURECUBE else 1)
+        is_volume = dimension == D3D10_RESOURCE_DIMENSION_TEXTURE3D
+    else:
+        if pf_flags & DDPF_FOURCC:
+            dxgi_format = FOURCC_TO_DXGI.get(fourcc)
+            if dxgi_format is None:
+                return None
+        else:
+            # 非压缩的旧式格式, 按掩码描述的位数计算
+            if pf_bitcount == 0 or pf_bitcount > 128:
+                return None
+            dxgi_format = None
+        layers = 1
+        if caps2 & DDSCAPS2_CUBEMAP:
+            layers = bin(caps2 & DDSCAPS2_CUBEMAP_ALL_FACES).count('1') or 6
+        is_volume = bool(caps2 & DDSCAPS2_VOLUME and flags & DDSD_DEPTH)
+
+    depth = max(1, depth) if is_volume else 1
+    mip_count = max(1, mipmap_count)
+    if mip_count > max(width, height, depth).bit_length():
+        return None
+
+    levels = []
+    w, h, d = width, height, depth
+    for _ in range(mip_count):
+        size = level_size(dxgi_format, pf_bitcount, w, h)
+        if size is None:
+            return None
+        levels.append(MipLevel(w, h, d, size * d))
+        w, h, d = max(1, w // 2), max(1, h // 2), max(1, d // 2)
+
+    return TextureLayout(dxgi_format, pf_bitcount, layers, levels)
+
+def header_inconsistency(fields: tuple, dx10: Optional[tuple], layout: TextureLayout) -> Optional[str]:
+    # strict 级别: 检查头中冗余的字段与格式、尺寸是否一致, 返回拒绝原因
+    flags, pitch_or_linear_size, pf_flags = fields[2], fields[5], fields[9]
+    if dx10 is not None:
+        if dx10[1] not in D3D10_RESOURCE_DIMENSIONS:
+            return 'bad_dx10'
+    elif not pf_flags & (DDPF_FOURCC | DDPF_UNCOMPRESSED):
+        return 'bad_pixel_format'
+
+    # 许多工具把该字段写为 0, 只在给出数值时检查
+    if pitch_or_linear_size:
+        top = layout.levels[0]
+        if flags & DDSD_LINEARSIZE:
+            expected = top.size // top.depth
+        elif flags & DDSD_PITCH:
+            expected = level_size(layout.dxgi_format, layout.bitcount, top.width, 1)
+        else:
+            expected = pitch_or_linear_size
+        if pitch_or_linear_size != expected:
+            return 'pitch_mismatch'
+    return None
+
+def texture_data_size(fields: tuple, dx10: Optional[tuple]) -> Optional[int]:
+    layout = texture_layout(fields, dx10)
+    if layout is None:
+        return None
+    return layout.layers * sum(level.size for level in layout.levels)
+
+def dds_total_size(data, pos: int, fields: tuple, level: str = STRUCTURAL) -> int:
+    # 返回整个 DDS (含魔数与头) 的字节数, 不合法时返回 0 并记录拒绝原因.
+    # 长度只能由头和格式算出, fast 与 structural 相同; strict 另外检查头字段的一致性
+    if not header_is_valid(fields):
+        stats.reject('dds', 'header_invalid')
+        return 0
+
+    dx10 = None
+    header_end = pos + 4 + DDS_HEADER_SIZE
+    if fields[10] == b'DX10':
+        if header_end + DX10_HEADER_SIZE > len(data):
+            stats.reject('dds', 'truncated_header')
+            return 0
+        dx10 = DX10_HEADER_STRUCT.unpack_from(data, header_end)
+        header_end += DX10_HEADER_SIZE
+
+    layout = texture_layout(fields, dx10)
+    if layout is None:
+        stats.reject('dds', 'unknown_format')
+        return 0
+    if level == STRICT:
+        reason = header_inconsistency(fields, dx10, layout)
+        if reason is not None:
+            stats.reject('dds', reason)
+            return 0
+
+    total_size = header_end - pos + layout.layers * sum(mip.size for mip in layout.levels)
+    if pos + total_size > len(data):
+        stats.reject('dds', 'size_overrun')
+        return 0
+    return total_size
+
+def validate_dds_headers(data, offsets: Iterable[int], level: str = STRUCTURAL) -> List[Tuple[int, int]]:
+    # 批量校验候选偏移, 返回合法的 (偏移, 总大小)
+    valid = []
+    unpack_from = DDS_HEADER_STRUCT.unpack_from
+    end = len(data) - 4 - DDS_HEADER_SIZE
+    for pos in offsets:
+        if pos > end:
+            stats.reject('dds', 'truncated_header')
+            continue
+        total_size = dds_total_size(data, pos, unpack_from(data, pos), level)
+        if total_size:
+            valid.append((pos, total_size))
+    return valid
+
 class DDSHeader:
-    def __init__(self, data: bytes):
-        self.size = struct.unpack_from('<I', data, 4)[0]
-        self.flags = struct.unpack_from('<I', data, 8)[0]
-        self.height = struct.unpack_from('<I', data, 12)[0]
-        self.width = struct.unpack_from('<I', data, 16)[0]
-        self.pitch_or_linear_size = struct.unpack_from('<I', data, 20)[0]
-        self.depth = struct.unpack_from('<I', data, 24)[0]
-        self.mipmap_count = struct.unpack_from('<I', data, 28)[0]
-        self.reserved1 = struct.unpack_from('<11I', data, 32)
-
-        pf_offset = 76
-        self.pf_size = struct.unpack_from('<I', data, pf_offset)[0]
-        self.pf_flags = struct.unpack_from('<I', data, pf_offset + 4)[0]
-        self.pf_fourcc = struct.unpack_from('<4s', data, pf_offset + 8)[0].decode('ascii').strip('\x00')
-        self.pf_bitcount = struct.unpack_from('<I', data, pf_offset + 12)[0]
-        self.pf_rmask = struct.unpack_from('<I', data, pf_offset + 16)[0]
-        self.pf_gmask = struct.unpack_from('<I', data, pf_offset + 20)[0]
-        self.pf_bmask = struct.unpack_from('<I', data, pf_offset + 24)[0]
-        self.pf_amask = struct.unpack_from('<I', data, pf_offset + 28)[0]
-
-        caps_offset = 108
-        self.caps1 = struct.unpack_from('<I', data, caps_offset)[0]
-        self.caps2 = struct.unpack_from('<I', data, caps_offset + 4)[0]
-        self.caps3 = struct.unpack_from('<I', data, caps_offset + 8)[0]
-        self.caps4 = struct.unpack_from('<I', data, caps_offset + 12)[0]
-        self.reserved2 = struct.unpack_from('<I', data, caps_offset + 16)[0]
+    def __init__(self, data: bytes, offset: int = 0):
+        fields = DDS_HEADER_STRUCT.unpack_from(data, offset)
+        (_, self.size, self.flags, self.height, self.width, self.pitch_or_linear_size,
+         self.depth, self.mipmap_count, self.pf_size, self.pf_flags, fourcc,
+         self.pf_bitcount, self.pf_rmask, self.pf_gmask, self.pf_bmask, self.pf_amask,
+         self.caps1, self.caps2, self.caps3, self.caps4) = fields
+        self.fields = fields
+        self.pf_fourcc = fourcc.decode('ascii', 'replace').strip('\x00')
+
+        self.dx10 = None
+        dx10_offset = offset + 4 + DDS_HEADER_SIZE
+        if self.has_dx10_extension() and dx10_offset + DX10_HEADER_SIZE <= len(data):
+            self.dx10 = DX10_HEADER_STRUCT.unpack_from(data, dx10_offset)
 
     def is_valid(self) -> bool:
-        return (self.size == DDS_HEADER_SIZE and
-                (self.flags & 0x1007) != 0 and  # DDSD_CAPS | DDSD_HEIGHT | DDSD_WIDTH | DDSD_PIXELFORMAT
-                self.width > 0 and self.height > 0 and
-                self.pf_size == 32)
+        return header_is_valid(self.fields)
 
     def has_dx10_extension(self) -> bool:
         return self.pf_fourcc == 'DX10'
 
-    def get_dxgi_format(self, dx10_data: bytes) -> str:
+    def get_dxgi_format(self, dx10_data: bytes, offset: int = 0) -> str:
         if not self.has_dx10_extension():
             return self.pf_fourcc
         try:
-            dxgi_format = struct.unpack_from('<I', dx10_data, 0)[0]
+            dxgi_format = struct.unpack_from('<I', dx10_data, offset)[0]
             return DXGI_FORMAT.get(dxgi_format, f"UNKNOWN({dxgi_format})")
         except struct.error:
             return "UNKNOWN"
 
     def calculate_data_size(self) -> int:
-        if self.flags & 0x80000:  # DDSD_LINEARSIZE
-            return self.pitch_or_linear_size
-
-        if self.pf_fourcc in ['DXT1', 'BC1', 'ATI1']:
-            block_size = 8
-        elif self.pf_fourcc in ['DXT3', 'DXT5', 'BC2', 'BC3', 'ATI2']:
-            block_size = 16
-        elif self.pf_fourcc in ['BC4U', 'BC4S']:
-            block_size = 4
-        elif self.pf_fourcc in ['BC5U', 'BC5S']:
-            block_size = 8
+        data_size = texture_data_size(self.fields, self.dx10)
+        return data_size if data_size is not None else 0
+
+def measure_dds(data, dds_pos: int) -> Optional[Tuple[int, DDSHeader, str]]:
+    if dds_pos + 4 + DDS_HEADER_SIZE > len(data):
+        stats.reject('dds', 'truncated_header')
+        return None
+
+    total_size = dds_total_size(data, dds_pos, DDS_HEADER_STRUCT.unpack_from(data, dds_pos))
+    if not total_size:
+        return None
+
+    header = DDSHeader(data, dds_pos)
+    return total_size, header, header.get_dxgi_format(data, dds_pos + 128)
+
+def dds_length(data, pos: int, level: str = STRUCTURAL) -> int:
+    if pos + 4 + DDS_HEADER_SIZE > len(data):
+        stats.reject('dds', 'truncated_header')
+        return 0
+    return dds_total_size(data, pos, DDS_HEADER_STRUCT.unpack_from(data, pos), level)
+
+def dds_metadata(data, pos: int) -> dict:
+    result = measure_dds(data, pos)
+    if result is None:
+        return {}
+    _, header, format_str = result
+    return {
+        'width': header.width,
+        'height': header.height,
+        'mipmap_count': max(1, header.mipmap_count),
+        'pixel_format': format_str,
+    }
+
+class MipSelection(NamedTuple):
+    # max_levels: 从第一个保留的 mip 起最多保留几级 (1 表示只要顶层)
+    # max_dimension: 跳过宽或高超过此值的 mip, 最小一级总会保留
+    # first_layer: 只保留第一个立方体面/数组元素
+    max_levels: Optional[int] = None
+    max_dimension: Optional[int] = None
+    first_layer: bool = False
+
+def dds_header_size(header: DDSHeader) -> int:
+    return 4 + DDS_HEADER_SIZE + (DX10_HEADER_SIZE if header.has_dx10_extension() else 0)
+
+def dds_layout(header: DDSHeader, layout: TextureLayout) -> List[Subresource]:
+    # 每个面/数组元素、每个 mip 在 DDS 中的位置, 顺序与文件中的存放顺序一致
+    subresources = []
+    offset = dds_header_size(header)
+    for layer in range(layout.layers):
+        for mip, level in enumerate(layout.levels):
+            subresources.append(Subresource(layer, mip, offset, level.size,
+                                            level.width, level.height, level.depth))
+            offset += level.size
+    return subresources
+
+def select_dds(data, pos: int, selection: MipSelection) -> Optional[Tuple[bytes, List[Tuple[int, int]]]]:
+    # 返回重写后的头以及需要复制的 (绝对偏移, 长度) 区间; 无法解析时返回 None
+    header = DDSHeader(data, pos)
+    layout = texture_layout(header.fields, header.dx10)
+    if layout is None:
+        return None
+    levels = layout.levels
+
+    first = 0
+    if selection.max_dimension:
+        while (first < len(levels) - 1 and
+               max(levels[first].width, levels[first].height) > selection.max_dimension):
+            first += 1
+    last = len(levels)
+    if selection.max_levels:
+        last = min(last, first + selection.max_levels)
+    layers = 1 if selection.first_layer else layout.layers
+
+    # 保留的子资源中相邻的合并为一个区间
+    ranges = []
+    for subresource in dds_layout(header, layout):
+        if subresource.layer >= layers or not first <= subresource.mip < last:
+            continue
+        start = pos + subresource.offset
+        if ranges and sum(ranges[-1]) == start:
+            ranges[-1] = (ranges[-1][0], ranges[-1][1] + subresource.length)
         else:
-            block_size = max(1, (self.pf_bitcount + 7) // 8) * 4
-
-        total_size = 0
-        w, h = self.width, self.height
-        for _ in range(max(1, self.mipmap_count)):
-            block_w = max(1, (w + 3) // 4)
-            block_h = max(1, (h + 3) // 4)
-            total_size += block_w * block_h * block_size
-            w = max(1, w // 2)
-            h = max(1, h // 2)
-
-        return total_size
+            ranges.append((start, subresource.length))
+
+    header_size = dds_header_size(header)
+
+    top = levels[first]
+    new_header = bytearray(data[pos:pos + header_size])
+    flags = header.flags
+    mip_count = last - first
+    if mip_count > 1:
+        flags |= DDSD_MIPMAPCOUNT
+    else:
+        flags &= ~DDSD_MIPMAPCOUNT
+    if flags & DDSD_LINEARSIZE:
+        pitch = top.size // top.depth
+    elif flags & DDSD_PITCH:
+        pitch = level_size(layout.dxgi_format, layout.bitcount, top.width, 1)
+    else:
+        pitch = header.pitch_or_linear_size
+    struct.pack_into('<6I', new_header, 8, flags, top.height, top.width, pitch,
+                     top.depth if header.depth else 0, mip_count if header.mipmap_count else 0)
+
+    caps1 = header.caps1
+    caps2 = header.caps2
+    if mip_count == 1:
+        caps1 &= ~DDSCAPS_MIPMAP
+    if selection.first_layer:
+        caps2 &= ~(DDSCAPS2_CUBEMAP | DDSCAPS2_CUBEMAP_ALL_FACES)
+    if mip_count == 1 and not caps2 & (DDSCAPS2_CUBEMAP | DDSCAPS2_VOLUME):
+        caps1 &= ~DDSCAPS_COMPLEX
+    struct.pack_into('<2I', new_header, 108, caps1, caps2)
+
+    if header.dx10 is not None and selection.first_layer:
+        # 只保留一个面: 数组大小为 1, 不再是立方体贴图
+        _, _, misc_flag, _, _ = header.dx10
+        struct.pack_into('<2I', new_header, 4 + DDS_HEADER_SIZE + 8,
+                         misc_flag & ~D3D11_RESOURCE_MISC_TEXTURECUBE, 1)
+
+    return bytes(new_header), ranges
+
+def dds_chunks(data, pos: int, total_size: int, selection: Optional[MipSelection] = None,
+               source_fd: Optional[int] = None, base_offset: int = 0) -> List:
+    # 按选择组成输出内容: 重写后的头加上各个保留区间在 data 中的 memoryview.
+    # 给出 source_fd 时 (data 为该文件从 base_offset 起的内容) 保留区间为 FileRange, 由内核复制
+    selected = select_dds(data, pos, selection) if selection is not None else None
+    view = memoryview(data)
+    if selected is None:
+        new_header, ranges = None, [(pos, total_size)]
+    else:
+        new_header, ranges = selected
+
+    if source_fd is None:
+        chunks = [view[start:start + length] for start, length in ranges]
+    else:
+        chunks = [FileRange(source_fd, base_offset + start, length, view[start:start + length])
+                  for start, length in ranges]
+    return chunks if new_header is None else [new_header] + chunks
 
 class DDSProcessor:
-    def __init__(self):
+    def __init__(self, dedup_dir: Optional[str] = None, selection: Optional[MipSelection] = None,
+                 preview_dir: Optional[str] = None, dedup_run: Optional[str] = None):
         self.extracted_count = 0
+        self.selection = selection
         self.skipped_files = []
+        self.dedup = DedupIndex(dedup_dir, dedup_run) if dedup_dir else None
+        # 给出 preview_dir 时同时把顶层 mip 解码为 PNG 预览, 需要 numpy.
+        # ddsdecode 依赖本模块, 只在需要时导入
+        self.preview_dir = preview_dir
+        self.to_png = None
+        if preview_dir is not None:
+            from ddsdecode import dds_to_png
+            self.to_png = dds_to_png
 
     def extract_from_file(self, file_path: str, output_dir: str) -> int:
         try:
-            with open(file_path, 'rb') as f:
-                data = f.read()
-
-            extracted = 0
-            offset = 0
-
-            while offset <= len(data) - 128:
-                dds_pos = data.find(struct.pack('<I', DDS_MAGIC), offset)
-                if dds_pos == -1:
-                    break
-
-                header_data = data[dds_pos:dds_pos + 128]
-                header = DDSHeader(header_data)
-
-                if not header.is_valid():
-                    offset = dds_pos + 4
-                    continue
+            with open(file_path, 'rb') as source_file, open_mapped(file_path) as data:
+                return self._extract_from_data(file_path, data, output_dir, source_file.fileno())
 
-                has_dx10 = header.has_dx10_extension()
-                dx10_size = DX10_HEADER_SIZE if has_dx10 else 0
-
-                data_size = header.calculate_data_size()
-                total_size = 4 + DDS_HEADER_SIZE + dx10_size + data_size
+        except Exception as e:
+            print(f"处理文件 {file_path} 时出错: {str(e)}")
+            self.skipped_files.append(file_path)
+            return 0
 
-                if dds_pos + total_size > len(data):
-                    offset = dds_pos + 4
+        finally:
+            if self.dedup is not None:
+                self.dedup.close()
+
+    def _extract_from_data(self, file_path: str, data, output_dir: str, source_fd: Optional[int] = None) -> int:
+        extracted = 0
+        offset = 0
+        stem = output_stem(file_path)
+
+        # 先收集全部候选偏移并批量校验, 再跳过落在已提取图像内部的候选
+        candidates = [match.start() for match in re.finditer(re.escape(DDS_SIGNATURE), data)]
+        for dds_pos, total_size in validate_dds_headers(data, candidates):
+            if dds_pos < offset:
+                continue
+
+            header = DDSHeader(data, dds_pos)
+            format_str = header.get_dxgi_format(data, dds_pos + 128)
+
+            # 按源文件名、路径哈希和偏移命名, 多进程并行和重复运行时各文件的输出互不冲突
+            output_path = os.path.join(output_dir, output_name(stem, dds_pos, 'dds'))
+
+            if self.dedup is not None:
+                original_path = self.dedup.claim(data, dds_pos, total_size, output_path)
+                if original_path:
+                    self.dedup.record_duplicate(file_path, dds_pos, total_size, output_path, original_path)
+                    print(f"[{extracted:04d}] 与 {original_path} 重复, 跳过")
+                    extracted += 1
+                    offset = dds_pos + total_size
                     continue
 
-                dx10_data = data[dds_pos + 128:dds_pos + 128 + dx10_size] if has_dx10 else b''
-                format_str = header.get_dxgi_format(dx10_data)
+            write_chunks(output_path, dds_chunks(data, dds_pos, total_size, self.selection, source_fd))
 
-                output_path = os.path.join(output_dir, f"extracted_{self.extracted_count:04d}.dds")
+            print(f"[{extracted:04d}] 从 {file_path} 提取到 {output_path}")
+            print(f"      尺寸: {header.width}x{header.height}, 格式: {format_str}")
 
-                with open(output_path, 'wb') as out_file:
-                    out_file.write(data[dds_pos:dds_pos + total_size])
+            if self.to_png is not None:
+                # 直接从已解析的头和映射中的数据解码, 不再读取写出的 DDS
+                preview = self.to_png(data, dds_pos, header)
+                if preview is None:
+                    print(f"      不支持预览的格式: {format_str}")
+                else:
+                    write_chunks(os.path.join(self.preview_dir, output_name(stem, dds_pos, 'png')),
+                                 [preview])
 
-                print(f"[{self.extracted_count:04d}] 从 {file_path} 提取到 {output_path}")
-                print(f"      尺寸: {header.width}x{header.height}, 格式: {format_str}")
+            extracted += 1
+            self.extracted_count += 1
+            offset = dds_pos + total_size
 
-                extracted += 1
-                self.extracted_count += 1
-                offset = dds_pos + total_size
+        return extracted
 
-            return extracted
+    def process_directory(self, input_dir: str, output_dir: str, max_workers: Optional[int] = None,
+                          dedup_dir: Optional[str] = None,
+                          selection: Optional[MipSelection] = None,
+                          preview_dir: Optional[str] = None) -> Tuple[int, int, int]:
+        # 输出目录在输入目录之内时不能把已提取的文件再扫描一遍
+        entries = discover_files(input_dir, exclude_paths=[output_dir] + ([preview_dir] if preview_dir else []))
+        file_paths = [entry.path for entry in entries]
+        sizes = {entry.path: entry.size for entry in entries}
 
-        except Exception as e:
-            print(f"处理文件 {file_path} 时出错: {str(e)}")
-            self.skipped_files.append(file_path)
-            return 0
-
-    def process_directory(self, input_dir: str, output_dir: str) -> Tuple[int, int, int]:
-        total_files = 0
+        total_files = len(file_paths)
         processed_files = 0
         total_extracted = 0
-
-        for root, _, files in os.walk(input_dir):
-            for filename in files:
-                file_path = os.path.join(root, filename)
-                total_files += 1
-
-                if not os.path.isfile(file_path):
-                    continue
-
-                print(f"\n处理文件: {file_path}")
-                extracted = self.extract_from_file(file_path, output_dir)
-
-                if extracted > 0:
-                    processed_files += 1
-                    total_extracted += extracted
+        # 所有工作进程共用一个去重运行编号
+        dedup_run = new_run_id() if dedup_dir else None
+
+        for file_path, result, error in run_files(extract_file_worker, file_paths, output_dir, dedup_dir, selection,
+                                                  preview_dir, dedup_run, max_workers=max_workers, sizes=sizes):
+            if error is not None:
+                print(f"处理文件 {file_path} 时出错: {str(error)}")
+                self.skipped_files.append(file_path)
+                continue
+
+            extracted, skipped = result
+            if skipped:
+                self.skipped_files.append(file_path)
+            if extracted > 0:
+                processed_files += 1
+                total_extracted += extracted
+                self.extracted_count += extracted
 
         return total_files, processed_files, total_extracted
 
+def extract_file_worker(file_path: str, output_dir: str,
+                        dedup_dir: Optional[str] = None,
+                        selection: Optional[MipSelection] = None,
+                        preview_dir: Optional[str] = None,
+                        dedup_run: Optional[str] = None) -> Tuple[int, bool]:
+    # 在工作进程中运行, 返回 (提取数量, 是否出错跳过)
+    print(f"\n处理文件: {file_path}")
+    processor = DDSProcessor(dedup_dir, selection, preview_dir, dedup_run)
+    extracted = processor.extract_from_file(file_path, output_dir)
+    return extracted, bool(processor.skipped_files)
+
 def main():
     print("=" * 50)
     print(" DDS图像提取器")
@@ -291,16 +677,36 @@ def main():
         print(f"错误: {input_dir} 不是一个有效的目录。")
         return
 
+    max_dimension = input("只保留不超过多少像素的 mip (留空则保留完整 mip 链): ").strip()
+    selection = None
+    if max_dimension:
+        if not max_dimension.isdigit():
+            print(f"错误: {max_dimension} 不是有效的像素数。")
+            return
+        selection = MipSelection(max_dimension=int(max_dimension))
+
+    preview_dir = None
+    if input("是否同时把顶层 mip 转换为 PNG 预览 (y/N): ").strip().lower() == 'y':
+        from ddsdecode import decoding_available
+        if not decoding_available():
+            print("错误: 转换为 PNG 需要安装 numpy。")
+            return
+        preview_dir = os.path.join(input_dir, "extracted_dds_png")
+
     output_dir = os.path.join(input_dir, "extracted_dds")
     os.makedirs(output_dir, exist_ok=True)
 
     print(f"\n输入目录: {input_dir}")
     print(f"输出目录: {output_dir}")
+    if preview_dir:
+        print(f"预览目录: {preview_dir}")
 
     print("\n开始处理...\n")
 
     processor = DDSProcessor()
-    total_files, processed_files, total_extracted = processor.process_directory(input_dir, output_dir)
+    total_files, processed_files, total_extracted = processor.process_directory(input_dir, output_dir,
+                                                                                selection=selection,
+                                                                                preview_dir=preview_dir)
 
     print("\n" + "=" * 50)
     print(f"处理完成!")
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+import uuid
+from typing import Optional, Tuple
+
+from sources import split_label
+
+DEDUP_INDEX_DIR = '.dedup_index'
+DEDUP_MANIFEST = 'dedup_manifest.jsonl'
+
+class DedupIndex:
+    # 索引保存在输出目录下, 每个 (大小, 哈希) 对应一个标记文件, 内容为认领它的运行编号和首个副本的路径.
+    # 标记文件通过 os.link 原子创建, 多个工作进程 (甚至多次运行) 可以安全共享同一索引;
+    # 同一次运行的各个工作进程应当传入相同的 run_id.
+    def __init__(self, index_root: str, run_id: Optional[str] = None):
+        self.index_dir = os.path.join(index_root, DEDUP_INDEX_DIR)
+        self.manifest_path = os.path.join(index_root, DEDUP_MANIFEST)
+        self.duplicates = 0
+        self.saved_bytes = 0
+        self.run_id = run_id or new_run_id()
+        self._manifest = None
+
+    def claim(self, data, start: int, length: int, output_path: str) -> Optional[str]:
+        # 返回 None 表示是新内容, 调用方应当写出; 否则返回已存在副本的路径
+        # 内容用 blake2b 比较, 标记按大小分目录存放
+        with memoryview(data) as view:
+            digest = hashlib.blake2b(view[start:start + length], digest_size=16).hexdigest()
+
+        bucket = os.path.join(self.index_dir, str(length))
+        os.makedirs(bucket, exist_ok=True)
+        marker = os.path.join(bucket, digest)
+
+        if os.path.exists(marker):
+            return self._check_marker(marker, output_path)
+
+        temp_path = self._write_temp(marker, output_path)
+        try:
+            os.link(temp_path, marker)
+            return None
+        except FileExistsError:
+            return self._check_marker(marker, output_path)
+        except OSError:
+            # 不支持硬链接的文件系统, 退回到排他创建
+            try:
+                fd = os.open(marker, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+            except FileExistsError:
+                return self._check_marker(marker, output_path)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(f"{self.run_id}\n{output_path}")
+            return None
+        finally:
+            os.remove(temp_path)
+
+    def _check_marker(self, marker: str, output_path: str) -> Optional[str]:
+        # 本次运行认领的标记一律有效, 其图像可能还在其他工作进程的写队列中, 尚未出现在磁盘上.
+        # 之前运行留下的标记可能指向本次要写出的同一个输出, 或指向已被删除的文件;
+        # 这两种情况改由当前输出认领, 否则重复运行时图像会被记为自己的副本, 删除的输出也不再补写
+        run_id, original_path = self._read_marker(marker)
+        if original_path == output_path:
+            return None
+        if run_id == self.run_id or output_exists(original_path):
+            return original_path
+        os.replace(self._write_temp(marker, output_path), marker)
+        return None
+
+    def _write_temp(self, marker: str, output_path: str) -> str:
+        temp_path = f"{marker}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(f"{self.run_id}\n{output_path}")
+        return temp_path
+
+    def record_duplicate(self, source_path: str, offset: int, length: int,
+                         output_path: str, original_path: str) -> None:
+        self.duplicates += 1
+        self.saved_bytes += length
+
+        if self._manifest is None:
+            self._manifest = open(self.manifest_path, 'a', encoding='utf-8', buffering=1)
+        self._manifest.write(json.dumps({
+            'source': source_path,
+            'offset': offset,
+            'length': length,
+            'output': output_path,
+            'duplicate_of': original_path,
+        }, ensure_ascii=False) + '\n')
+
+    def close(self) -> None:
+        if self._manifest is not None:
+            self._manifest.close()
+            self._manifest = None
+
+    def _read_marker(self, marker: str) -> Tuple[str, str]:
+        # 旧格式的标记只有路径, 视为之前运行留下的
+        with open(marker, encoding='utf-8') as f:
+            run_id, _, original_path = f.read().rpartition('\n')
+        return run_id, original_path
+
+def new_run_id() -> str:
+    return uuid.uuid4().hex
+
+def output_exists(output_path: str) -> bool:
+    # 归档输出记录为 <归档路径>!<成员名>, 只检查归档本身是否存在
+    if os.path.exists(output_path):
+        return True
+    try:
+        split_label(output_path)
+    except ValueError:
+        return False
+    return True
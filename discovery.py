@@ -0,0 +1,185 @@
+import fnmatch
+import os
+import stat
+import sys
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+SIZE_SUFFIXES = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+class FileEntry(NamedTuple):
+    # 遍历时取得的 stat 结果, 后续排序、进度和增量索引不必再次 stat
+    path: str
+    size: int
+    mtime_ns: int
+    ino: int
+
+class DiscoveryOptions(NamedTuple):
+    # include/exclude 为 glob, 匹配文件名或相对于输入目录的路径, 不区分大小写;
+    # exclude 同样作用于目录, 匹配的目录整个跳过
+    include: Tuple[str, ...] = ()
+    exclude: Tuple[str, ...] = ()
+    min_size: int = 0
+    max_size: Optional[int] = None
+    follow_symlinks: bool = False
+    files_from: Optional[str] = None  # '\0' 分隔的文件列表, '-' 表示标准输入
+
+def parse_size(text: str) -> int:
+    # 支持 K/M/G/T 后缀, 例如 64K, 1.5G
+    text = text.strip().upper().rstrip('B')
+    suffix = text[-1:] if text[-1:] in SIZE_SUFFIXES else ''
+    number = text[:-1] if suffix else text
+    return int(float(number) * SIZE_SUFFIXES[suffix])
+
+def matches_any(name: str, relative_path: str, patterns: Iterable[str]) -> bool:
+    name = name.lower()
+    relative_path = relative_path.replace(os.sep, '/').lower()
+    for pattern in patterns:
+        pattern = pattern.lower()
+        if fnmatch.fnmatchcase(name, pattern) or fnmatch.fnmatchcase(relative_path, pattern):
+            return True
+    return False
+
+def read_file_list(source: str) -> Iterator[str]:
+    # 读取 find -print0 一类命令产生的 '\0' 分隔列表
+    stream = sys.stdin.buffer if source == '-' else open(source, 'rb')
+    try:
+        pending = b''
+        while True:
+            block = stream.read(1024 * 1024)
+            if not block:
+                break
+            pending += block
+            *paths, pending = pending.split(b'\0')
+            for path in paths:
+                if path:
+                    yield os.fsdecode(path)
+        if pending.strip(b'\r\n'):
+            yield os.fsdecode(pending.strip(b'\r\n'))
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+
+class Discovery:
+    def __init__(self, options: DiscoveryOptions = DiscoveryOptions(), exclude_paths: Iterable[str] = ()):
+        self.options = options
+        # 输出目录等按 (设备, inode) 排除, 不必对每个目录调用 realpath
+        self.excluded: Set[Tuple[int, int]] = set()
+        self.excluded_prefixes: List[str] = []
+        for path in exclude_paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            self.excluded.add((st.st_dev, st.st_ino))
+            self.excluded_prefixes.append(os.path.realpath(path))
+        self.seen_files: Set[Tuple[int, int]] = set()
+        self.seen_dirs: Set[Tuple[int, int]] = set()
+        self.skipped: Dict[str, int] = {}
+
+    def _skip(self, reason: str) -> None:
+        self.skipped[reason] = self.skipped.get(reason, 0) + 1
+
+    def _accept_file(self, path: str, name: str, relative_path: str, st) -> Optional[FileEntry]:
+        options = self.options
+        if (st.st_dev, st.st_ino) in self.excluded:
+            self._skip('output')
+            return None
+        if options.include and not matches_any(name, relative_path, options.include):
+            self._skip('not_included')
+            return None
+        if options.exclude and matches_any(name, relative_path, options.exclude):
+            self._skip('excluded')
+            return None
+        if st.st_size < options.min_size or (options.max_size is not None and st.st_size > options.max_size):
+            self._skip('size')
+            return None
+
+        # 硬链接或指向同一文件的符号链接只扫描一次
+        key = (st.st_dev, st.st_ino)
+        if key in self.seen_files:
+            self._skip('duplicate_link')
+            return None
+        self.seen_files.add(key)
+        return FileEntry(path, st.st_size, st.st_mtime_ns, st.st_ino)
+
+    def walk(self, root: str) -> Iterator[FileEntry]:
+        follow = self.options.follow_symlinks
+        try:
+            root_stat = os.stat(root)
+        except OSError:
+            return
+        self.seen_dirs.add((root_stat.st_dev, root_stat.st_ino))
+        stack = [(root, '')]
+
+        while stack:
+            directory, relative_dir = stack.pop()
+            try:
+                iterator = os.scandir(directory)
+            except OSError:
+                self._skip('unreadable')
+                continue
+
+            subdirectories = []
+            with iterator:
+                for entry in iterator:
+                    relative_path = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+                    try:
+                        if entry.is_symlink() and not follow:
+                            continue
+                        st = entry.stat(follow_symlinks=follow)
+                    except OSError:
+                        self._skip('unreadable')
+                        continue
+
+                    if stat.S_ISDIR(st.st_mode):
+                        key = (st.st_dev, st.st_ino)
+                        if key in self.excluded:
+                            self._skip('output')
+                            continue
+                        if key in self.seen_dirs:
+                            # 符号链接环或重复挂载
+                            self._skip('directory_loop')
+                            continue
+                        if self.options.exclude and matches_any(entry.name, relative_path, self.options.exclude):
+                            self._skip('excluded')
+                            continue
+                        self.seen_dirs.add(key)
+                        subdirectories.append((entry.path, relative_path))
+                    elif stat.S_ISREG(st.st_mode):
+                        file_entry = self._accept_file(entry.path, entry.name, relative_path, st)
+                        if file_entry is not None:
+                            yield file_entry
+
+            # 逆序入栈, 保持目录内按名称出现的顺序
+            stack.extend(reversed(subdirectories))
+
+    def from_list(self, paths: Iterable[str]) -> Iterator[FileEntry]:
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                self._skip('unreadable')
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            real_path = os.path.realpath(path)
+            if any(real_path == prefix or real_path.startswith(prefix + os.sep)
+                   for prefix in self.excluded_prefixes):
+                self._skip('output')
+                continue
+            file_entry = self._accept_file(path, os.path.basename(path), path, st)
+            if file_entry is not None:
+                yield file_entry
+
+def discover(input_dir: Optional[str], options: DiscoveryOptions = DiscoveryOptions(),
+             exclude_paths: Iterable[str] = ()) -> Iterator[FileEntry]:
+    # 按需产生文件, 大目录树不必等全部遍历完成; files_from 给出时代替目录遍历
+    discovery = Discovery(options, exclude_paths)
+    if options.files_from:
+        yield from discovery.from_list(read_file_list(options.files_from))
+    elif input_dir:
+        yield from discovery.walk(input_dir)
+
+def discover_files(input_dir: Optional[str], options: DiscoveryOptions = DiscoveryOptions(),
+                   exclude_paths: Iterable[str] = ()) -> List[FileEntry]:
+    return list(discover(input_dir, options, exclude_paths))
@@ -1,9 +1,18 @@
 import os
+import struct
 import sys
-import concurrent.futures
-from typing import List, Optional, Tuple
+from typing import Optional
 import time
 
+import stats
+from dedup import DedupIndex, new_run_id
+from discovery import DiscoveryOptions, discover_files
+from parallel import run_files
+from pipeline import AsyncWriter
+from scanio import FileRange, open_mapped
+from sinks import output_name, output_stem
+from validation import FAST, STRICT, STRUCTURAL
+
 def parse_sequence(sequence_input: str) -> bytes:
     if '*' in sequence_input:
         parts = sequence_input.split('*')
@@ -16,64 +25,173 @@ def parse_sequence(sequence_input: str) -> bytes:
 def find_sequence(content: bytes, sequence: bytes, start_index: int) -> int:
     return content.find(sequence, start_index)
 
-def is_valid_jpg(data: bytes) -> bool:
-    if len(data) < 10:
+DEFAULT_MAX_JPG_SIZE = 64 * 1024 * 1024
+
+# 没有长度字段的独立标记: TEM 和 RST0-RST7
+STANDALONE_MARKERS = {0x01} | set(range(0xD0, 0xD8))
+# SOF0-SOF15, 不含 DHT(C4)、JPG(C8)、DAC(CC)
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+def skip_entropy_data(data, offset: int, end_limit: int) -> int:
+    # 在熵编码数据中查找下一个真实标记, 跳过 FF 00 填充和 RSTn
+    while True:
+        offset = data.find(b'\xFF', offset, end_limit)
+        if offset == -1 or offset + 1 >= end_limit:
+            return -1
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            offset += 1
+        elif marker == 0x00 or marker in STANDALONE_MARKERS:
+            offset += 2
+        else:
+            return offset
+
+# 保留的标记 (JPEG 规范中的 RES); 正常文件中不会出现
+RESERVED_MARKERS = set(range(0x02, 0xC0))
+
+def sof_is_valid(data, offset: int, segment_length: int) -> bool:
+    # 精度(1) 高(2) 宽(2) 分量数(1), 每个分量3字节
+    if segment_length < 8:
         return False
-    if not data.startswith(b'\xFF\xD8\xFF'):
+    precision, height, width, components = struct.unpack_from('>BHHB', data, offset + 4)
+    return (precision in (8, 12, 16) and width > 0 and 0 < components <= 4 and
+            segment_length == 8 + 3 * components)
+
+def sos_is_valid(data, offset: int, segment_length: int) -> bool:
+    # 分量数(1), 每个分量2字节, 之后是 Ss/Se/Ah-Al 3字节
+    if segment_length < 6:
         return False
-    return (b'JFIF' in data[:20] or b'Exif' in data[:32]) and b'\xFF\xD9' in data
+    components = data[offset + 4]
+    return 0 < components <= 4 and segment_length == 6 + 2 * components
+
+def jpg_length(data, pos: int, max_size: int = DEFAULT_MAX_JPG_SIZE, level: str = STRUCTURAL) -> int:
+    # 按长度字段逐段遍历 SOI/APPn/DQT/SOF/SOS, 只在熵编码数据里搜索标记.
+    # fast 只要求各段长度能一路走到 EOI; strict 另外拒绝保留标记, 并检查 SOF/SOS 的长度与出现顺序
+    end_limit = min(len(data), pos + max_size)
+    if data[pos:pos + 3] != b'\xFF\xD8\xFF':
+        stats.reject('jpg', 'bad_soi')
+        return 0
 
-def extract_jpgs_from_file(file_path: str, start_sequence: bytes, end_sequence: bytes, 
-                          output_dir: str, progress_callback=None) -> int:
+    structural = level != FAST
+    strict = level == STRICT
+    offset = pos + 2
+    frames = 0
+    hierarchical = False
+    seen_scan = False
+    while offset + 2 <= end_limit:
+        if data[offset] != 0xFF:
+            stats.reject('jpg', 'bad_marker')
+            return 0
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            offset += 1
+            continue
+
+        if marker == 0xD9:
+            if structural and not seen_scan:
+                stats.reject('jpg', 'no_scan')
+                return 0
+            return offset + 2 - pos
+        if marker in STANDALONE_MARKERS:
+            offset += 2
+            continue
+        if marker in (0x00, 0xD8):
+            stats.reject('jpg', 'bad_marker')
+            return 0
+        if strict and marker in RESERVED_MARKERS:
+            stats.reject('jpg', 'reserved_marker')
+            return 0
+        if offset + 4 > end_limit:
+            break
+
+        segment_length = struct.unpack_from('>H', data, offset + 2)[0]
+        if segment_length < 2:
+            stats.reject('jpg', 'bad_segment_length')
+            return 0
+        segment_end = offset + 2 + segment_length
+        if segment_end > end_limit:
+            break
+
+        if marker in SOF_MARKERS:
+            # 除分层模式 (DHP) 外只能有一个帧, 且必须在第一个扫描之前
+            frames += 1
+            if strict and not hierarchical and (frames > 1 or seen_scan):
+                stats.reject('jpg', 'marker_order')
+                return 0
+            if strict and not sof_is_valid(data, offset, segment_length):
+                stats.reject('jpg', 'bad_sof')
+                return 0
+        elif marker == 0xDE:
+            hierarchical = True
+        elif strict and marker == 0xDD and segment_length != 4:
+            stats.reject('jpg', 'bad_segment_length')
+            return 0
+
+        if marker == 0xDA:
+            if structural and not frames:
+                stats.reject('jpg', 'no_frame')
+                return 0
+            if strict and not sos_is_valid(data, offset, segment_length):
+                stats.reject('jpg', 'bad_sos')
+                return 0
+            seen_scan = True
+            offset = skip_entropy_data(data, segment_end, end_limit)
+            if offset == -1:
+                break
+        else:
+            offset = segment_end
+
+    stats.reject('jpg', 'size_cap' if pos + max_size < len(data) else 'truncated')
+    return 0
+
+def extract_jpgs_from_file(file_path: str, start_sequence: bytes, output_dir: str,
+                          progress_callback=None, max_size: int = DEFAULT_MAX_JPG_SIZE,
+                          dedup_dir: Optional[str] = None, dedup_run: Optional[str] = None) -> int:
+    dedup = DedupIndex(dedup_dir, dedup_run) if dedup_dir else None
     try:
         if os.path.getsize(file_path) == 0:
             if progress_callback:
                 progress_callback(f"跳过空文件: {file_path}")
             return 0
             
-        base_filename = os.path.basename(file_path)
-        filename_without_ext = os.path.splitext(base_filename)[0]
+        stem = output_stem(file_path)
         os.makedirs(output_dir, exist_ok=True)
         
         extracted_count = 0
-        buffer_size = 8 * 1024 * 1024
-        remaining_data = b''
         
-        with open(file_path, 'rb') as f:
+        # 写出交给单独的线程, 扫描与写盘重叠; 写线程在映射关闭前结束
+        with open(file_path, 'rb') as source_file, open_mapped(file_path) as data, \
+                AsyncWriter() as writer, memoryview(data) as view:
+            start_index = 0
+            
             while True:
-                chunk = f.read(buffer_size)
-                if not chunk:
+                jpg_start = find_sequence(data, start_sequence, start_index)
+                if jpg_start == -1:
                     break
                     
-                current_data = remaining_data + chunk
-                start_index = 0
-                
-                while True:
-                    jpg_start = find_sequence(current_data, start_sequence, start_index)
-                    if jpg_start == -1:
-                        break
-                        
-                    jpg_end = find_sequence(current_data, end_sequence, jpg_start + len(start_sequence))
-                    if jpg_end == -1:
-                        break
-                        
-                    jpg_end += len(end_sequence)
-                    jpg_data = current_data[jpg_start:jpg_end]
+                jpg_size = jpg_length(data, jpg_start, max_size)
+                if not jpg_size:
+                    start_index = jpg_start + 1
+                    continue
                     
-                    if is_valid_jpg(jpg_data):
-                        output_filename = f"{filename_without_ext}_{extracted_count}.jpg"
-                        output_path = os.path.join(output_dir, output_filename)
-                        
-                        with open(output_path, 'wb') as out_file:
-                            out_file.write(jpg_data)
-                            
+                output_filename = output_name(stem, jpg_start, 'jpg')
+                output_path = os.path.join(output_dir, output_filename)
+                start_index = jpg_start + jpg_size
+                
+                if dedup is not None:
+                    original_path = dedup.claim(data, jpg_start, jpg_size, output_path)
+                    if original_path:
+                        dedup.record_duplicate(file_path, jpg_start, jpg_size, output_path, original_path)
                         extracted_count += 1
-                        if progress_callback:
-                            progress_callback(f"已提取: {output_path}")
-                    
-                    start_index = jpg_end
+                        continue
                 
-                remaining_data = current_data[start_index:]
+                # 由内核从源文件复制到输出文件, 不可用时写出映射中的这一段
+                writer.submit(output_path, [FileRange(source_file.fileno(), jpg_start, jpg_size,
+                                                      view[jpg_start:jpg_start + jpg_size])])
+                    
+                extracted_count += 1
+                if progress_callback:
+                    progress_callback(f"已提取: {output_path}")
         
         if progress_callback:
             progress_callback(f"从 {file_path} 提取了 {extracted_count} 个JPG")
@@ -84,38 +202,41 @@ def extract_jpgs_from_file(file_path: str, start_sequence: bytes, end_sequence:
         if progress_callback:
             progress_callback(f"处理文件 {file_path} 时出错: {str(e)}")
         return 0
-
-def process_directory(directory_path: str, start_sequence: bytes, end_sequence: bytes, 
-                     output_base_dir: str, max_workers: int = 5, progress_callback=None) -> int:
-    files_to_process = []
     
-    for root, _, files in os.walk(directory_path):
-        for file in files:
-            if not file.endswith('.py') and 'disabled' not in file.lower():
-                files_to_process.append(os.path.join(root, file))
+    finally:
+        if dedup is not None:
+            dedup.close()
+
+def extract_jpgs_into_tree(file_path: str, directory_path: str, start_sequence: bytes,
+                           output_base_dir: str, progress_callback=None,
+                           dedup_dir: Optional[str] = None, dedup_run: Optional[str] = None) -> int:
+    output_dir = os.path.join(output_base_dir, os.path.relpath(os.path.dirname(file_path), directory_path))
+    return extract_jpgs_from_file(file_path, start_sequence, output_dir, progress_callback,
+                                  dedup_dir=dedup_dir, dedup_run=dedup_run)
+
+def process_directory(directory_path: str, start_sequence: bytes, 
+                     output_base_dir: str, max_workers: Optional[int] = None, progress_callback=None,
+                     dedup_dir: Optional[str] = None) -> int:
+    entries = discover_files(directory_path, DiscoveryOptions(exclude=('*.py', '*disabled*')),
+                             exclude_paths=[output_base_dir])
+    files_to_process = [entry.path for entry in entries]
+    sizes = {entry.path: entry.size for entry in entries}
     
     if progress_callback:
         progress_callback(f"发现 {len(files_to_process)} 个文件需要处理")
     
     total_extracted = 0
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_file = {
-            executor.submit(
-                extract_jpgs_from_file, 
-                file_path, 
-                start_sequence, 
-                end_sequence,
-                os.path.join(output_base_dir, os.path.relpath(os.path.dirname(file_path), directory_path)),
-                progress_callback
-            ): file_path for file_path in files_to_process
-        }
-        
-        for future in concurrent.futures.as_completed(future_to_file):
-            try:
-                total_extracted += future.result()
-            except Exception as e:
-                if progress_callback:
-                    progress_callback(f"处理文件时发生异常: {str(e)}")
+    # 所有工作进程共用一个去重运行编号
+    dedup_run = new_run_id() if dedup_dir else None
+    for file_path, extracted, error in run_files(extract_jpgs_into_tree, files_to_process,
+                                                 directory_path, start_sequence, output_base_dir,
+                                                 progress_callback, dedup_dir, dedup_run,
+                                                 max_workers=max_workers, sizes=sizes):
+        if error is not None:
+            if progress_callback:
+                progress_callback(f"处理文件时发生异常: {str(error)}")
+            continue
+        total_extracted += extracted
     
     return total_extracted
 
@@ -128,15 +249,14 @@ def main():
         print(f"错误: {directory_path} 不是一个有效的目录。")
         sys.exit(1)
     
-    start_sequence = parse_sequence("FF D8 FF E0")
-    end_sequence = parse_sequence("FF D9")
+    start_sequence = parse_sequence("FF D8 FF")
     
     print("开始提取JPG文件...")
     output_base_dir = os.path.join(directory_path, "extracted_jpgs")
     start_time = time.time()
     
     try:
-        total_jpgs = process_directory(directory_path, start_sequence, end_sequence, 
+        total_jpgs = process_directory(directory_path, start_sequence, 
                                       output_base_dir, progress_callback=progress_log)
         elapsed_time = time.time() - start_time
         
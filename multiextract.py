@@ -0,0 +1,1084 @@
+import argparse
+import functools
+import heapq
+import io
+import itertools
+import mmap
+import os
+import re
+import time
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from catalog import CatalogWriter
+import stats
+from ddsdecode import dds_to_png, decoding_available
+from ddsextract import MipSelection, dds_chunks, dds_length, dds_metadata
+from dedup import DedupIndex, new_run_id
+from discovery import DiscoveryOptions, FileEntry, discover_files, parse_size
+from jpgextract import jpg_length
+from pngextract import png_length, png_metadata
+from pipeline import DEFAULT_READ_BLOCK, DEFAULT_WRITE_QUEUE, PrefetchReader, prefetch_mapped
+from parallel import default_workers, run_files, run_shards, split_ranges
+from scanindex import SCAN_INDEX_NAME, IndexedHit, ScanIndex, reemit_missing
+from scanio import FileRange, chunk_size, open_mapped, release_mapping
+from sinks import SINKS, open_sink, output_name, output_stem
+from sources import STREAM_ERRORS, container_kind, iter_members, iter_zlib_streams
+from validation import DEFAULT_LEVEL, LEVELS, STRUCTURAL
+from webpextract import webp_length
+
+SIGNATURES = {
+    'png': rb'\x89PNG',
+    'jpg': rb'\xFF\xD8\xFF',
+    'dds': rb'DDS \x7C\x00\x00\x00',
+    'webp': rb'RIFF.{4}WEBPVP8',
+}
+
+# 签名开头的固定字节, 用 find 查找; 找到后再用完整签名确认
+SIGNATURE_PREFIXES = {
+    'png': b'\x89PNG',
+    'jpg': b'\xFF\xD8\xFF',
+    'dds': b'DDS \x7C\x00\x00\x00',
+    'webp': b'RIFF',
+}
+
+class SignatureSet(NamedTuple):
+    # 每种格式按固定前缀各自查找, 再按偏移合并. 多个分支的正则无法利用字面量快速查找,
+    # 比逐个格式 find 慢得多; 数据仍然只映射和读取一次
+    prefixes: Tuple[Tuple[str, bytes], ...]
+    patterns: Dict[str, re.Pattern]
+    checks: Dict[str, re.Pattern]  # 前缀之外还有其他字节的签名 (WebP), 找到前缀后需要确认
+
+    def match(self, data, pos: int, end: Optional[int] = None) -> Optional[str]:
+        # pos 处是否为某个格式的完整签名, 返回格式
+        fmt = FORMAT_BY_FIRST_BYTE.get(data[pos])
+        pattern = self.patterns.get(fmt)
+        if pattern is None or pattern.match(data, pos, len(data) if end is None else end) is None:
+            return None
+        return fmt
+
+def compile_signatures(formats: Iterable[str]) -> SignatureSet:
+    selected = set(formats)
+    formats = [fmt for fmt in SIGNATURES if fmt in selected]
+    patterns = {fmt: re.compile(SIGNATURES[fmt], re.DOTALL) for fmt in formats}
+    checks = {fmt: pattern for fmt, pattern in patterns.items() if not pattern.fullmatch(SIGNATURE_PREFIXES[fmt])}
+    return SignatureSet(tuple((fmt, SIGNATURE_PREFIXES[fmt]) for fmt in formats), patterns, checks)
+
+# 按签名首字节分派到对应格式
+FORMAT_BY_FIRST_BYTE = {
+    0x89: 'png',
+    0xFF: 'jpg',
+    ord('D'): 'dds',
+    ord('R'): 'webp',
+}
+
+ALL_SIGNATURES = compile_signatures(SIGNATURES)
+
+# 扇区对齐模式先取出每个扇区的首字节, 只在首字节可能是签名时做完整匹配
+SECTOR_HEAD_PATTERN = re.compile(b'[' + b''.join(re.escape(bytes([byte])) for byte in FORMAT_BY_FIRST_BYTE) + b']')
+SECTOR_SIZES = (512, 4096)
+
+MAX_SIGNATURE_LENGTH = 15
+# 各格式的前缀按窗口向前查找: 提取的图像会跳过其内部, 不必一次查找整个剩余数据.
+# 连续没有找到时窗口加倍, 图像稀疏的数据不会因窗口过小而多次调用 find
+MIN_FIND_WINDOW = 4 * 1024
+MAX_FIND_WINDOW = 1024 * 1024
+DEFAULT_SHARD_SIZE = 256 * 1024 * 1024
+# 解压流不能回退, 扫描时保留的前瞻字节数; 更长的图像只有位于流末尾时才能识别
+DEFAULT_STREAM_WINDOW = 64 * 1024 * 1024
+
+HANDLERS = {
+    'png': png_length,
+    'jpg': jpg_length,
+    'dds': dds_length,
+    'webp': webp_length,
+}
+
+# 各校验级别下的长度函数; structural 即 HANDLERS
+VALIDATORS = {
+    level: {fmt: functools.partial(handler, level=level) for fmt, handler in HANDLERS.items()}
+    for level in LEVELS
+}
+VALIDATORS[STRUCTURAL] = HANDLERS
+
+METADATA = {
+    'png': png_metadata,
+    'dds': dds_metadata,
+}
+
+class Hit(NamedTuple):
+    format: str
+    offset: int
+    length: int
+
+class ExtractOptions(NamedTuple):
+    # 传给工作进程的选项, 必须可以被 pickle
+    dedup: bool = False
+    verbose: bool = False
+    dds_selection: Optional[MipSelection] = None
+    archives: bool = False
+    raw_zlib: bool = False
+    stream_window: int = DEFAULT_STREAM_WINDOW
+    read_block: int = DEFAULT_READ_BLOCK
+    write_queue: int = DEFAULT_WRITE_QUEUE  # 0 表示在扫描线程中同步写出
+    write_threads: int = 1
+    validation: str = DEFAULT_LEVEL
+    sink: str = 'dir'
+    dds_preview: bool = False  # 另外把 DDS 顶层 mip 写成 PNG 预览, 需要 numpy
+    shard_depth: int = 0  # 目录输出的哈希分桶层数
+    dedup_run: str = ''  # 去重索引的运行编号, 同一次运行的所有工作进程共用
+
+class CarvedHit(NamedTuple):
+    # carve 的结果: offset 为图像在文件 (压缩包成员时为成员) 中的偏移, source 为成员标识, 普通数据为空.
+    # payload 是指向源数据的 memoryview, 不复制; 源数据在仍有 payload 引用时保持有效
+    format: str
+    offset: int
+    length: int
+    payload: memoryview
+    source: str = ''
+
+    @property
+    def metadata(self) -> dict:
+        parse = METADATA.get(self.format)
+        return parse(self.payload, 0) if parse is not None else {}
+
+class FileResult(NamedTuple):
+    counts: Dict[str, int]
+    written: List[IndexedHit]
+    stats: Dict
+
+def scan_hits(data, start: int = 0, stop: Optional[int] = None,
+              signatures=ALL_SIGNATURES, level: str = DEFAULT_LEVEL) -> Iterator[Hit]:
+    # 只返回起点位于 [start, stop) 的图像, 图像本身可以越过 stop
+    if stop is None:
+        stop = len(data)
+    # 签名可能跨越 stop, 多搜索 MAX_SIGNATURE_LENGTH - 1 字节作为重叠区
+    search_end = min(len(data), stop + MAX_SIGNATURE_LENGTH - 1)
+
+    handlers = VALIDATORS[level]
+    checks = signatures.checks
+    find = data.find
+    heapreplace = heapq.heapreplace
+    run_stats = stats.CURRENT
+    counters = run_stats.counters
+    parse_time = 0.0
+    clock = time.perf_counter
+    # 查找耗时为本函数总耗时减去解析耗时, 不必对每次 find 计时; 暂停在 yield 时不计
+    busy = 0.0
+    mark = clock()
+
+    try:
+        # 每种格式一个游标 (位置, 格式, 前缀, 窗口), 总是处理位置最小的一个. 窗口为 0 表示 pos
+        # 处找到了前缀; 否则 pos 为下次查找的起点, 它之前已经查过, 窗口为上次查找的范围
+        cursors = [(start, fmt, prefix, MIN_FIND_WINDOW // 2) for fmt, prefix in signatures.prefixes]
+        heapq.heapify(cursors)
+
+        offset = start
+        while cursors:
+            pos, fmt, prefix, window = cursors[0]
+            if pos >= stop:
+                break
+            # 落在已提取图像内部的前缀直接跳过, 从图像末尾继续查找
+            if not window and pos >= offset and (fmt not in checks or checks[fmt].match(data, pos, search_end)):
+                started = clock()
+                length = handlers[fmt](data, pos)
+                parse_time += clock() - started
+                counters['candidates.' + fmt] += 1
+                if length > 0:
+                    counters['hits.' + fmt] += 1
+                    busy += clock() - mark
+                    mark = None
+                    yield Hit(fmt, pos, length)
+                    mark = clock()
+                    offset = pos + length
+
+            if pos < offset:
+                resume = offset
+                window = MIN_FIND_WINDOW
+            elif window:
+                resume = pos
+                window = min(window * 2, MAX_FIND_WINDOW)
+            else:
+                resume = pos + 1
+                window = MIN_FIND_WINDOW
+            end = resume + window
+            if end > search_end:
+                end = search_end
+            pos = find(prefix, resume, end) if resume < stop else -1
+            if pos != -1:
+                heapreplace(cursors, (pos, fmt, prefix, 0))
+            elif resume >= stop or end >= search_end:
+                heapq.heappop(cursors)
+            else:
+                # 跨越窗口末尾的前缀留给下一个窗口
+                heapreplace(cursors, (end - len(prefix) + 1, fmt, prefix, window))
+    finally:
+        if mark is not None:
+            busy += clock() - mark
+        run_stats.timers['search'] += busy - parse_time
+        run_stats.timers['parse'] += parse_time
+
+def scan_aligned(data, start: int, stop: int, alignment: int,
+                 signatures=ALL_SIGNATURES, level: str = DEFAULT_LEVEL, base: int = 0) -> Iterator[Hit]:
+    # 与 scan_hits 相同, 但只检查 (base + 偏移) 为 alignment 整数倍的位置: 文件系统中的文件
+    # 总是从扇区起点开始存放. 逐字节搜索变为对每个扇区首字节的一次跨步复制和查找
+    handlers = VALIDATORS[level]
+    run_stats = stats.CURRENT
+    counters = run_stats.counters
+    clock = time.perf_counter
+
+    started = clock()
+    first = start + (-(base + start) % alignment)
+    with memoryview(data) as view:
+        heads = view[first:stop:alignment].tobytes()
+    search_time = clock() - started
+    parse_time = 0.0
+
+    try:
+        cursor = start
+        for head in SECTOR_HEAD_PATTERN.finditer(heads):
+            pos = first + head.start() * alignment
+            if pos < cursor:
+                continue
+            started = clock()
+            fmt = signatures.match(data, pos)
+            searched = clock()
+            search_time += searched - started
+            if fmt is None:
+                continue
+
+            length = handlers[fmt](data, pos)
+            parse_time += clock() - searched
+            counters['candidates.' + fmt] += 1
+            if length <= 0:
+                continue
+
+            counters['hits.' + fmt] += 1
+            yield Hit(fmt, pos, length)
+            cursor = pos + length
+    finally:
+        run_stats.timers['search'] += search_time
+        run_stats.timers['parse'] += parse_time
+
+def scan_blocks(data, block_size: int = DEFAULT_READ_BLOCK,
+                signatures=ALL_SIGNATURES, level: str = DEFAULT_LEVEL, alignment: int = 0) -> Iterator[Hit]:
+    # 结果与 scan_hits(data) 相同, 但按块推进: 扫描当前块时对下一块发出异步预读.
+    # alignment 非 0 时只检查对齐的位置
+    cursor = 0
+    for start in range(0, len(data), block_size):
+        stop = min(len(data), start + block_size)
+        if cursor >= stop:
+            continue
+        prefetch_mapped(data, stop, block_size)
+        if alignment:
+            hits = scan_aligned(data, cursor, stop, alignment, signatures, level)
+        else:
+            hits = scan_hits(data, cursor, stop, signatures, level)
+        for hit in hits:
+            yield hit
+            cursor = hit.offset + hit.length
+        cursor = max(cursor, stop)
+
+def scan_range(file_path: str, start: int, stop: int, level: str = DEFAULT_LEVEL) -> Tuple[List[Hit], Dict]:
+    with stats.collect() as run_stats:
+        with open_mapped(file_path) as data:
+            hits = list(scan_hits(data, start, stop, level=level))
+        run_stats.counters['bytes_read'] += stop - start
+        return hits, run_stats.to_dict()
+
+def merge_shard_hits(data, ranges: List[Tuple[int, int]], shard_hits: List[List[Hit]],
+                     level: str = DEFAULT_LEVEL) -> List[Hit]:
+    # 合并各区间的结果, 保证与从头串行扫描完全一致:
+    # 串行扫描在提取一张图像后从其末尾继续搜索 (cursor). 若 cursor 落在某区间
+    # 工作进程也搜索过的位置, 则该区间之后的结果可以直接采用; 若落在该区间某个
+    # 候选图像内部, 则需要从 cursor 起重新串行扫描这个区间.
+    merged = []
+    cursor = 0
+
+    for (start, stop), hits in zip(ranges, shard_hits):
+        if cursor >= stop:
+            continue
+
+        if cursor <= start:
+            accepted = hits
+        elif any(hit.offset < cursor < hit.offset + hit.length for hit in hits):
+            accepted = list(scan_hits(data, cursor, stop, level=level))
+        else:
+            accepted = [hit for hit in hits if hit.offset >= cursor]
+
+        merged.extend(accepted)
+        if accepted:
+            cursor = accepted[-1].offset + accepted[-1].length
+
+    return merged
+
+def scan_file_sharded(file_path: str, max_workers: Optional[int], shard_size: int,
+                      level: str = DEFAULT_LEVEL) -> Tuple[List[Hit], List[Dict]]:
+    # 并行扫描各区间, 返回合并前的各区间结果与统计
+    ranges = split_ranges(os.path.getsize(file_path), shard_size)
+    results = run_shards(functools.partial(scan_range, level=level), file_path, ranges, max_workers)
+    return ranges, results
+
+def scan_stream(stream, label: str, lookahead: int = DEFAULT_STREAM_WINDOW,
+                signatures=ALL_SIGNATURES, level: str = DEFAULT_LEVEL,
+                alignment: int = 0) -> Iterator[Tuple[bytearray, int, List[Hit]]]:
+    # 在不可 seek 的解压流上按窗口扫描, 产生 (缓冲区, 缓冲区在流中的偏移, 缓冲区内的图像).
+    # 缓冲区在下一次迭代时被复用, 调用方必须在此之前写出图像. alignment 非 0 时只检查流中对齐的位置
+    read_size = max(1024 * 1024, lookahead // 4)
+    counters = stats.CURRENT.counters
+    buffer = bytearray()
+    base = 0
+    cursor = 0
+    eof = False
+
+    while True:
+        while not eof and len(buffer) < cursor + lookahead + read_size:
+            try:
+                piece = stream.read(read_size)
+            except STREAM_ERRORS as e:
+                # 截断或损坏的压缩数据: 保留已经解压的部分
+                print(f"读取 {label} 时出错: {str(e)}")
+                counters['stream_errors'] += 1
+                piece = b''
+            if not piece:
+                eof = True
+                break
+            buffer += piece
+            counters['bytes_decompressed'] += len(piece)
+
+        stop = len(buffer) if eof else len(buffer) - lookahead
+        if alignment:
+            hits = list(scan_aligned(buffer, cursor, stop, alignment, signatures, level, base))
+        else:
+            hits = list(scan_hits(buffer, cursor, stop, signatures, level))
+        yield buffer, base, hits
+
+        if eof:
+            return
+        cursor = max(stop, hits[-1].offset + hits[-1].length) if hits else stop
+        try:
+            del buffer[:cursor]
+        except BufferError:
+            # 调用方仍持有缓冲区中图像的 memoryview: 换用新的缓冲区, 旧缓冲区随这些引用一起释放
+            buffer = buffer[cursor:]
+        base += cursor
+        cursor = 0
+
+def carve_hits(data, hits: Iterable[Hit], source: str = '', base_offset: int = 0) -> Iterator[CarvedHit]:
+    # 为每个图像附上指向 data 的 memoryview; base_offset 为 data 在文件或成员中的偏移
+    with memoryview(data) as view:
+        for hit in hits:
+            yield CarvedHit(hit.format, base_offset + hit.offset, hit.length,
+                            view[hit.offset:hit.offset + hit.length], source)
+
+def carve_streams(streams, options: ExtractOptions = ExtractOptions(),
+                  signatures=ALL_SIGNATURES) -> Iterator[CarvedHit]:
+    # streams 产生 (成员标识, 解压流), 每个流按窗口扫描
+    for label, stream in streams:
+        for buffer, base, hits in scan_stream(stream, label, options.stream_window, signatures,
+                                              options.validation):
+            yield from carve_hits(buffer, hits, label, base)
+
+def image_block(read_block: int) -> int:
+    # 读取块按最大的扇区大小对齐, 从镜像起点顺序读取时每次读取都落在对齐的位置
+    return max(SECTOR_SIZES[-1], read_block // SECTOR_SIZES[-1] * SECTOR_SIZES[-1])
+
+def image_size(image_file) -> int:
+    # 块设备的 stat 大小为 0, 以 seek 到末尾的位置为准
+    size = image_file.seek(0, os.SEEK_END)
+    image_file.seek(0)
+    return size
+
+def map_image(image_file, size: int):
+    # 按给定长度映射: 块设备的 stat 大小为 0, 不能像普通文件那样映射整个文件. 不能映射时返回 None
+    if not size:
+        return None
+    try:
+        mapped = mmap.mmap(image_file.fileno(), size, access=mmap.ACCESS_READ)
+    except (OSError, ValueError, OverflowError):
+        return None
+    if hasattr(mapped, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+    return mapped
+
+def carve_image(image_file, size: int, label: str, options: ExtractOptions = ExtractOptions(),
+                alignment: int = 0, signatures=ALL_SIGNATURES) -> Iterator[CarvedHit]:
+    # 原始磁盘镜像/块设备: 偏移为镜像中的绝对偏移, 结果与普通文件相同 (source 为空).
+    # 映射后按对齐的大块扫描, 扫描当前块时对下一块发出预读; 不能映射时由后台线程以对齐的大块顺序读取
+    block_size = image_block(options.read_block)
+    mapped = map_image(image_file, size)
+    if mapped is None:
+        # 读取使用单独打开的文件, 结束时关闭它不影响调用方按 fd 复制图像
+        with PrefetchReader(open(label, 'rb', buffering=0), block_size) as reader:
+            for buffer, base, hits in scan_stream(reader, label, options.stream_window, signatures,
+                                                  options.validation, alignment):
+                yield from carve_hits(buffer, hits, '', base)
+        return
+
+    try:
+        yield from carve_hits(mapped, scan_blocks(mapped, block_size, signatures, options.validation, alignment))
+    finally:
+        release_mapping(mapped)
+
+def carve_data(data, options: ExtractOptions = ExtractOptions(), label: str = '',
+               signatures=ALL_SIGNATURES) -> Iterator[CarvedHit]:
+    yield from carve_hits(data, scan_blocks(data, options.read_block, signatures, options.validation))
+    if options.raw_zlib:
+        yield from carve_streams(iter_zlib_streams(label, data), options, signatures)
+
+def searchable(buffer):
+    # 扫描需要 find 等方法; 完整覆盖 bytes/bytearray/mmap 的 memoryview 直接使用其底层对象,
+    # 其他缓冲区 (切片、array 等) 只能复制一份
+    if isinstance(buffer, (bytes, bytearray, mmap.mmap)):
+        return buffer
+    with memoryview(buffer) as view:
+        if (isinstance(view.obj, (bytes, bytearray, mmap.mmap)) and view.c_contiguous
+                and view.nbytes == len(view.obj)):
+            return view.obj
+        return view.tobytes()
+
+def carve(source, formats: Iterable[str] = tuple(HANDLERS),
+          options: ExtractOptions = ExtractOptions()) -> Iterator[CarvedHit]:
+    # 库接口: 在进程内识别图像, 不写出任何文件.
+    # source 可以是路径、bytes/bytearray/mmap 等缓冲区或文件对象; 文件对象从头扫描,
+    # 可映射的普通文件直接映射, 其他流 (管道、解压流等) 按窗口读取.
+    # options.archives 对路径生效, 此时压缩包成员的结果带有 source 成员标识
+    signatures = compile_signatures(formats)
+
+    if isinstance(source, (str, os.PathLike)):
+        file_path = os.fspath(source)
+        if options.archives and container_kind(file_path):
+            yield from carve_streams(iter_members(file_path, options.read_block), options, signatures)
+            return
+        with open_mapped(file_path) as data:
+            yield from carve_data(data, options, file_path, signatures)
+        return
+
+    if not hasattr(source, 'read'):
+        yield from carve_data(searchable(source), options, '', signatures)
+        return
+
+    if hasattr(source, 'getvalue'):
+        # BytesIO: 内容未被修改时 getvalue 不复制
+        yield from carve_data(source.getvalue(), options, '', signatures)
+        return
+
+    mapped = None
+    # 只映射直接打开的文件; 解压流等包装对象的 fileno 指向的是压缩数据
+    if isinstance(getattr(source, 'raw', source), io.FileIO):
+        try:
+            mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            pass
+    if mapped is None:
+        label = source.name if isinstance(getattr(source, 'name', None), str) else ''
+        yield from carve_streams([(label, source)], options, signatures)
+        return
+
+    try:
+        yield from carve_data(mapped, options, '', signatures)
+    finally:
+        release_mapping(mapped)
+
+def write_hits(file_path: str, hits: Iterable[CarvedHit], sink,
+               dedup: Optional[DedupIndex] = None,
+               options: ExtractOptions = ExtractOptions(),
+               counts: Optional[Dict[str, int]] = None,
+               source_fd: Optional[int] = None) -> Tuple[Dict[str, int], List[IndexedHit]]:
+    # 返回各格式计数以及每个图像实际所在的输出 (供增量索引记录). 输出名为 <来源>@<偏移>.<格式>,
+    # 由 sink 决定写到目录、归档还是丢弃.
+    # 传入 source_fd (file_path 的 fd) 时, 文件本身中的图像按偏移由内核复制, 不经过 Python
+    if counts is None:
+        counts = {fmt: 0 for fmt in HANDLERS}
+        counts['duplicates'] = 0
+    written = []
+    counters = stats.CURRENT.counters
+    timers = stats.CURRENT.timers
+    stems = {'': output_stem(file_path)}
+
+    for hit in hits:
+        stem = stems.get(hit.source)
+        if stem is None:
+            stem = stems[hit.source] = output_stem(file_path, hit.source)
+        name = f"{hit.format}/{output_name(stem, hit.offset, hit.format)}"
+        output_path = sink.output(name)
+        counts[hit.format] += 1
+
+        started = time.perf_counter()
+        if dedup is not None:
+            original_path = dedup.claim(hit.payload, 0, hit.length, output_path)
+            if original_path:
+                dedup.record_duplicate(hit.source or file_path, hit.offset, hit.length, output_path, original_path)
+                counts['duplicates'] += 1
+                written.append(IndexedHit(hit.format, hit.offset, hit.length, original_path, hit.source))
+                timers['dedup'] += time.perf_counter() - started
+                continue
+            timers['dedup'] += time.perf_counter() - started
+            started = time.perf_counter()
+
+        fd = source_fd if not hit.source else None
+        if hit.format == 'dds' and options.dds_selection is not None:
+            chunks = dds_chunks(hit.payload, 0, hit.length, options.dds_selection, fd, hit.offset)
+        elif fd is not None:
+            chunks = [FileRange(fd, hit.offset, hit.length, hit.payload)]
+        else:
+            chunks = [hit.payload]
+        written_bytes = sum(chunk_size(chunk) for chunk in chunks)
+
+        if sink.buffered and isinstance(hit.payload.obj, bytearray):
+            # 流的缓冲区在下一个窗口会被改写, 交给写线程前复制, 缓冲区可以原地复用;
+            # 按偏移从源文件复制的区间不引用缓冲区, 内核复制不可用时改为从源文件读取
+            chunks = [chunk._replace(fallback=None) if isinstance(chunk, FileRange) else bytes(chunk)
+                      for chunk in chunks]
+        sink.write(name, chunks)
+        chunks = None
+        timers['write'] += time.perf_counter() - started
+        counters['bytes_written'] += written_bytes
+
+        if hit.format == 'dds' and options.dds_preview:
+            # 顶层 mip 解码为 PNG 预览, 与 DDS 一起写出, 不必之后再读一遍
+            started = time.perf_counter()
+            preview = dds_to_png(hit.payload, 0)
+            timers['dds_preview'] += time.perf_counter() - started
+            if preview is None:
+                counters['dds_preview_unsupported'] += 1
+            else:
+                sink.write(f"dds_png/{output_name(stem, hit.offset, 'png')}", [preview])
+                counters['dds_previews'] += 1
+            preview = None
+
+        written.append(IndexedHit(hit.format, hit.offset, hit.length, output_path, hit.source))
+        if options.verbose:
+            location = f"{hit.source}@{hit.offset}" if hit.source else f"偏移 {hit.offset}"
+            print(f"已提取 {hit.format.upper()}: {output_path} ({location}, 大小 {hit.length})")
+        hit = None
+
+    return counts, written
+
+def output_sink(output_dir: str, file_path: str, options: ExtractOptions):
+    return open_sink(options.sink, output_dir, file_path, options.shard_depth,
+                     options.write_queue, options.write_threads)
+
+def index_fingerprint(options: ExtractOptions, output_dir: str) -> str:
+    # 增量索引中记录的选项和输出目录: 改变其中任何一项, 找到的图像或写出的内容和位置都可能不同
+    selection = options.dds_selection
+    return ','.join([
+        f"archives={int(options.archives)}",
+        f"zlib={int(options.raw_zlib)}",
+        # 前瞻大小只影响解压流中的扫描
+        f"window={options.stream_window if options.archives or options.raw_zlib else 0}",
+        f"validate={options.validation}",
+        f"dds={'' if selection is None else ':'.join(str(value) for value in selection)}",
+        f"dds_png={int(options.dds_preview)}",
+        f"sink={options.sink}",
+        f"shard={options.shard_depth}",
+        f"output={os.path.abspath(output_dir)}",
+    ])
+
+def extract_all_from_file(file_path: str, output_dir: str,
+                          options: ExtractOptions = ExtractOptions()) -> FileResult:
+    dedup_index = DedupIndex(output_dir, options.dedup_run or None) if options.dedup else None
+    started = time.perf_counter()
+    try:
+        with stats.collect() as run_stats:
+            if options.archives and container_kind(file_path):
+                # 压缩包/压缩流: 逐个成员解压扫描, 不落地到磁盘
+                with output_sink(output_dir, file_path, options) as sink:
+                    counts, written = write_hits(file_path, carve(file_path, options=options), sink,
+                                                 dedup_index, options)
+                size = os.path.getsize(file_path)
+            else:
+                with open(file_path, 'rb') as source_file, open_mapped(file_path) as data, \
+                        output_sink(output_dir, file_path, options) as sink:
+                    counts, written = write_hits(file_path, carve_data(data, options, file_path), sink,
+                                                 dedup_index, options, source_fd=source_file.fileno())
+                    size = len(data)
+            run_stats.counters['bytes_read'] += size
+            run_stats.add_file(file_path, size, time.perf_counter() - started, len(written))
+            return FileResult(counts, written, run_stats.to_dict())
+    finally:
+        if dedup_index is not None:
+            dedup_index.close()
+
+def extract_all_from_file_sharded(file_path: str, output_dir: str, max_workers: Optional[int] = None,
+                                  shard_size: int = DEFAULT_SHARD_SIZE,
+                                  options: ExtractOptions = ExtractOptions()) -> FileResult:
+    # 单个超大文件: 按字节区间并行扫描, 合并后在主进程中按顺序写出
+    started = time.perf_counter()
+    ranges, results = scan_file_sharded(file_path, max_workers, shard_size, options.validation)
+
+    dedup_index = DedupIndex(output_dir, options.dedup_run or None) if options.dedup else None
+    try:
+        with stats.collect() as run_stats:
+            for _, shard_stats in results:
+                run_stats.merge(shard_stats)
+            with open(file_path, 'rb') as source_file, open_mapped(file_path) as data, \
+                    output_sink(output_dir, file_path, options) as sink:
+                hits = merge_shard_hits(data, ranges, [hits for hits, _ in results], options.validation)
+                carved = carve_hits(data, hits)
+                if options.raw_zlib:
+                    carved = itertools.chain(carved, carve_streams(iter_zlib_streams(file_path, data), options))
+                counts, written = write_hits(file_path, carved, sink, dedup_index, options,
+                                             source_fd=source_file.fileno())
+                size = len(data)
+            run_stats.add_file(file_path, size, time.perf_counter() - started, len(written))
+            return FileResult(counts, written, run_stats.to_dict())
+    finally:
+        if dedup_index is not None:
+            dedup_index.close()
+
+def extract_image(image_path: str, output_dir: str, options: ExtractOptions = ExtractOptions(),
+                  alignment: int = 0) -> FileResult:
+    # 单个磁盘镜像或块设备, 图像按偏移从镜像由内核复制到输出
+    dedup_index = DedupIndex(output_dir, options.dedup_run or None) if options.dedup else None
+    started = time.perf_counter()
+    try:
+        with stats.collect() as run_stats, open(image_path, 'rb', buffering=0) as image_file:
+            size = image_size(image_file)
+            with output_sink(output_dir, image_path, options) as sink:
+                carved = carve_image(image_file, size, image_path, options, alignment)
+                counts, written = write_hits(image_path, carved, sink, dedup_index, options,
+                                             source_fd=image_file.fileno())
+            run_stats.counters['bytes_read'] += size
+            run_stats.add_file(image_path, size, time.perf_counter() - started, len(written))
+            return FileResult(counts, written, run_stats.to_dict())
+    finally:
+        if dedup_index is not None:
+            dedup_index.close()
+
+# 默认不扫描脚本本身
+DEFAULT_DISCOVERY = DiscoveryOptions(exclude=('*.py',))
+
+def collect_files(input_dir: Optional[str], exclude_paths: Iterable[str] = (),
+                  discovery: DiscoveryOptions = DEFAULT_DISCOVERY) -> List[FileEntry]:
+    # 输出目录、清单等自己写出的路径总是排除在外
+    return discover_files(input_dir, discovery, exclude_paths)
+
+def catalog_records(source: str, hits: Iterable[CarvedHit]) -> List[dict]:
+    # source 为文件路径; 压缩包成员的记录使用成员标识
+    records = []
+    for hit in hits:
+        record = {'source': hit.source or source, 'format': hit.format, 'offset': hit.offset,
+                  'length': hit.length}
+        record.update(hit.metadata)
+        records.append(record)
+    return records
+
+def catalog_file(file_path: str, options: ExtractOptions = ExtractOptions()) -> Tuple[List[dict], Dict]:
+    started = time.perf_counter()
+    source = os.path.abspath(file_path)
+    with stats.collect() as run_stats:
+        if options.archives and container_kind(file_path):
+            records = catalog_records(source, carve(source, options=options))
+            size = os.path.getsize(file_path)
+        else:
+            with open_mapped(file_path) as data:
+                records = catalog_records(source, carve_data(data, options, source))
+                size = len(data)
+        run_stats.counters['bytes_read'] += size
+        run_stats.add_file(file_path, size, time.perf_counter() - started, len(records))
+        return records, run_stats.to_dict()
+
+def catalog_image(image_path: str, options: ExtractOptions = ExtractOptions(),
+                  alignment: int = 0) -> Tuple[List[dict], Dict]:
+    started = time.perf_counter()
+    source = os.path.abspath(image_path)
+    with stats.collect() as run_stats, open(image_path, 'rb', buffering=0) as image_file:
+        size = image_size(image_file)
+        records = catalog_records(source, carve_image(image_file, size, image_path, options, alignment))
+        run_stats.counters['bytes_read'] += size
+        run_stats.add_file(image_path, size, time.perf_counter() - started, len(records))
+        return records, run_stats.to_dict()
+
+def catalog_file_sharded(file_path: str, max_workers: Optional[int] = None,
+                         shard_size: int = DEFAULT_SHARD_SIZE,
+                         options: ExtractOptions = ExtractOptions()) -> Tuple[List[dict], Dict]:
+    started = time.perf_counter()
+    source = os.path.abspath(file_path)
+    ranges, results = scan_file_sharded(file_path, max_workers, shard_size, options.validation)
+
+    with stats.collect() as run_stats:
+        for _, shard_stats in results:
+            run_stats.merge(shard_stats)
+        with open_mapped(file_path) as data:
+            hits = merge_shard_hits(data, ranges, [hits for hits, _ in results], options.validation)
+            records = catalog_records(source, carve_hits(data, hits))
+            if options.raw_zlib:
+                records += catalog_records(source, carve_streams(iter_zlib_streams(source, data), options))
+            size = len(data)
+        run_stats.add_file(file_path, size, time.perf_counter() - started, len(records))
+        return records, run_stats.to_dict()
+
+def split_huge_files(file_paths: List[str], sizes: Dict[str, int], max_workers: Optional[int], shard_size: int,
+                     options: ExtractOptions = ExtractOptions()) -> Tuple[List[str], List[str]]:
+    # 超过分片大小的文件在文件内部按区间并行, 其余文件按文件并行; 压缩包只能顺序解压, 不分片
+    huge_files = []
+    if (max_workers or default_workers()) > 1:
+        huge_files = [file_path for file_path in file_paths if sizes[file_path] > shard_size
+                      and not (options.archives and container_kind(file_path))]
+    huge_set = set(huge_files)
+    return huge_files, [file_path for file_path in file_paths if file_path not in huge_set]
+
+def catalog_image_file(image_path: str, catalog_path: str, run_stats: Optional[stats.RunStats] = None,
+                       options: ExtractOptions = ExtractOptions(), alignment: int = 0) -> Tuple[int, Dict[str, int]]:
+    totals = {fmt: 0 for fmt in HANDLERS}
+    run_stats = run_stats if run_stats is not None else stats.RunStats()
+    records, file_stats = catalog_image(image_path, options, alignment)
+    run_stats.merge(file_stats)
+    writer = CatalogWriter(catalog_path)
+    try:
+        for record in records:
+            writer.write(record)
+            totals[record['format']] += 1
+    finally:
+        writer.close()
+    return 1, totals
+
+def catalog_directory(input_dir: Optional[str], catalog_path: str, max_workers: Optional[int] = None,
+                      shard_size: int = DEFAULT_SHARD_SIZE,
+                      run_stats: Optional[stats.RunStats] = None,
+                      options: ExtractOptions = ExtractOptions(),
+                      discovery: DiscoveryOptions = DEFAULT_DISCOVERY) -> Tuple[int, Dict[str, int]]:
+    # 只扫描并记录偏移和元数据, 不写出任何图像
+    totals = {fmt: 0 for fmt in HANDLERS}
+    run_stats = run_stats if run_stats is not None else stats.RunStats()
+    entries = collect_files(input_dir, [catalog_path], discovery)
+    sizes = {entry.path: entry.size for entry in entries}
+    file_paths = [entry.path for entry in entries]
+    huge_files, small_files = split_huge_files(file_paths, sizes, max_workers, shard_size, options)
+    progress = stats.ProgressReporter(len(file_paths), sum(sizes.values()))
+
+    def results():
+        for file_path in huge_files:
+            try:
+                yield file_path, catalog_file_sharded(file_path, max_workers, shard_size, options), None
+            except Exception as e:
+                yield file_path, None, e
+        yield from run_files(catalog_file, small_files, options, max_workers=max_workers, sizes=sizes)
+
+    writer = CatalogWriter(catalog_path)
+    try:
+        for file_path, result, error in results():
+            if error is not None:
+                print(f"处理文件 {file_path} 时出错: {str(error)}")
+                run_stats.counters['files_failed'] += 1
+                continue
+            records, file_stats = result
+            run_stats.merge(file_stats)
+            for record in records:
+                writer.write(record)
+                totals[record['format']] += 1
+            progress.update(file_stats['files'][-1]['bytes'], len(records))
+    finally:
+        writer.close()
+        progress.finish()
+
+    return len(file_paths), totals
+
+def process_image(image_path: str, output_dir: str, options: ExtractOptions = ExtractOptions(),
+                  run_stats: Optional[stats.RunStats] = None, alignment: int = 0) -> Tuple[int, Dict[str, int]]:
+    run_stats = run_stats if run_stats is not None else stats.RunStats()
+    try:
+        result = extract_image(image_path, output_dir, options, alignment)
+    except OSError as e:
+        print(f"读取镜像 {image_path} 时出错: {str(e)}")
+        run_stats.counters['files_failed'] += 1
+        totals = {fmt: 0 for fmt in HANDLERS}
+        totals['duplicates'] = 0
+        return 1, totals
+    run_stats.merge(result.stats)
+    return 1, dict(result.counts)
+
+def process_directory(input_dir: Optional[str], output_dir: str, max_workers: Optional[int] = None,
+                      shard_size: int = DEFAULT_SHARD_SIZE,
+                      options: ExtractOptions = ExtractOptions(),
+                      index_path: Optional[str] = None, reemit: bool = False,
+                      run_stats: Optional[stats.RunStats] = None,
+                      discovery: DiscoveryOptions = DEFAULT_DISCOVERY) -> Tuple[int, Dict[str, int]]:
+    totals = {fmt: 0 for fmt in HANDLERS}
+    totals['duplicates'] = 0
+    totals['unchanged'] = 0
+    run_stats = run_stats if run_stats is not None else stats.RunStats()
+    if options.dedup and not options.dedup_run:
+        options = options._replace(dedup_run=new_run_id())
+    exclude_paths = [output_dir] + ([index_path] if index_path else [])
+    entries = collect_files(input_dir, exclude_paths, discovery)
+
+    index = ScanIndex(index_path) if index_path else None
+    fingerprint = index_fingerprint(options, output_dir)
+    keys = {}
+    progress = None
+
+    def finish(file_path, result):
+        for fmt, count in result.counts.items():
+            totals[fmt] += count
+        run_stats.merge(result.stats)
+        if index is not None:
+            index.record(file_path, HANDLERS, result.written, keys[file_path], fingerprint)
+        if options.verbose:
+            print(f"完成: {file_path}")
+        else:
+            progress.update(keys[file_path][0], len(result.written))
+
+    try:
+        pending_files = []
+        for entry in entries:
+            file_path = entry.path
+            # 遍历时已取得 stat 结果, 直接作为增量索引的键
+            keys[file_path] = (entry.size, entry.mtime_ns, entry.ino)
+            if index is not None and index.is_unchanged(file_path, HANDLERS, keys[file_path], fingerprint):
+                # 未变化的文件直接跳过, 按需根据记录的偏移补写缺失的输出
+                indexed_hits = index.get_hits(file_path)
+                for hit in indexed_hits:
+                    totals[hit.format] += 1
+                totals['unchanged'] += 1
+                if reemit:
+                    reemit_missing(file_path, indexed_hits, options.dds_selection)
+                continue
+            pending_files.append(file_path)
+
+        sizes = {file_path: keys[file_path][0] for file_path in pending_files}
+        huge_files, small_files = split_huge_files(pending_files, sizes, max_workers, shard_size, options)
+        progress = stats.ProgressReporter(len(pending_files), sum(sizes.values()))
+
+        for file_path in huge_files:
+            if options.verbose:
+                print(f"\n分片并行处理大文件: {file_path}")
+            try:
+                result = extract_all_from_file_sharded(file_path, output_dir, max_workers,
+                                                       shard_size, options)
+            except Exception as e:
+                print(f"处理文件 {file_path} 时出错: {str(e)}")
+                run_stats.counters['files_failed'] += 1
+                continue
+            finish(file_path, result)
+
+        for file_path, result, error in run_files(extract_all_from_file, small_files, output_dir, options,
+                                                  max_workers=max_workers, sizes=sizes):
+            if error is not None:
+                print(f"处理文件 {file_path} 时出错: {str(error)}")
+                run_stats.counters['files_failed'] += 1
+                continue
+            finish(file_path, result)
+
+    finally:
+        if index is not None:
+            index.close()
+        if progress is not None and not options.verbose:
+            progress.finish()
+
+    return len(entries), totals
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="一次读取同时提取 PNG/JPG/DDS/WebP 图像")
+    parser.add_argument('input_dir', nargs='?', help="要处理的文件夹路径, 省略时交互输入")
+    parser.add_argument('-o', '--output', help="输出目录, 默认为 <输入目录>/extracted_all")
+    parser.add_argument('--include', action='append', default=[], metavar='GLOB',
+                        help="只扫描文件名或相对路径匹配的文件, 可重复")
+    parser.add_argument('--exclude', action='append', default=[], metavar='GLOB',
+                        help="跳过匹配的文件和目录, 可重复; 默认总是跳过 *.py")
+    parser.add_argument('--min-size', type=parse_size, default=0, metavar='SIZE',
+                        help="跳过小于此大小的文件, 可带 K/M/G 后缀")
+    parser.add_argument('--max-size', type=parse_size, default=None, metavar='SIZE',
+                        help="跳过大于此大小的文件, 可带 K/M/G 后缀")
+    parser.add_argument('--follow-symlinks', action='store_true',
+                        help="跟随符号链接 (链接环和指向同一文件的链接只处理一次)")
+    parser.add_argument('--files-from', metavar='PATH',
+                        help="从文件读取 '\\0' 分隔的待扫描文件列表代替目录遍历, '-' 表示标准输入 "
+                             "(例如 find ... -print0 | multiextract.py --files-from - -o OUT)")
+    parser.add_argument('--image', metavar='PATH',
+                        help="代替输入目录, 扫描单个原始磁盘镜像或块设备 (如 /dev/sdb); "
+                             "以对齐的大块 (--read-block) 顺序读取, 必须用 -o 指定输出目录")
+    parser.add_argument('--sector-align', type=int, choices=SECTOR_SIZES, default=0, metavar='N',
+                        help="与 --image 一起使用: 只在 N (512 或 4096) 字节边界上检查签名. 文件系统中的"
+                             "文件从扇区起点开始存放, 可大幅提高扫描速度, 但会漏掉不对齐的图像 (如嵌在其他文件中)")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="工作进程数, 默认为 CPU 核心数")
+    parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE // (1024 * 1024),
+                        help="单个文件超过此大小 (MB) 时在文件内部分片并行扫描")
+    parser.add_argument('--dedup', action='store_true',
+                        help="按内容哈希去重, 重复的图像只记录到 dedup_manifest.jsonl 而不再写出")
+    parser.add_argument('--index', nargs='?', const='', default=None, metavar='PATH',
+                        help=f"启用增量扫描索引, 未变化的文件不再扫描; 默认保存为 <输出目录>/{SCAN_INDEX_NAME}")
+    parser.add_argument('--reemit', action='store_true',
+                        help="对未变化的文件, 根据索引中的偏移补写缺失的输出文件")
+    parser.add_argument('--catalog', metavar='PATH',
+                        help="只生成清单 (.jsonl 或 .csv), 每个图像一条记录, 不写出图像; "
+                             "之后可用 catalog.py 按清单提取")
+    parser.add_argument('--validate', choices=LEVELS, default=DEFAULT_LEVEL,
+                        help="校验级别: fast 只检查签名与头部; structural 逐块遍历结构; "
+                             "strict 另外校验 PNG CRC、JPEG 标记顺序、DDS 头字段一致性与 RIFF 块大小")
+    parser.add_argument('--dds-mips', type=int, metavar='N',
+                        help="DDS 只写出前 N 级 mip (1 表示只要顶层), 并重写文件头")
+    parser.add_argument('--dds-max-size', type=int, metavar='PX',
+                        help="DDS 跳过宽或高超过 PX 像素的 mip")
+    parser.add_argument('--dds-first-layer', action='store_true',
+                        help="DDS 立方体贴图/纹理数组只写出第一个面或元素")
+    parser.add_argument('--dds-png', action='store_true',
+                        help="同时把 DDS 的顶层 mip 解码为 PNG 预览, 保存在 dds_png 子目录 (需要 numpy); "
+                             "支持 BC1-BC5 与常见非压缩格式")
+    parser.add_argument('--archives', action='store_true',
+                        help="在 zip/tar/gzip/bz2/xz 内部直接解压扫描, 图像标记为 压缩包!成员@偏移")
+    parser.add_argument('--zlib', action='store_true',
+                        help="另外查找文件中的原始 zlib 流并解压扫描")
+    parser.add_argument('--stream-window', type=int, default=DEFAULT_STREAM_WINDOW // (1024 * 1024),
+                        help="扫描解压流时保留的前瞻大小 (MB), 更大的图像只有位于流末尾时才能识别")
+    parser.add_argument('--read-block', type=int, default=DEFAULT_READ_BLOCK // (1024 * 1024),
+                        help="按块扫描并预读下一块的块大小 (MB)")
+    parser.add_argument('--write-queue', type=int, default=DEFAULT_WRITE_QUEUE // (1024 * 1024),
+                        help="写线程队列中最多排队的字节数 (MB), 写出较慢时扫描在此等待; 0 表示同步写出")
+    parser.add_argument('--write-threads', type=int, default=1, help="写线程数")
+    parser.add_argument('--sink', choices=SINKS, default='dir',
+                        help="输出方式: dir 每个图像一个文件; tar/zip 每个输入写成一个不压缩的归档; "
+                             "none 试运行, 只扫描统计不写出")
+    parser.add_argument('--shard-dirs', type=int, default=0, metavar='N',
+                        help="目录输出时按文件名哈希分到 N 级子目录 (每级 256 个), 避免单个目录文件过多")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="逐个打印提取的图像, 代替单行进度")
+    parser.add_argument('--stats', metavar='PATH', help="把运行统计 (计数、拒绝原因、耗时、每个文件的吞吐量) 写成 JSON")
+    parser.add_argument('--profile', metavar='PATH', help="用 cProfile 分析主进程并保存结果")
+    parser.add_argument('--tracemalloc', action='store_true', help="用 tracemalloc 报告主进程的内存分配热点")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    run_stats = stats.RunStats()
+    started = time.perf_counter()
+
+    with stats.profiled(args.profile, args.tracemalloc):
+        run(args, run_stats)
+
+    if args.stats:
+        stats.write_stats(run_stats, args.stats, time.perf_counter() - started)
+        print(f"运行统计保存在: {args.stats}")
+
+def print_rejections(run_stats: stats.RunStats, level: str) -> None:
+    if not run_stats.rejections:
+        return
+    print(f"校验级别 {level}, 被拒绝的候选:")
+    for reason, count in sorted(run_stats.rejections.items()):
+        print(f"  {reason}: {count}")
+
+def run(args, run_stats: stats.RunStats):
+    print("=" * 50)
+    print(" PNG/JPG/DDS/WebP 单次扫描提取器")
+    print("=" * 50)
+
+    if args.sector_align and not args.image:
+        print("错误: --sector-align 只能与 --image 一起使用。")
+        return
+
+    if args.image:
+        # 单个镜像或设备按流顺序扫描, 不遍历目录, 也不支持需要随机访问或按文件索引的选项
+        input_dir = None
+        if args.input_dir or args.files_from:
+            print("错误: --image 不能与输入目录或 --files-from 同时使用。")
+            return
+        if args.archives or args.zlib or args.index is not None or args.reemit:
+            print("错误: --image 不支持 --archives、--zlib、--index 和 --reemit。")
+            return
+        if not os.path.exists(args.image):
+            print(f"错误: {args.image} 不存在。")
+            return
+        if not args.output and not args.catalog:
+            print("错误: 使用 --image 时必须用 -o 指定输出目录。")
+            return
+    elif args.files_from:
+        # 文件列表来自标准输入时不能再交互输入, 必须用 -o 指定输出目录
+        input_dir = args.input_dir
+        if not args.output and not args.catalog:
+            print("错误: 使用 --files-from 时必须用 -o 指定输出目录。")
+            return
+    else:
+        input_dir = args.input_dir or input("请输入要处理的文件夹路径: ").strip()
+
+    if input_dir and not os.path.isdir(input_dir):
+        print(f"错误: {input_dir} 不是一个有效的目录。")
+        return
+
+    discovery = DiscoveryOptions(include=tuple(args.include), exclude=('*.py',) + tuple(args.exclude),
+                                 min_size=args.min_size, max_size=args.max_size,
+                                 follow_symlinks=args.follow_symlinks, files_from=args.files_from)
+
+    shard_size = args.shard_size * 1024 * 1024
+    options = ExtractOptions(verbose=args.verbose, archives=args.archives, raw_zlib=args.zlib,
+                             stream_window=args.stream_window * 1024 * 1024,
+                             read_block=args.read_block * 1024 * 1024,
+                             write_queue=args.write_queue * 1024 * 1024, write_threads=args.write_threads,
+                             validation=args.validate)
+
+    if args.catalog:
+        print(f"\n输入: {args.image or input_dir or args.files_from}")
+        print(f"清单文件: {args.catalog}")
+
+        if args.image:
+            total_files, totals = catalog_image_file(args.image, args.catalog, run_stats, options,
+                                                     args.sector_align)
+        else:
+            total_files, totals = catalog_directory(input_dir, args.catalog, args.workers, shard_size,
+                                                    run_stats, options, discovery)
+
+        print("\n" + "=" * 50)
+        print("扫描完成!")
+        print(f"总文件数: {total_files}")
+        for fmt in HANDLERS:
+            print(f"找到的{fmt.upper()}图像: {totals[fmt]}")
+        print(f"清单保存在: {args.catalog}")
+        print_rejections(run_stats, options.validation)
+        print("=" * 50)
+        return
+
+    if args.sink != 'dir' and args.reemit:
+        print("错误: --reemit 只能用于目录输出 (--sink dir)。")
+        return
+    if args.dds_png and not decoding_available():
+        print("错误: --dds-png 需要安装 numpy。")
+        return
+    if args.sink == 'none' and args.index is not None:
+        print("错误: 试运行 (--sink none) 不能更新增量索引。")
+        return
+    if args.sink == 'none' and args.dedup:
+        # 去重索引保存在输出目录中, 试运行留下的标记会让之后的实际运行把图像当作重复跳过
+        print("错误: 试运行 (--sink none) 不能使用 --dedup。")
+        return
+
+    output_dir = args.output or os.path.join(input_dir, "extracted_all")
+    os.makedirs(output_dir, exist_ok=True)
+
+    print(f"\n输入: {args.image or input_dir or args.files_from}")
+    print(f"输出目录: {output_dir}")
+    if args.sector_align:
+        print(f"只检查 {args.sector_align} 字节边界上的签名")
+
+    print("\n开始处理...\n")
+
+    index_path = None
+    if args.index is not None:
+        index_path = args.index or os.path.join(output_dir, SCAN_INDEX_NAME)
+
+    dds_selection = None
+    if args.dds_mips or args.dds_max_size or args.dds_first_layer:
+        dds_selection = MipSelection(args.dds_mips, args.dds_max_size, args.dds_first_layer)
+
+    options = options._replace(dedup=args.dedup, dds_selection=dds_selection, sink=args.sink,
+                               shard_depth=args.shard_dirs, dds_preview=args.dds_png)
+    if args.image:
+        total_files, totals = process_image(args.image, output_dir, options, run_stats, args.sector_align)
+    else:
+        total_files, totals = process_directory(input_dir, output_dir, args.workers, shard_size,
+                                               options, index_path, args.reemit, run_stats, discovery)
+
+    print("\n" + "=" * 50)
+    print("处理完成!")
+    print(f"总文件数: {total_files}")
+    for fmt in HANDLERS:
+        print(f"提取的{fmt.upper()}图像: {totals[fmt]}")
+    if args.dedup:
+        print(f"重复而未写出的图像: {totals['duplicates']}")
+    if index_path:
+        print(f"未变化而跳过的文件: {totals['unchanged']}")
+    print(f"提取的文件保存在: {output_dir}")
+    print_rejections(run_stats, options.validation)
+    print("=" * 50)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import concurrent.futures
+import os
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
+
+def largest_first(file_paths: Iterable[str], sizes: Optional[Dict[str, int]] = None) -> List[str]:
+    # sizes 为遍历时已经取得的文件大小, 给出时不再逐个 stat
+    sized = []
+    for file_path in file_paths:
+        if sizes is not None and file_path in sizes:
+            size = sizes[file_path]
+        else:
+            try:
+                size = os.path.getsize(file_path)
+            except OSError:
+                size = 0
+        sized.append((size, file_path))
+
+    sized.sort(key=lambda item: item[0], reverse=True)
+    return [file_path for _, file_path in sized]
+
+def run_files(func: Callable, file_paths: Iterable[str], *args,
+              max_workers: Optional[int] = None,
+              backend: str = 'process',
+              sizes: Optional[Dict[str, int]] = None) -> Iterator[Tuple[str, Any, Optional[BaseException]]]:
+    # 按文件大小从大到小调度, 结果完成一个返回一个: (文件路径, 返回值, 异常)
+    # func 及其参数在 process 后端下必须可以被 pickle
+    ordered = largest_first(file_paths, sizes)
+    max_workers = max_workers or default_workers()
+
+    if max_workers == 1 or len(ordered) <= 1:
+        for file_path in ordered:
+            try:
+                yield file_path, func(file_path, *args), None
+            except Exception as e:
+                yield file_path, None, e
+        return
+
+    if backend == 'process':
+        executor_class = concurrent.futures.ProcessPoolExecutor
+    elif backend == 'thread':
+        executor_class = concurrent.futures.ThreadPoolExecutor
+    else:
+        raise ValueError(f"未知的执行后端: {backend}")
+
+    # 限制同时提交的任务数, 文件很多时不会一次性创建所有 future
+    max_pending = max_workers * 4
+    pending = {}
+    remaining = iter(ordered)
+
+    with executor_class(max_workers=max_workers) as executor:
+        while True:
+            while len(pending) < max_pending:
+                file_path = next(remaining, None)
+                if file_path is None:
+                    break
+                pending[executor.submit(func, file_path, *args)] = file_path
+
+            if not pending:
+                break
+
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                file_path = pending.pop(future)
+                try:
+                    yield file_path, future.result(), None
+                except Exception as e:
+                    yield file_path, None, e
+
+def split_ranges(total_size: int, shard_size: int) -> List[Tuple[int, int]]:
+    # 把一个文件切成若干 [start, stop) 字节区间, 每个区间只负责起点落在其中的图像
+    shard_size = max(1, shard_size)
+    return [(start, min(start + shard_size, total_size))
+            for start in range(0, total_size, shard_size)]
+
+def run_shards(func: Callable, file_path: str, ranges: List[Tuple[int, int]],
+               max_workers: Optional[int] = None) -> List[Any]:
+    # 并行扫描同一文件的多个区间, 结果按区间顺序返回
+    max_workers = max_workers or default_workers()
+    if max_workers == 1 or len(ranges) <= 1:
+        return [func(file_path, start, stop) for start, stop in ranges]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(func, file_path, start, stop) for start, stop in ranges]
+        return [future.result() for future in futures]
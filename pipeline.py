@@ -0,0 +1,164 @@
+import mmap
+import os
+import queue
+import threading
+import time
+from typing import Callable, List, Optional
+
+import stats
+from scanio import chunk_size, write_chunks
+
+DEFAULT_READ_BLOCK = 8 * 1024 * 1024
+DEFAULT_WRITE_QUEUE = 64 * 1024 * 1024
+
+def advise_sequential(file) -> None:
+    # 提示内核按顺序读取, 加大预读窗口
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+
+def prefetch_mapped(data, start: int, length: int) -> None:
+    # 对映射中即将扫描的区域发出异步预读, 不等待读取完成
+    if start >= len(data) or not isinstance(data, mmap.mmap) or not hasattr(mmap, 'MADV_WILLNEED'):
+        return
+    # madvise 的起点必须按页对齐
+    aligned = start - start % mmap.PAGESIZE
+    try:
+        data.madvise(mmap.MADV_WILLNEED, aligned, min(len(data), start + length) - aligned)
+    except OSError:
+        pass
+
+class PrefetchReader:
+    # 后台线程按大块顺序读取文件放入有界队列, 当前块被解压或扫描时下一块已经在读取
+    def __init__(self, file, block_size: int = DEFAULT_READ_BLOCK, depth: int = 2):
+        self.file = file
+        self.block_size = block_size
+        self._queue = queue.Queue(maxsize=depth)
+        self._buffer = b''
+        self._eof = False
+        self._closed = False
+        advise_sequential(file)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        try:
+            while not self._closed:
+                block = self.file.read(self.block_size)
+                self._queue.put(block)
+                if not block:
+                    return
+        except Exception as e:
+            self._queue.put(e)
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            block = self._queue.get()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                self._eof = True
+                break
+            self._buffer = self._buffer + block if self._buffer else block
+
+        if size < 0 or size >= len(self._buffer):
+            result, self._buffer = self._buffer, b''
+        else:
+            result, self._buffer = self._buffer[:size], self._buffer[size:]
+        return result
+
+    def readable(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        # 让读线程退出: 取走队列中的块, 使阻塞的 put 返回
+        self._closed = True
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class AsyncWriter:
+    # 写出由单独的线程完成, 扫描不必等待输出存储. 排队中的字节数超过上限时 submit 阻塞,
+    # 输出存储较慢时对扫描形成背压, 内存不会无限增长
+    def __init__(self, max_pending_bytes: int = DEFAULT_WRITE_QUEUE, threads: int = 1,
+                 write: Callable[[str, List], None] = write_chunks):
+        # write(name, chunks) 完成实际写出; 单线程时按提交顺序执行, 可用于顺序追加的归档
+        self.max_pending_bytes = max_pending_bytes
+        self.write = write
+        self._queue = queue.Queue()
+        self._condition = threading.Condition()
+        self._pending_bytes = 0
+        self._pending_items = 0
+        self._error: Optional[BaseException] = None
+        self._threads = [threading.Thread(target=self._run, daemon=True) for _ in range(max(1, threads))]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, output_path: str, chunks: List) -> None:
+        # chunks 为依次写入的 bytes/memoryview/FileRange; 其底层数据和 fd 在写出完成前必须保持有效
+        size = sum(chunk_size(chunk) for chunk in chunks)
+        started = time.perf_counter()
+        with self._condition:
+            while (self._error is None and self._pending_items and
+                   self._pending_bytes + size > self.max_pending_bytes):
+                self._condition.wait()
+            if self._error is not None:
+                raise self._error
+            self._pending_bytes += size
+            self._pending_items += 1
+        stats.CURRENT.timers['write_wait'] += time.perf_counter() - started
+        self._queue.put((output_path, chunks, size))
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            size = item[2]
+            try:
+                self.write(*item[:2])
+            except Exception as e:
+                with self._condition:
+                    if self._error is None:
+                        self._error = e
+            finally:
+                # 写完立即释放对数据的引用, 否则映射在写出完成后仍无法关闭
+                item = None
+                with self._condition:
+                    self._pending_bytes -= size
+                    self._pending_items -= 1
+                    self._condition.notify_all()
+
+    def drain(self) -> None:
+        # 等待已提交的写出全部完成
+        with self._condition:
+            while self._pending_items:
+                self._condition.wait()
+            if self._error is not None:
+                raise self._error
+
+    def close(self) -> None:
+        try:
+            self.drain()
+        finally:
+            for _ in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
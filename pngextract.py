@@ -1,50 +1,179 @@
 import os
 import struct
+import zlib
+
+import stats
+from discovery import DiscoveryOptions, discover_files
+from parallel import run_files
+from scanio import copy_range
+from sinks import output_name, output_stem
+from validation import FAST, STRICT, STRUCTURAL
+
+PNG_SIGNATURE = b'\x89\x50\x4E\x47'
+PNG_FULL_SIGNATURE = b'\x89\x50\x4E\x47\x0D\x0A\x1A\x0A'
+PNG_MAX_CHUNK_LENGTH = 0x7FFFFFFF
+DEFAULT_MAX_PNG_SIZE = 256 * 1024 * 1024
+
+def is_chunk_header(length: int, chunk_type: bytes) -> bool:
+    # 块类型必须是4个ASCII字母, 长度不超过2^31-1
+    return length <= PNG_MAX_CHUNK_LENGTH and chunk_type.isalpha()
+
+# IHDR 中合法的 (颜色类型, 位深) 组合
+PNG_BIT_DEPTHS = {0: (1, 2, 4, 8, 16), 2: (8, 16), 3: (1, 2, 4, 8), 4: (8, 16), 6: (8, 16)}
+
+def png_length(data, pos: int, max_size: int = DEFAULT_MAX_PNG_SIZE, level: str = STRUCTURAL) -> int:
+    # 按每个块的长度字段逐块跳转, 直到 IEND.
+    # fast 只检查签名和 IHDR, 中间的块只看长度; strict 另外校验每个块的 CRC 与块的顺序
+    if data[pos:pos + 8] != PNG_FULL_SIGNATURE:
+        stats.reject('png', 'bad_signature')
+        return 0
+
+    structural = level != FAST
+    strict = level == STRICT
+    offset = pos + 8
+    expected_type = b'IHDR'
+    seen_idat = False
+    idat_ended = False
+    while offset + 8 <= len(data):
+        length, chunk_type = struct.unpack_from('>I4s', data, offset)
+        if length > PNG_MAX_CHUNK_LENGTH or (structural and not chunk_type.isalpha()):
+            stats.reject('png', 'bad_chunk')
+            return 0
+        if expected_type is not None and chunk_type != expected_type:
+            stats.reject('png', 'no_ihdr')
+            return 0
+
+        chunk_end = offset + 12 + length
+        if chunk_end - pos > max_size:
+            stats.reject('png', 'size_cap')
+            return 0
+        if chunk_end > len(data):
+            break
+
+        if strict:
+            stored_crc = struct.unpack_from('>I', data, chunk_end - 4)[0]
+            if zlib.crc32(memoryview(data)[offset + 4:chunk_end - 4]) != stored_crc:
+                stats.reject('png', 'crc_mismatch')
+                return 0
+            if expected_type is not None and not ihdr_is_valid(data, offset, length):
+                stats.reject('png', 'bad_ihdr')
+                return 0
+            # IDAT 必须连续出现, PLTE 必须在 IDAT 之前
+            if chunk_type == b'IDAT':
+                if idat_ended:
+                    stats.reject('png', 'chunk_order')
+                    return 0
+                seen_idat = True
+            elif seen_idat:
+                idat_ended = True
+                if chunk_type in (b'PLTE', b'IHDR'):
+                    stats.reject('png', 'chunk_order')
+                    return 0
+
+        offset = chunk_end
+        if chunk_type == b'IEND':
+            if strict and not seen_idat:
+                stats.reject('png', 'no_idat')
+                return 0
+            return offset - pos
+        expected_type = None
+
+    stats.reject('png', 'truncated')
+    return 0
+
+def ihdr_is_valid(data, offset: int, length: int) -> bool:
+    if length != 13:
+        return False
+    width, height, bit_depth, color_type, compression, filter_method, interlace = \
+        struct.unpack_from('>IIBBBBB', data, offset + 8)
+    return (0 < width <= PNG_MAX_CHUNK_LENGTH and 0 < height <= PNG_MAX_CHUNK_LENGTH and
+            bit_depth in PNG_BIT_DEPTHS.get(color_type, ()) and
+            compression == 0 and filter_method == 0 and interlace in (0, 1))
+
+def png_metadata(data, pos: int) -> dict:
+    # IHDR 紧跟在签名之后: 长度(4) 类型(4) 宽(4) 高(4) 位深(1) 颜色类型(1)
+    if pos + 26 > len(data):
+        return {}
+    width, height, bit_depth, color_type = struct.unpack_from('>IIBB', data, pos + 16)
+    return {'width': width, 'height': height, 'bit_depth': bit_depth, 'color_type': color_type}
+
+def png_stream_length(file, pos: int, max_size: int = DEFAULT_MAX_PNG_SIZE) -> int:
+    # 与 png_length 相同, 但在文件流上只读取块头, 块数据直接 seek 跳过
+    file.seek(pos)
+    if file.read(8) != PNG_FULL_SIGNATURE:
+        return 0
+
+    total = 8
+    expected_type = b'IHDR'
+    while True:
+        header = file.read(8)
+        if len(header) < 8:
+            return 0
+        length, chunk_type = struct.unpack('>I4s', header)
+        if not is_chunk_header(length, chunk_type):
+            return 0
+        if expected_type is not None and chunk_type != expected_type:
+            return 0
+
+        total += 12 + length
+        if total > max_size:
+            return 0
+        if chunk_type == b'IEND':
+            # IEND 之后文件必须还有4字节CRC
+            file.seek(pos + total - 4)
+            return total if len(file.read(4)) == 4 else 0
+
+        file.seek(length + 4, os.SEEK_CUR)
+        expected_type = None
+
+def extract_content(file_path, directory_path, max_size=DEFAULT_MAX_PNG_SIZE):
+    buffer_size = 8192
+    start_seq_len = len(PNG_SIGNATURE)
+    extracted_count = 0
 
-def extract_content(file_path, directory_path, start_sequence, block_marker, end_sequence):
-    buffer_size = 8192 
-    start_seq_len = len(start_sequence)
-    end_seq_len = len(end_sequence)
-    
     with open(file_path, 'rb') as file:
         leftover = b''
-        current_png = None
-        found_start = False
-        
+        position = 0
+
         while True:
             chunk = file.read(buffer_size)
-            if not chunk: 
+            if not chunk:
                 break
-                
+
             data = leftover + chunk
-            
-            if not found_start:
-                start_index = data.find(start_sequence)
-                if start_index != -1:
-                    found_start = True
-                    current_png = data[start_index:]
-                    leftover = b''
-                else:
-                    leftover = data[-start_seq_len + 1:] if len(data) >= start_seq_len else data
+
+            start_index = data.find(PNG_SIGNATURE)
+            if start_index == -1:
+                leftover = data[-start_seq_len + 1:] if len(data) >= start_seq_len else data
+                position += len(data) - len(leftover)
+                continue
+
+            png_start = position + start_index
+            png_size = png_stream_length(file, png_start, max_size)
+
+            if png_size:
+                # 名称由源文件名和偏移决定, 并行处理和重复运行时都不会冲突
+                new_filename = output_name(output_stem(file_path), png_start, 'png')
+                new_filepath = os.path.join(directory_path, new_filename)
+                os.makedirs(os.path.dirname(new_filepath), exist_ok=True)
+                with open(new_filepath, 'wb') as new_file:
+                    copy_range(file, new_file, png_start, png_size, buffer_size)
+                print(f"提取的内容另存为: {new_filepath}")
+                extracted_count += 1
+                position = png_start + png_size
             else:
-                current_png += chunk
-                
-                end_index = current_png.find(end_sequence)
-                if end_index != -1:
-                    end_index += end_seq_len
-                    extracted_data = current_png[:end_index]
-                    
-                    if block_marker in extracted_data:
-                        new_filename = f"{os.path.splitext(os.path.basename(file_path))[0]}_{len(os.listdir(directory_path))}.png"
-                        new_filepath = os.path.join(directory_path, new_filename)
-                        os.makedirs(os.path.dirname(new_filepath), exist_ok=True)
-                        with open(new_filepath, 'wb') as new_file:
-                            new_file.write(extracted_data)
-                        print(f"提取的内容另存为: {new_filepath}")
-                    
-                    found_start = False
-                    leftover = current_png[end_index:]
-                    current_png = None
+                position = png_start + 1
+
+            file.seek(position)
+            leftover = b''
+
+    return extracted_count
+
+def extract_content_into_tree(file_path, directory_path, output_base_dir, max_size=DEFAULT_MAX_PNG_SIZE):
+    # 在输出目录下按源文件的相对路径存放, 不再写到源文件旁边
+    print(f"处理文件: {file_path}")
+    output_dir = os.path.join(output_base_dir, os.path.relpath(os.path.dirname(file_path), directory_path))
+    return extract_content(file_path, output_dir, max_size)
 
 def main():
     directory_path = input("请输入要处理的文件夹路径: ")
@@ -52,16 +181,17 @@ def main():
         print(f"错误: {directory_path} 不是一个有效的目录。")
         return
 
-    start_sequence = b'\x89\x50\x4E\x47'
-    block_marker = b'\x49\x48\x44\x52'
-    end_sequence = b'\x00\x00\x00\x49\x45\x4E\x44\xAE\x42\x60\x82'
+    output_base_dir = os.path.join(directory_path, "extracted_png")
+    entries = discover_files(directory_path, DiscoveryOptions(exclude=('*.py', '*.png')),
+                             exclude_paths=[output_base_dir])
+    file_paths = [entry.path for entry in entries]
+    sizes = {entry.path: entry.size for entry in entries}
 
-    for root, dirs, files in os.walk(directory_path):
-        for file in files:
-            file_path = os.path.join(root, file)
-            if not file.endswith(('.py', '.png')):
-                print(f"处理文件: {file_path}")
-                extract_content(file_path, directory_path, start_sequence, block_marker, end_sequence)
+    for file_path, _, error in run_files(extract_content_into_tree, file_paths, directory_path, output_base_dir,
+                                         sizes=sizes):
+        if error is not None:
+            print(f"处理文件 {file_path} 时出错: {str(error)}")
+    print(f"PNG 文件提取完成, 保存在: {output_base_dir}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,132 @@
+import io
+import os
+import sqlite3
+import time
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from ddsextract import MipSelection, dds_chunks
+from scanio import copy_range, open_mapped, write_chunks
+from sources import copy_member_range, open_member
+
+SCAN_INDEX_NAME = 'scan_index.sqlite'
+
+class IndexedHit(NamedTuple):
+    format: str
+    offset: int
+    length: int
+    output: str
+    source: str = ''  # 来自压缩包成员时为成员标识, 偏移相对于解压后的成员
+
+def file_key(file_path: str) -> Tuple[int, int, int]:
+    st = os.stat(file_path)
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+class ScanIndex:
+    # 增量扫描索引: 以 (路径, 大小, mtime, inode) 判断文件是否变化, 并记录找到的每个图像.
+    # 同时记录扫描时影响输出的选项 (fingerprint), 选项改变后文件要重新扫描.
+    # 每处理完一个文件就提交一次, 因此中断后重新运行会从最后完成的文件之后继续.
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                formats TEXT NOT NULL,
+                completed_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS hits (
+                path TEXT NOT NULL,
+                format TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                output TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS hits_by_path ON hits (path);
+        ''')
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(hits)')}
+        if 'source' not in columns:
+            # 旧版本创建的索引没有 source 列
+            self.conn.execute("ALTER TABLE hits ADD COLUMN source TEXT NOT NULL DEFAULT ''")
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(files)')}
+        if 'options' not in columns:
+            self.conn.execute("ALTER TABLE files ADD COLUMN options TEXT NOT NULL DEFAULT ''")
+        self.conn.commit()
+
+    def is_unchanged(self, file_path: str, formats: Iterable[str],
+                     current_key: Optional[Tuple[int, int, int]] = None, fingerprint: str = '') -> bool:
+        row = self.conn.execute(
+            'SELECT size, mtime_ns, inode, formats, options FROM files WHERE path = ?',
+            (os.path.abspath(file_path),)).fetchone()
+        if row is None:
+            return False
+
+        if current_key is None:
+            try:
+                current_key = file_key(file_path)
+            except OSError:
+                return False
+
+        scanned_formats = set(row[3].split(','))
+        return tuple(row[:3]) == current_key and set(formats) <= scanned_formats and row[4] == fingerprint
+
+    def get_hits(self, file_path: str) -> List[IndexedHit]:
+        rows = self.conn.execute(
+            'SELECT format, offset, length, output, source FROM hits WHERE path = ? ORDER BY rowid',
+            (os.path.abspath(file_path),)).fetchall()
+        return [IndexedHit(*row) for row in rows]
+
+    def record(self, file_path: str, formats: Iterable[str], hits: Iterable[IndexedHit],
+               key: Optional[Tuple[int, int, int]] = None, fingerprint: str = '') -> None:
+        # key 应在扫描前取得, 扫描期间文件被修改时下次运行会重新扫描
+        path = os.path.abspath(file_path)
+        size, mtime_ns, inode = key or file_key(file_path)
+
+        with self.conn:
+            self.conn.execute('DELETE FROM hits WHERE path = ?', (path,))
+            self.conn.executemany(
+                'INSERT INTO hits (path, format, offset, length, output, source) VALUES (?, ?, ?, ?, ?, ?)',
+                [(path, hit.format, hit.offset, hit.length, hit.output, hit.source) for hit in hits])
+            self.conn.execute(
+                'INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, formats, completed_at, options) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (path, size, mtime_ns, inode, ','.join(sorted(formats)), time.time(), fingerprint))
+
+    def close(self) -> None:
+        self.conn.close()
+
+def reemit_missing(file_path: str, hits: Iterable[IndexedHit], selection: Optional[MipSelection] = None) -> int:
+    # 按记录的偏移直接定位读取, 补写缺失的输出文件, 不重新扫描源文件.
+    # 扫描时选择了 DDS mip (索引的选项记录保证与本次相同), 按同样的选择重写头并只写出保留的区间
+    missing = [hit for hit in hits if not os.path.exists(hit.output)]
+    direct = [hit for hit in missing if not hit.source]
+
+    if direct:
+        with open(file_path, 'rb') as in_file, open_mapped(file_path) as data:
+            for hit in direct:
+                if hit.format == 'dds' and selection is not None:
+                    write_chunks(hit.output, dds_chunks(data, hit.offset, hit.length, selection, in_file.fileno()))
+                    continue
+                os.makedirs(os.path.dirname(hit.output), exist_ok=True)
+                with open(hit.output, 'wb') as out_file:
+                    copy_range(in_file, out_file, hit.offset, hit.length)
+
+    # 压缩包成员不能随机访问, 每个图像重新打开成员并向前读到其偏移
+    for hit in missing:
+        if not hit.source:
+            continue
+        os.makedirs(os.path.dirname(hit.output), exist_ok=True)
+        with open_member(hit.source) as stream:
+            if hit.format == 'dds' and selection is not None:
+                buffer = io.BytesIO()
+                copy_member_range(stream, buffer, hit.offset, hit.length)
+                write_chunks(hit.output, dds_chunks(buffer.getvalue(), 0, hit.length, selection))
+                continue
+            with open(hit.output, 'wb') as out_file:
+                copy_member_range(stream, out_file, hit.offset, hit.length)
+
+    return len(missing)
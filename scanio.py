@@ -0,0 +1,143 @@
+import errno
+import io
+import mmap
+import os
+import sys
+from contextlib import contextmanager
+from typing import Iterable, NamedTuple, Optional
+
+# 内核复制在这些错误下不可用 (旧内核、跨文件系统、不支持的文件类型), 出现后本进程不再尝试
+KERNEL_COPY_ERRORS = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.ESPIPE}
+# sendfile 只有 Linux 支持普通文件作为输出
+KERNEL_COPY = {
+    'copy_file_range': hasattr(os, 'copy_file_range'),
+    'sendfile': hasattr(os, 'sendfile') and sys.platform.startswith('linux'),
+}
+
+class FileRange(NamedTuple):
+    # 源文件中的一段, 写出时在内核中复制, 数据不经过 Python;
+    # fallback 为同一段数据的 memoryview (通常来自映射), 内核复制不可用时写出它
+    fd: int
+    offset: int
+    length: int
+    fallback: Optional[memoryview] = None
+
+def chunk_size(chunk) -> int:
+    return chunk.length if isinstance(chunk, FileRange) else len(chunk)
+
+@contextmanager
+def open_mapped(file_path: str):
+    # 以只读方式映射整个文件, 常驻内存由页缓存决定而不随文件大小增长
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if hasattr(mapped, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            yield mapped
+        finally:
+            release_mapping(mapped)
+
+def release_mapping(mapped) -> None:
+    # 调用方仍持有映射中数据的 memoryview 时 (例如 carve 返回的 payload) 不能关闭,
+    # 映射在这些引用释放后由垃圾回收关闭
+    try:
+        mapped.close()
+    except BufferError:
+        pass
+
+def kernel_copy(in_fd: int, out_fd: int, pos: int, length: int) -> int:
+    # 把 in_fd 中 [pos, pos + length) 在内核中复制到 out_fd 的当前位置, 不改变 in_fd 的位置.
+    # 返回复制的字节数; 内核复制不可用时可能少于 length, 剩余部分由调用方用其他方式复制
+    copied = 0
+    for method in ('copy_file_range', 'sendfile'):
+        if not KERNEL_COPY[method]:
+            continue
+        try:
+            while copied < length:
+                if method == 'copy_file_range':
+                    count = os.copy_file_range(in_fd, out_fd, length - copied, pos + copied)
+                else:
+                    count = os.sendfile(out_fd, in_fd, pos + copied, length - copied)
+                if count == 0:
+                    # 源文件在此结束
+                    return copied
+                copied += count
+            return copied
+        except OSError as e:
+            if e.errno not in KERNEL_COPY_ERRORS:
+                raise
+            KERNEL_COPY[method] = False
+    return copied
+
+def write_all(fd: int, data) -> None:
+    with memoryview(data) as view:
+        while view:
+            view = view[os.write(fd, view):]
+
+def chunk_data(chunk, start: int = 0):
+    # 取得块的数据 (FileRange 时为其映射视图或从文件读取), 供必须经过 Python 的输出使用
+    if not isinstance(chunk, FileRange):
+        return chunk[start:] if start else chunk
+    if chunk.fallback is not None:
+        return chunk.fallback[start:]
+    return os.pread(chunk.fd, chunk.length - start, chunk.offset + start)
+
+def write_chunks_to(fd: int, chunks: Iterable) -> int:
+    # 在 fd 的当前位置按顺序写出 bytes/memoryview/FileRange, 返回写出的字节数
+    written = 0
+    for chunk in chunks:
+        if isinstance(chunk, FileRange):
+            copied = kernel_copy(chunk.fd, fd, chunk.offset, chunk.length)
+            if copied < chunk.length:
+                write_all(fd, chunk_data(chunk, copied))
+        else:
+            write_all(fd, chunk)
+        written += chunk_size(chunk)
+    return written
+
+def write_chunks(output_path: str, chunks: Iterable) -> None:
+    # 直接使用 fd, 不创建缓冲文件对象. 目录通常已经存在, 只有打开失败时才创建,
+    # 每个图像不必再调用 makedirs; 也不缓存已创建的目录, 目录在两次调用之间被删除时仍能重新创建
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+    try:
+        fd = os.open(output_path, flags, 0o666)
+    except FileNotFoundError:
+        ensure_directory(os.path.dirname(output_path))
+        fd = os.open(output_path, flags, 0o666)
+    try:
+        write_chunks_to(fd, chunks)
+    finally:
+        os.close(fd)
+
+def ensure_directory(directory: str) -> None:
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+def copy_range(in_file, out_file, pos: int, length: int, buffer_size: int = 1024 * 1024) -> None:
+    # 从可 seek 的文件中按位置复制一段字节, 内存占用不超过 buffer_size.
+    # 两者都是普通文件时先尝试在内核中复制, 数据不经过用户空间
+    try:
+        in_fd, out_fd = in_file.fileno(), out_file.fileno()
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        in_fd = out_fd = None
+    if in_fd is not None:
+        out_file.flush()
+        copied = kernel_copy(in_fd, out_fd, pos, length)
+        if copied == length:
+            return
+        # 之后经由文件对象写出, 先与内核写到的位置同步
+        out_file.seek(0, os.SEEK_END)
+        pos += copied
+        length -= copied
+
+    in_file.seek(pos)
+    while length > 0:
+        piece = in_file.read(min(buffer_size, length))
+        if not piece:
+            break
+        out_file.write(piece)
+        length -= len(piece)
@@ -0,0 +1,211 @@
+import hashlib
+import os
+import re
+import tarfile
+import time
+import zipfile
+from contextlib import contextmanager
+from typing import List
+
+from pipeline import DEFAULT_WRITE_QUEUE, AsyncWriter
+from scanio import chunk_data, chunk_size, ensure_directory, write_all, write_chunks, write_chunks_to
+from sources import MEMBER_SEPARATOR, member_label, split_label
+
+SINKS = ('dir', 'tar', 'zip', 'none')
+
+TAR_BLOCK = tarfile.BLOCKSIZE
+# zip 的时间戳不能早于 1980 年
+ZIP_EPOCH = 315532800
+
+def path_digest(file_path: str) -> str:
+    return hashlib.blake2b(os.path.abspath(file_path).encode('utf-8', 'surrogateescape'),
+                           digest_size=4).hexdigest()
+
+def output_stem(file_path: str, source: str = '') -> str:
+    # 输出名中代表来源的部分: <源文件名去掉扩展名>-<路径哈希>; 压缩包成员为 <压缩包名>_<成员名>-<路径哈希>.
+    # 不同目录中的同名输入写到同一个格式目录时不会互相覆盖
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    if source:
+        prefix = file_path + MEMBER_SEPARATOR
+        member = source[len(prefix):] if source.startswith(prefix) else split_label(source)[1]
+        stem = re.sub(r'[^\w.-]', '_', f"{stem}_{os.path.splitext(os.path.basename(member))[0]}")
+    return f"{stem}-{path_digest(file_path)}"
+
+def output_name(stem: str, offset: int, fmt: str) -> str:
+    # 名称只由来源和偏移决定, 与扫描顺序、并行方式和已有的输出无关, 重复运行得到相同的名称
+    return f"{stem}@{offset}.{fmt}"
+
+def archive_path(output_dir: str, file_path: str, extension: str) -> str:
+    # 每个输入一个归档; 不同目录中的同名输入由路径哈希区分, 并行写出时不会写到同一个归档
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(output_dir, f"{stem}-{path_digest(file_path)}.{extension}")
+
+def source_mtime(file_path: str) -> int:
+    try:
+        return int(os.stat(file_path).st_mtime)
+    except OSError:
+        return 0
+
+class DirectorySink:
+    # 每个图像一个文件. shard_depth > 0 时按名称哈希分到多级子目录 (每级 256 个),
+    # 单个目录中的文件数不会过多
+    def __init__(self, output_dir: str, shard_depth: int = 0, write_queue: int = DEFAULT_WRITE_QUEUE,
+                 write_threads: int = 1):
+        self.output_dir = output_dir
+        self.shard_depth = shard_depth
+        self.writer = AsyncWriter(write_queue, write_threads) if write_queue else None
+
+    @property
+    def buffered(self) -> bool:
+        return self.writer is not None
+
+    def output(self, name: str) -> str:
+        if not self.shard_depth:
+            return os.path.join(self.output_dir, name)
+        directory, filename = os.path.split(name)
+        digest = hashlib.blake2b(filename.encode('utf-8', 'surrogateescape'), digest_size=8).hexdigest()
+        buckets = [digest[2 * i:2 * i + 2] for i in range(self.shard_depth)]
+        return os.path.join(self.output_dir, directory, *buckets, filename)
+
+    def write(self, name: str, chunks: List) -> str:
+        output_path = self.output(name)
+        if self.writer is not None:
+            self.writer.submit(output_path, chunks)
+        else:
+            write_chunks(output_path, chunks)
+        return output_path
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+
+class ArchiveSink:
+    # 一个输入的所有图像顺序追加到同一个归档. 追加由单个写线程按提交顺序完成,
+    # 输出记录为 <归档路径>!<成员名>. 归档在第一次写出时才创建, 没有图像的输入不留下空归档
+    extension = ''
+
+    def __init__(self, output_dir: str, file_path: str, write_queue: int = DEFAULT_WRITE_QUEUE):
+        self.output_dir = output_dir
+        self.path = archive_path(output_dir, file_path, self.extension)
+        self.mtime = source_mtime(file_path)
+        self.opened = False
+        self.writer = AsyncWriter(write_queue, 1, write=self._append) if write_queue else None
+
+    @property
+    def buffered(self) -> bool:
+        return self.writer is not None
+
+    def output(self, name: str) -> str:
+        return member_label(self.path, name)
+
+    def write(self, name: str, chunks: List) -> str:
+        if not self.opened:
+            ensure_directory(self.output_dir)
+            self._open()
+            self.opened = True
+        if self.writer is not None:
+            self.writer.submit(name, chunks)
+        else:
+            self._append(name, chunks)
+        return self.output(name)
+
+    def close(self) -> None:
+        try:
+            if self.writer is not None:
+                self.writer.close()
+        finally:
+            if self.opened:
+                self._close()
+
+    def _open(self) -> None:
+        raise NotImplementedError
+
+    def _append(self, name: str, chunks: List) -> None:
+        raise NotImplementedError
+
+    def _close(self) -> None:
+        raise NotImplementedError
+
+class TarSink(ArchiveSink):
+    # 不经过 tarfile 的文件对象: 头部由 TarInfo 生成, 数据与普通输出一样由内核复制
+    extension = 'tar'
+
+    def _open(self) -> None:
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o666)
+        self.position = 0
+
+    def _append(self, name: str, chunks: List) -> None:
+        info = tarfile.TarInfo(name)
+        info.size = sum(chunk_size(chunk) for chunk in chunks)
+        info.mtime = self.mtime
+        info.mode = 0o644
+        # PAX 格式支持超过 8 GB 的成员和长名称
+        header = info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+        write_all(self.fd, header)
+        write_chunks_to(self.fd, chunks)
+        padding = -info.size % TAR_BLOCK
+        if padding:
+            write_all(self.fd, bytes(padding))
+        self.position += len(header) + info.size + padding
+
+    def _close(self) -> None:
+        try:
+            # 结尾为两个空块, 再补齐到 tarfile 的记录长度
+            end = self.position + 2 * TAR_BLOCK
+            write_all(self.fd, bytes(end - self.position + (-end % tarfile.RECORDSIZE)))
+        finally:
+            os.close(self.fd)
+
+class ZipSink(ArchiveSink):
+    # 只存储不压缩; 图像本身已经压缩, 再压缩得不偿失. zip 需要计算 CRC, 数据必须经过 Python
+    extension = 'zip'
+
+    def _open(self) -> None:
+        self.archive = zipfile.ZipFile(self.path, 'w', zipfile.ZIP_STORED, allowZip64=True)
+        self.date_time = time.gmtime(max(self.mtime, ZIP_EPOCH))[:6]
+
+    def _append(self, name: str, chunks: List) -> None:
+        info = zipfile.ZipInfo(name, self.date_time)
+        info.compress_type = zipfile.ZIP_STORED
+        info.file_size = sum(chunk_size(chunk) for chunk in chunks)
+        with self.archive.open(info, 'w', force_zip64=info.file_size >= zipfile.ZIP64_LIMIT) as out:
+            for chunk in chunks:
+                out.write(chunk_data(chunk))
+
+    def _close(self) -> None:
+        self.archive.close()
+
+class NullSink:
+    # 试运行: 扫描、校验和统计照常进行, 不写出任何数据
+    buffered = False
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+
+    def output(self, name: str) -> str:
+        return os.path.join(self.output_dir, name)
+
+    def write(self, name: str, chunks: List) -> str:
+        return self.output(name)
+
+    def close(self) -> None:
+        pass
+
+@contextmanager
+def open_sink(kind: str, output_dir: str, file_path: str, shard_depth: int = 0,
+              write_queue: int = DEFAULT_WRITE_QUEUE, write_threads: int = 1):
+    # 退出时等待所有写出完成并结束归档; 写线程必须在数据 (映射) 关闭之前结束
+    if kind == 'dir':
+        sink = DirectorySink(output_dir, shard_depth, write_queue, write_threads)
+    elif kind == 'tar':
+        sink = TarSink(output_dir, file_path, write_queue)
+    elif kind == 'zip':
+        sink = ZipSink(output_dir, file_path, write_queue)
+    elif kind == 'none':
+        sink = NullSink(output_dir)
+    else:
+        raise ValueError(f"未知的输出方式: {kind}")
+    try:
+        yield sink
+    finally:
+        sink.close()
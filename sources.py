@@ -0,0 +1,200 @@
+import bz2
+import gzip
+import lzma
+import os
+import re
+import tarfile
+import zipfile
+import zlib
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+from pipeline import DEFAULT_READ_BLOCK, PrefetchReader
+from scanio import open_mapped
+
+# 压缩包内成员的标识: <压缩包路径>!<成员名>, 图像再附加 @<成员内偏移>
+MEMBER_SEPARATOR = '!'
+ZLIB_MEMBER_PREFIX = 'zlib:'
+
+COMPRESSED_OPENERS = {
+    'gzip': gzip.open,
+    'bz2': bz2.open,
+    'xz': lzma.open,
+}
+
+# 损坏或截断的压缩数据在读取过程中抛出的异常
+STREAM_ERRORS = (EOFError, OSError, zlib.error, lzma.LZMAError, zipfile.BadZipFile, tarfile.TarError)
+
+# 原始 zlib 流的头: CMF=0x78 (32K 窗口), FLG 使 CMF*256+FLG 为 31 的倍数
+ZLIB_HEADER_PATTERN = re.compile(rb'\x78[\x01\x5E\x9C\xDA]')
+ZLIB_READ_SIZE = 64 * 1024
+ZLIB_PROBE_SIZE = 4096
+
+def container_kind(file_path: str) -> Optional[str]:
+    # 按文件头识别压缩包/压缩流, 不是容器时返回 None
+    with open(file_path, 'rb') as f:
+        head = f.read(262)
+
+    if head.startswith((b'PK\x03\x04', b'PK\x05\x06')) and zipfile.is_zipfile(file_path):
+        return 'zip'
+    if head[257:262] == b'ustar':
+        return 'tar'
+    if head.startswith(b'\x1f\x8b'):
+        return 'gzip'
+    if head.startswith(b'BZh'):
+        return 'bz2'
+    if head.startswith(b'\xfd7zXZ\x00'):
+        return 'xz'
+    return None
+
+def member_label(file_path: str, member: str) -> str:
+    return f"{file_path}{MEMBER_SEPARATOR}{member}"
+
+def split_label(label: str) -> Tuple[str, str]:
+    # 路径和成员名中都可能含有 '!', 取第一个使前半部分为现有文件的位置
+    index = label.find(MEMBER_SEPARATOR)
+    while index != -1:
+        if os.path.isfile(label[:index]):
+            return label[:index], label[index + 1:]
+        index = label.find(MEMBER_SEPARATOR, index + 1)
+    raise ValueError(f"不是压缩包成员: {label}")
+
+def is_compressed_tar(file_path: str, kind: str) -> bool:
+    try:
+        with COMPRESSED_OPENERS[kind](file_path, 'rb') as stream:
+            return stream.read(262)[257:262] == b'ustar'
+    except STREAM_ERRORS:
+        return False
+
+def compressed_member_name(file_path: str) -> str:
+    # 单个压缩流没有成员名, 使用去掉压缩扩展名后的文件名
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+def iter_members(file_path: str, read_block: int = DEFAULT_READ_BLOCK) -> Iterator[Tuple[str, BinaryIO]]:
+    # 依次产生 (成员标识, 解压流); 流只在下一次迭代之前有效.
+    # 顺序读取的格式由后台线程预读压缩数据, 读盘与解压、扫描重叠进行
+    kind = container_kind(file_path)
+
+    if kind == 'zip':
+        with zipfile.ZipFile(file_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                with archive.open(info) as stream:
+                    yield member_label(file_path, info.filename), stream
+
+    elif kind == 'tar' or (kind in COMPRESSED_OPENERS and is_compressed_tar(file_path, kind)):
+        # 流式模式按顺序读取, 不需要随机访问解压后的数据
+        with PrefetchReader(open(file_path, 'rb'), read_block) as raw, \
+                tarfile.open(fileobj=raw, mode='r|*') as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                stream = archive.extractfile(member)
+                yield member_label(file_path, member.name), stream
+
+    elif kind in COMPRESSED_OPENERS:
+        with PrefetchReader(open(file_path, 'rb'), read_block) as raw, \
+                COMPRESSED_OPENERS[kind](raw, 'rb') as stream:
+            yield member_label(file_path, compressed_member_name(file_path)), stream
+
+class ZlibStream:
+    # 从内存数据 (通常是文件映射) 中某个偏移处的原始 zlib 流按需解压
+    def __init__(self, data, offset: int):
+        self.data = data
+        self.offset = offset
+        self.pos = offset
+        self.decompressor = zlib.decompressobj()
+        self._buffer = bytearray()
+
+    @property
+    def eof(self) -> bool:
+        return self.decompressor.eof
+
+    @property
+    def end(self) -> int:
+        # 压缩数据的结束位置, 仅在 eof 之后有意义
+        return self.pos - len(self.decompressor.unused_data)
+
+    def read(self, size: int = -1) -> bytes:
+        while (size < 0 or len(self._buffer) < size) and not self.decompressor.eof:
+            compressed = self.decompressor.unconsumed_tail
+            if not compressed:
+                if self.pos >= len(self.data):
+                    break
+                compressed = self.data[self.pos:self.pos + ZLIB_READ_SIZE]
+                self.pos += len(compressed)
+            # 限制单次解压的输出, 高压缩比的数据不会一次占用大量内存
+            self._buffer += self.decompressor.decompress(compressed, ZLIB_READ_SIZE * 16)
+
+        if size < 0:
+            size = len(self._buffer)
+        result = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return result
+
+    def close(self) -> None:
+        self._buffer = bytearray()
+
+def is_zlib_stream(data, pos: int) -> bool:
+    # 只试解压开头一小段; 随机数据中的假头通常很快出错
+    try:
+        zlib.decompressobj().decompress(data[pos:pos + ZLIB_PROBE_SIZE], ZLIB_PROBE_SIZE)
+    except zlib.error:
+        return False
+    return True
+
+def iter_zlib_streams(file_path: str, data) -> Iterator[Tuple[str, ZlibStream]]:
+    # 在数据中查找原始 zlib 流, 依次产生 (成员标识, 解压流).
+    # 调用方读完一个流后, 从其压缩数据的末尾继续查找
+    match = ZLIB_HEADER_PATTERN.search(data)
+    while match is not None:
+        pos = match.start()
+        if not is_zlib_stream(data, pos):
+            match = ZLIB_HEADER_PATTERN.search(data, pos + 1)
+            continue
+
+        stream = ZlibStream(data, pos)
+        yield member_label(file_path, f"{ZLIB_MEMBER_PREFIX}{pos}"), stream
+        resume = stream.end if stream.eof else pos + 1
+        match = ZLIB_HEADER_PATTERN.search(data, max(resume, pos + 1))
+
+@contextmanager
+def open_member(label: str):
+    # 按成员标识重新打开解压流, 供按清单或索引补写输出时使用
+    file_path, member = split_label(label)
+
+    if member.startswith(ZLIB_MEMBER_PREFIX) and member[len(ZLIB_MEMBER_PREFIX):].isdigit():
+        with open_mapped(file_path) as data:
+            yield ZlibStream(data, int(member[len(ZLIB_MEMBER_PREFIX):]))
+        return
+
+    kind = container_kind(file_path)
+    if kind == 'zip':
+        with zipfile.ZipFile(file_path) as archive, archive.open(member) as stream:
+            yield stream
+    elif kind == 'tar' or (kind in COMPRESSED_OPENERS and is_compressed_tar(file_path, kind)):
+        with tarfile.open(file_path, 'r:*') as archive:
+            stream = archive.extractfile(member)
+            if stream is None:
+                raise ValueError(f"不是普通文件: {label}")
+            yield stream
+    elif kind in COMPRESSED_OPENERS:
+        with COMPRESSED_OPENERS[kind](file_path, 'rb') as stream:
+            yield stream
+    else:
+        raise ValueError(f"不是压缩包: {file_path}")
+
+def copy_member_range(stream, out_file, pos: int, length: int, buffer_size: int = 1024 * 1024) -> None:
+    # 解压流一般不能 seek, 向前读取并丢弃 pos 之前的数据
+    while pos > 0:
+        skipped = stream.read(min(buffer_size, pos))
+        if not skipped:
+            return
+        pos -= len(skipped)
+    while length > 0:
+        piece = stream.read(min(buffer_size, length))
+        if not piece:
+            break
+        out_file.write(piece)
+        length -= len(piece)
@@ -0,0 +1,132 @@
+import cProfile
+import json
+import pstats
+import sys
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+class RunStats:
+    # 计数器与计时器; 工作进程各自累计, 通过 to_dict/merge 汇总到主进程
+    def __init__(self):
+        self.counters = Counter()
+        self.rejections = Counter()
+        self.timers = defaultdict(float)
+        self.files = []
+
+    def add_file(self, file_path: str, size: int, seconds: float, hits: int) -> None:
+        self.files.append({
+            'path': file_path,
+            'bytes': size,
+            'seconds': seconds,
+            'mb_per_s': size / (1024 * 1024) / seconds if seconds else 0.0,
+            'hits': hits,
+        })
+
+    def merge(self, other: Dict) -> None:
+        self.counters.update(other.get('counters', {}))
+        self.rejections.update(other.get('rejections', {}))
+        for name, seconds in other.get('timers', {}).items():
+            self.timers[name] += seconds
+        self.files.extend(other.get('files', []))
+
+    def to_dict(self) -> Dict:
+        return {
+            'counters': dict(self.counters),
+            'rejections': dict(self.rejections),
+            'timers': dict(self.timers),
+            'files': self.files,
+        }
+
+# 当前进程的统计对象, 各格式的解析函数直接向其报告拒绝原因
+CURRENT = RunStats()
+
+def reject(fmt: str, reason: str) -> None:
+    CURRENT.rejections[f"{fmt}.{reason}"] += 1
+
+@contextmanager
+def collect():
+    # 为单个任务收集统计, 结束后恢复之前的统计对象
+    global CURRENT
+    previous = CURRENT
+    CURRENT = RunStats()
+    try:
+        yield CURRENT
+    finally:
+        CURRENT = previous
+
+class ProgressReporter:
+    # 限频的单行进度: 已处理文件数、字节数、速率与预计剩余时间
+    def __init__(self, total_files: int, total_bytes: int, interval: float = 1.0, stream=None):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.files_done = 0
+        self.bytes_done = 0
+        self.hits = 0
+        self.start = time.perf_counter()
+        self._last_print = 0.0
+        self._printed_files = -1
+
+    def update(self, size: int, hits: int) -> None:
+        self.files_done += 1
+        self.bytes_done += size
+        self.hits += hits
+
+        now = time.perf_counter()
+        if now - self._last_print >= self.interval or self.files_done == self.total_files:
+            self._last_print = now
+            self._print(now)
+
+    def _print(self, now: float) -> None:
+        self._printed_files = self.files_done
+        elapsed = now - self.start
+        rate = self.bytes_done / elapsed if elapsed else 0.0
+        remaining = self.total_bytes - self.bytes_done
+        eta = remaining / rate if rate else 0.0
+        self.stream.write(
+            f"\r[{self.files_done}/{self.total_files}] "
+            f"{self.bytes_done / (1024 * 1024):.1f}/{self.total_bytes / (1024 * 1024):.1f} MB "
+            f"{rate / (1024 * 1024):.1f} MB/s 命中 {self.hits} 剩余 {eta:.0f} 秒   ")
+        self.stream.flush()
+
+    def finish(self) -> None:
+        if self._printed_files != self.files_done:
+            self._print(time.perf_counter())
+        self.stream.write('\n')
+        self.stream.flush()
+
+def write_stats(stats: RunStats, stats_path: str, elapsed: float) -> None:
+    report = stats.to_dict()
+    report['elapsed'] = elapsed
+    bytes_read = stats.counters.get('bytes_read', 0)
+    report['mb_per_s'] = bytes_read / (1024 * 1024) / elapsed if elapsed else 0.0
+    with open(stats_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+@contextmanager
+def profiled(profile_path: Optional[str] = None, trace_memory: bool = False, top: int = 15):
+    # 可选: 用 cProfile 包裹整个运行并保存结果, 或用 tracemalloc 报告内存分配热点.
+    # 注意只统计主进程, 分析扫描内核时请使用 -j 1.
+    profiler = cProfile.Profile() if profile_path else None
+    if trace_memory:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(top)
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            sys.stderr.write(f"tracemalloc: 当前 {current / 1024:.0f} KB, 峰值 {peak / 1024:.0f} KB\n")
+            for stat in snapshot.statistics('lineno')[:top]:
+                sys.stderr.write(f"  {stat}\n")
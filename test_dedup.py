@@ -0,0 +1,66 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from dedup import DedupIndex, new_run_id
+
+def claim_all(output_dir, payloads):
+    index = DedupIndex(output_dir)
+    try:
+        results = []
+        for name, data in payloads:
+            output_path = os.path.join(output_dir, name)
+            original_path = index.claim(data, 0, len(data), output_path)
+            if original_path is None:
+                with open(output_path, 'wb') as f:
+                    f.write(data)
+            results.append(original_path)
+        return results
+    finally:
+        index.close()
+
+def claim_queued(output_dir, run_id, name, data):
+    # 在工作进程中认领但不写出, 模拟图像还在写队列中
+    index = DedupIndex(output_dir, run_id)
+    try:
+        return index.claim(data, 0, len(data), os.path.join(output_dir, name))
+    finally:
+        index.close()
+
+def claim_in_workers(output_dir, run_id, names, data):
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(claim_queued, output_dir, run_id, name, data) for name in names]
+        return [future.result() for future in futures]
+
+def test_duplicate_within_run(tmp_path):
+    output_dir = str(tmp_path)
+    results = claim_all(output_dir, [('a.png', b'image'), ('b.png', b'image'), ('c.png', b'other')])
+    assert results == [None, os.path.join(output_dir, 'a.png'), None]
+
+def test_rerun_claims_own_output(tmp_path):
+    output_dir = str(tmp_path)
+    payloads = [('a.png', b'image'), ('b.png', b'image')]
+    claim_all(output_dir, payloads)
+    # 再次运行时同一个输出不是自己的副本
+    assert claim_all(output_dir, payloads) == [None, os.path.join(output_dir, 'a.png')]
+
+def test_rerun_rewrites_deleted_original(tmp_path):
+    output_dir = str(tmp_path)
+    claim_all(output_dir, [('a.png', b'image')])
+    os.remove(os.path.join(output_dir, 'a.png'))
+    assert claim_all(output_dir, [('b.png', b'image')]) == [None]
+    assert claim_all(output_dir, [('c.png', b'image')]) == [os.path.join(output_dir, 'b.png')]
+
+def test_workers_share_run(tmp_path):
+    output_dir = str(tmp_path)
+    names = [f"{i}.png" for i in range(8)]
+    results = claim_in_workers(output_dir, new_run_id(), names, b'image')
+    # 同一次运行中只有一个工作进程写出, 即使它的输出还没有落盘
+    assert results.count(None) == 1
+    original_path = os.path.join(output_dir, names[results.index(None)])
+    assert all(result in (None, original_path) for result in results)
+
+    with open(original_path, 'wb') as f:
+        f.write(b'image')
+    rerun = claim_in_workers(output_dir, new_run_id(), names, b'image')
+    assert rerun == [None if os.path.join(output_dir, name) == original_path else original_path
+                     for name in names]
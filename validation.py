@@ -0,0 +1,9 @@
+# 校验级别: fast 只检查签名与头部, 用于可信的数据源;
+# structural 逐块/逐段遍历整个结构 (默认); strict 另外检查 CRC、标记顺序与各字段的一致性,
+# 用于来源不可信、误报代价高的数据
+FAST = 'fast'
+STRUCTURAL = 'structural'
+STRICT = 'strict'
+
+LEVELS = (FAST, STRUCTURAL, STRICT)
+DEFAULT_LEVEL = STRUCTURAL
@@ -1,43 +1,212 @@
 import os
+import re
 import struct
+from typing import Iterator, Tuple
 
-def extract_webp_data(file_content):
-    riff_header = b'\x52\x49\x46\x46'
-    webp_header = b'\x57\x45\x42\x50\x56\x50\x38'
-
-    webp_data_start = file_content.find(riff_header)
-    while webp_data_start != -1:
-        file_size = struct.unpack('<I', file_content[webp_data_start + 4:webp_data_start + 8])[0]
-        # 确保file_size是4字节对齐
-        file_size = (file_size + 1) & ~1
-        if file_content[webp_data_start + 8:webp_data_start + 15] == webp_header:
-            webp_data = file_content[webp_data_start:webp_data_start + file_size + 8]
-            yield webp_data
-        webp_data_start = file_content.find(riff_header, webp_data_start + file_size + 8)
-
-def extract_webps_from_file(file_path):
-    with open(file_path, 'rb') as file:
-        file_content = file.read()
+import stats
+from discovery import DiscoveryOptions, discover_files
+from parallel import run_files
+from scanio import copy_range
+from sinks import output_name, output_stem
+from validation import FAST, STRICT, STRUCTURAL
 
-    webp_data_generator = extract_webp_data(file_content)
-    count = 0
-    for webp_data in webp_data_generator:
-        base_filename, _ = os.path.splitext(os.path.basename(file_path))
-        extracted_filename = f"{base_filename}_{count}.webp"
-        extracted_path = os.path.join(os.path.dirname(file_path), extracted_filename)
-        os.makedirs(os.path.dirname(extracted_path), exist_ok=True)
-        with open(extracted_path, 'wb') as output_file:
-            output_file.write(webp_data)
-        print(f"Extracted content saved as: {extracted_path}")
-        count += 1
-
-def extract_webps(directory_path):
-    for root, dirs, files in os.walk(directory_path):
-        for file in files:
-            if file.endswith(('.py', '.webp')):
+RIFF_HEADER = b'\x52\x49\x46\x46'
+WEBP_HEADER = b'\x57\x45\x42\x50\x56\x50\x38'
+WEBP_SIGNATURE = re.compile(re.escape(RIFF_HEADER) + b'.{4}' + re.escape(WEBP_HEADER), re.DOTALL)
+WEBP_SIGNATURE_LENGTH = 15
+
+VP8_START_CODE = b'\x9d\x01\x2a'
+VP8L_SIGNATURE = 0x2F
+VP8X_ANIMATION = 0x02
+DEFAULT_MAX_WEBP_SIZE = 256 * 1024 * 1024
+DEFAULT_WINDOW_SIZE = 1024 * 1024
+
+def is_fourcc(chunk_type: bytes) -> bool:
+    # 块类型必须是4个可打印ASCII字符
+    return all(0x20 <= c < 0x7F for c in chunk_type)
+
+def vp8_is_valid(frame: bytes) -> bool:
+    # 帧标签: 必须是关键帧 (位0为0)、版本不超过3、show_frame 为1; 之后是14位的宽和高
+    tag = frame[0] | frame[1] << 8 | frame[2] << 16
+    width, height = struct.unpack_from('<HH', frame, 6)
+    return bool(not tag & 1 and (tag >> 1) & 7 <= 3 and tag >> 4 & 1 and
+                width & 0x3FFF and height & 0x3FFF)
+
+def vp8l_is_valid(header: bytes) -> bool:
+    # 签名之后: 宽-1 (14位), 高-1 (14位), alpha (1位), 版本 (3位, 必须为0)
+    bits = struct.unpack_from('<I', header, 1)[0]
+    return bits >> 29 == 0
+
+def vp8x_is_valid(header: bytes, length: int) -> bool:
+    # 标志字节的最高两位和最低位、以及之后的3个字节为保留位, 必须为0; 画布宽高之积不超过 2^32-1
+    width = int.from_bytes(header[4:7], 'little') + 1
+    height = int.from_bytes(header[7:10], 'little') + 1
+    return (length == 10 and not header[0] & 0xC1 and header[1:4] == b'\x00\x00\x00' and
+            width * height < 1 << 32)
+
+def walk_webp(read, pos: int, limit: int, max_size: int = DEFAULT_MAX_WEBP_SIZE,
+              level: str = STRUCTURAL) -> int:
+    # 逐块校验 RIFF/WEBP 结构, 并要求块的总长度与 RIFF 头声明的大小一致.
+    # read(offset, size) 返回数据中的一段字节, 只读取块头和必要的几个字节, limit 为数据末尾.
+    # fast 只检查 RIFF 头并信任其中的大小; strict 另外检查各图像块的帧头, 且不容忍末尾缺少填充字节
+    header = read(pos, 12)
+    if len(header) < 12 or header[:4] != RIFF_HEADER or header[8:12] != WEBP_HEADER[:4]:
+        stats.reject('webp', 'not_webp')
+        return 0
+
+    riff_size = struct.unpack_from('<I', header, 4)[0]
+    end = pos + 8 + riff_size
+    if riff_size < 12:
+        stats.reject('webp', 'size_mismatch')
+        return 0
+    if 8 + riff_size > max_size:
+        stats.reject('webp', 'size_cap')
+        return 0
+    if end > limit:
+        stats.reject('webp', 'size_overrun')
+        return 0
+    if level == FAST:
+        return end - pos
+
+    strict = level == STRICT
+    offset = pos + 12
+    extended = False
+    animated = False
+    has_image = False
+    has_anim = False
+    frames = 0
+
+    while offset < end:
+        if offset + 8 > end:
+            stats.reject('webp', 'size_mismatch')
+            return 0
+        chunk_type, length = struct.unpack('<4sI', read(offset, 8))
+        if not is_fourcc(chunk_type):
+            stats.reject('webp', 'bad_chunk')
+            return 0
+        if offset + 8 + length > end:
+            stats.reject('webp', 'size_mismatch')
+            return 0
+
+        if offset == pos + 12:
+            if chunk_type == b'VP8X':
+                if length < 10 or (strict and not vp8x_is_valid(read(offset + 8, 10), length)):
+                    stats.reject('webp', 'bad_vp8x')
+                    return 0
+                extended = True
+                animated = bool(read(offset + 8, 1)[0] & VP8X_ANIMATION)
+            elif chunk_type not in (b'VP8 ', b'VP8L'):
+                stats.reject('webp', 'bad_chunk')
+                return 0
+        elif not extended:
+            # 简单格式只有一个图像块, 声明的大小多出的部分不属于这个图像
+            stats.reject('webp', 'size_mismatch')
+            return 0
+
+        if chunk_type == b'VP8 ':
+            frame = read(offset + 8, 10)
+            if length < 10 or frame[3:6] != VP8_START_CODE or (strict and not vp8_is_valid(frame)):
+                stats.reject('webp', 'bad_vp8')
+                return 0
+            has_image = True
+        elif chunk_type == b'VP8L':
+            if length < 5 or read(offset + 8, 1)[0] != VP8L_SIGNATURE or \
+                    (strict and not vp8l_is_valid(read(offset + 8, 5))):
+                stats.reject('webp', 'bad_vp8l')
+                return 0
+            has_image = True
+        elif chunk_type == b'ANIM':
+            has_anim = True
+        elif chunk_type == b'ANMF':
+            if length < 16:
+                stats.reject('webp', 'bad_anmf')
+                return 0
+            frames += 1
+
+        # 块数据长度为奇数时补1字节
+        offset += 8 + length + (length & 1)
+
+    if (animated and not (has_anim and frames)) or (not animated and not has_image):
+        stats.reject('webp', 'no_image')
+        return 0
+    # RIFF 大小为奇数时, 末尾的填充字节可能没有计入
+    if strict and offset != end:
+        stats.reject('webp', 'size_mismatch')
+        return 0
+    if offset > limit:
+        stats.reject('webp', 'size_overrun')
+        return 0
+    return offset - pos
+
+def webp_length(data, pos: int, max_size: int = DEFAULT_MAX_WEBP_SIZE, level: str = STRUCTURAL) -> int:
+    return walk_webp(lambda offset, size: data[offset:offset + size], pos, len(data), max_size, level)
+
+def webp_stream_length(file, pos: int, file_size: int, max_size: int = DEFAULT_MAX_WEBP_SIZE) -> int:
+    # 与 webp_length 相同, 但在文件流上按需 seek 读取
+    def read(offset, size):
+        file.seek(offset)
+        return file.read(size)
+    return walk_webp(read, pos, file_size, max_size)
+
+def iter_webps(file, window_size: int = DEFAULT_WINDOW_SIZE,
+               max_size: int = DEFAULT_MAX_WEBP_SIZE) -> Iterator[Tuple[int, int]]:
+    # 按窗口读取并搜索签名, 产生 (偏移, 长度); 内存占用由窗口大小决定, 与文件大小无关.
+    # 校验失败时从下一个字节继续搜索, 不信任 RIFF 头中的大小
+    file.seek(0, os.SEEK_END)
+    file_size = file.tell()
+    window_start = 0
+
+    while window_start < file_size:
+        file.seek(window_start)
+        window = file.read(window_size)
+        at_end = window_start + len(window) >= file_size
+        # 签名可能跨越窗口边界, 未到文件末尾时最后几个字节留给下一个窗口
+        search_end = len(window) if at_end else len(window) - WEBP_SIGNATURE_LENGTH + 1
+        next_start = window_start + max(1, search_end)
+
+        match = WEBP_SIGNATURE.search(window, 0)
+        while match is not None and match.start() < search_end:
+            webp_start = window_start + match.start()
+            webp_size = webp_stream_length(file, webp_start, file_size, max_size)
+            if not webp_size:
+                match = WEBP_SIGNATURE.search(window, match.start() + 1)
                 continue
-            file_path = os.path.join(root, file)
-            extract_webps_from_file(file_path)
+
+            yield webp_start, webp_size
+            resume = webp_start + webp_size
+            if resume >= window_start + search_end:
+                next_start = resume
+                break
+            match = WEBP_SIGNATURE.search(window, resume - window_start)
+
+        window_start = next_start
+
+def extract_webps_from_file(file_path, output_dir):
+    stem = output_stem(file_path)
+    count = 0
+    with open(file_path, 'rb') as file:
+        for webp_start, webp_size in iter_webps(file):
+            extracted_filename = output_name(stem, webp_start, 'webp')
+            extracted_path = os.path.join(output_dir, extracted_filename)
+            os.makedirs(output_dir, exist_ok=True)
+            with open(extracted_path, 'wb') as output_file:
+                copy_range(file, output_file, webp_start, webp_size)
+            print(f"Extracted content saved as: {extracted_path}")
+            count += 1
+    return count
+
+def extract_webps(directory_path, output_dir=None, max_workers=None):
+    # 输出到单独的目录, 并且不扫描这个目录, 重复运行不会再次读取提取出的文件
+    output_dir = output_dir or os.path.join(directory_path, "extracted_webp")
+    entries = discover_files(directory_path, DiscoveryOptions(exclude=('*.py', '*.webp')),
+                             exclude_paths=[output_dir])
+    file_paths = [entry.path for entry in entries]
+    sizes = {entry.path: entry.size for entry in entries}
+
+    for file_path, _, error in run_files(extract_webps_from_file, file_paths, output_dir,
+                                         max_workers=max_workers, sizes=sizes):
+        if error is not None:
+            print(f"处理文件 {file_path} 时出错: {str(error)}")
 
 def main():
     directory_path = input("请输入要处理的文件夹路径: ")
@@ -46,7 +215,7 @@ def main():
         return
 
     extract_webps(directory_path)
-    print("WebP 文件提取完成。")
+    print(f"WebP 文件提取完成, 保存在: {os.path.join(directory_path, 'extracted_webp')}")
 
 if __name__ == "__main__":
     main()